@@ -0,0 +1,310 @@
+"""
+Benchmarks quickbooks2 against fake_qbo.FakeQBO, so performance regressions show up before an upgrade rather than
+after it, and without an Intuit sandbox.
+
+    python benchmarks/bench.py                              # every scenario
+    python benchmarks/bench.py fetch crud --scale 0.1       # some of them, with less data
+    python benchmarks/bench.py --latency 0.05 --throttle-rate 0.02 --fault-rate 0.01
+    python benchmarks/bench.py --save before.json
+    python benchmarks/bench.py --compare before.json        # exits with 1 if anything got worse by --tolerance
+
+For each scenario it reports throughput, the p50/p99 latency of the API requests it made, how far its peak RSS rose
+above where it started, and how many requests were retried, throttled or failed outright.
+The fake server runs in a process of its own and so does each scenario, so neither's memory shows up in another's.
+"""
+import argparse, collections, json, logging, multiprocessing, os, resource, shutil, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import quickbooks2
+from fake_qbo import FakeQBO
+
+REALM = "1234567890"
+
+# at scale 1
+SIZES = {"customers": 20000, "items": 2000, "accounts": 200, "invoices": 5000, "crud": 300, "batch": 1500,
+         "files": 20, "file_size": 1024 * 1024, "report_months": 24}
+
+SCENARIOS = collections.OrderedDict()
+
+
+def scenario(units):
+    """
+    Registers a benchmark: fn(qb, sizes, workdir) does the work and returns how many `units` it got through
+    """
+    def register(fn):
+        SCENARIOS[fn.__name__] = (fn, units)
+        return fn
+    return register
+
+
+#-----------------------------------------------------------------------------------------------------------------------
+@scenario("records")
+def fetch(qb, sizes, workdir):
+    return len(qb._fetch("POST", "Customer", "SELECT * FROM Customer"))
+
+
+@scenario("records")
+def fetch_parallel(qb, sizes, workdir):
+    return len(qb.query_objects("Customer", workers=4))
+
+
+@scenario("records")
+def fetch_projected(qb, sizes, workdir):
+    return len(qb.query_objects("Customer", fields=["Id", "SyncToken", "DisplayName"]))
+
+
+@scenario("records")
+def object_dicts(qb, sizes, workdir):
+    dicts = qb.object_dicts(["Customer", "Item", "Account", "Invoice"], requery=True, workers=4)
+    return sum(len(objects) for objects in dicts.itervalues())
+
+
+@scenario("operations")
+def crud(qb, sizes, workdir):
+    done = 0
+    for i in range(sizes["crud"]):
+        created = qb.create_object("Customer", {"DisplayName": "Bench customer %d" % i,
+                                                "PrimaryEmailAddr": {"Address": "bench%d@example.com" % i}})
+        created["Notes"] = "Updated by the benchmark"
+        qb.update_object("Customer", created["Id"], created)
+        done += 2
+    return done
+
+
+@scenario("operations")
+def batch(qb, sizes, workdir):
+    results = qb.create_objects("Item", [{"Name": "Bench item %d" % i, "Type": "Service",
+                                          "IncomeAccountRef": {"value": "1"}} for i in range(sizes["batch"])])
+    return len([result for result in results if "Fault" not in result])
+
+
+@scenario("reports")
+def sharded_report(qb, sizes, workdir):
+    qb.report_cache = None
+    end_year, end_month = 2025 + sizes["report_months"] // 12, sizes["report_months"] % 12 or 12
+    report = qb.get_report("ProfitAndLoss", {"start_date": "2026-01-01",
+                                             "end_date": "%d-%02d-28" % (end_year, end_month)}, shard="month")
+    if "Fault" in report:
+        raise Exception("Report failed: %s" % report["Fault"])
+    return sizes["report_months"]
+
+
+@scenario("MB")
+def upload_file(qb, sizes, workdir):
+    path = os.path.join(workdir, "upload.pdf")
+    with open(path, "wb") as f:
+        f.write("%PDF-1.4 benchmark upload " * (sizes["file_size"] // 26 + 1))
+
+    for i in range(sizes["files"]):
+        qb.upload_file(path, name="upload-%d.pdf" % i)
+
+    return sizes["files"] * os.path.getsize(path) / 1048576.0
+
+
+@scenario("MB")
+def download_file(qb, sizes, workdir):
+    ids = [obj["Id"] for obj in qb.query_objects("Attachable", fields=["Id"])]
+    for Id in ids:
+        qb.download_file(Id, workdir + os.sep)
+    return sum(os.path.getsize(os.path.join(workdir, name)) for name in os.listdir(workdir)) / 1048576.0
+
+
+@scenario("MB")
+def download_files(qb, sizes, workdir):
+    ids = [obj["Id"] for obj in qb.query_objects("Attachable", fields=["Id"])]
+    results = qb.download_files(ids, workdir + os.sep, workers=4)
+    return sum(os.path.getsize(path) for path in results.itervalues() if isinstance(path, basestring)) / 1048576.0
+
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _serve(options, sizes, ready):
+    server = FakeQBO(latency=options.latency, throttle_rate=options.throttle_rate, fault_rate=options.fault_rate,
+                     retry_after=options.retry_after)
+    server.populate(customers=sizes["customers"], items=sizes["items"], accounts=sizes["accounts"],
+                    invoices=sizes["invoices"], attachments=sizes["files"], attachment_size=sizes["file_size"])
+    ready.put(server.start())
+
+    while True:
+        time.sleep(3600)
+
+
+def _rss_mb():
+    """
+    The current resident set size, from /proc where there is one (and the peak so far where there isn't)
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1048576.0
+    except IOError:
+        return _peak_mb()
+
+
+def _peak_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1048576.0 if sys.platform == "darwin" else peak / 1024.0
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def _run(name, url, options, sizes, results):
+    fn, units = SCENARIOS[name]
+
+    limiter = quickbooks2.RateLimiter.for_realm(REALM)
+    limiter.max_rate = limiter.rate = options.rate
+
+    latencies = []
+    metrics = quickbooks2.Metrics()
+    qb = quickbooks2.QuickBooks(consumer_key="bench", consumer_secret="bench", access_token="bench",
+                                access_token_secret="bench", company_id=REALM, base_url=url, metrics=metrics,
+                                post_request_hooks=[lambda event: latencies.append(event["elapsed"])],
+                                typed_entities=options.typed_entities, sparse_updates=options.sparse_updates)
+    qb.backoff_base = options.backoff_base
+
+    workdir = tempfile.mkdtemp(prefix="qbo-bench-")
+    baseline = _rss_mb()
+    started = time.time()
+
+    try:
+        done = fn(qb, sizes, workdir)
+        error = None
+    except Exception as e:
+        done, error = 0, "%s: %s" % (e.__class__.__name__, e)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    elapsed = time.time() - started
+
+    results.put({"scenario": name, "units": units, "done": done, "seconds": elapsed,
+                 "throughput": done / elapsed if elapsed else None, "requests": len(latencies),
+                 "p50_ms": (_percentile(latencies, 0.5) or 0) * 1000,
+                 "p99_ms": (_percentile(latencies, 0.99) or 0) * 1000,
+                 "peak_mb": max(0.0, _peak_mb() - baseline), "retries": metrics.counter("qbo_retries_total"),
+                 "throttled": metrics.counter("qbo_throttled_total"),
+                 "failed": metrics.counter("qbo_errors_total") +
+                 sum(metrics.counter("qbo_requests_total", status=str(status)) for status in (500, 502, 503, 504)),
+                 "error": error})
+
+
+def _print(results, baseline=None):
+    print "%-16s %10s %-11s %9s %9s %9s %9s %8s %7s %9s %7s" % (
+        "scenario", "throughput", "", "seconds", "requests", "p50 ms", "p99 ms", "peak MB", "retries", "throttled",
+        "failed")
+
+    for result in results:
+        if result["error"]:
+            print "%-16s FAILED: %s" % (result["scenario"], result["error"])
+            continue
+
+        line = "%-16s %10.1f %-11s %9.2f %9d %9.1f %9.1f %8.1f %7d %9d %7d" % (
+            result["scenario"], result["throughput"], result["units"] + "/s", result["seconds"], result["requests"],
+            result["p50_ms"], result["p99_ms"], result["peak_mb"], result["retries"], result["throttled"],
+            result["failed"])
+
+        before = (baseline or {}).get(result["scenario"])
+        if before and before.get("throughput"):
+            line += "   (%+.0f%% throughput)" % (100.0 * (result["throughput"] / before["throughput"] - 1))
+        print line
+
+
+def _regressions(results, baseline, tolerance):
+    """
+    [description] of every way these results are worse than the baseline's by more than tolerance (a fraction)
+    """
+    found = []
+    for result in results:
+        before = baseline.get(result["scenario"])
+        if not before or before.get("error"):
+            continue
+        if result["error"]:
+            found.append("%s failed: %s" % (result["scenario"], result["error"]))
+            continue
+
+        if before["throughput"] and result["throughput"] < before["throughput"] * (1 - tolerance):
+            found.append("%s throughput %.1f -> %.1f %s/s" % (result["scenario"], before["throughput"],
+                                                              result["throughput"], result["units"]))
+        for key in ("p99_ms", "peak_mb"):
+            # ignore noise in very small numbers
+            if before[key] > 1 and result[key] > before[key] * (1 + tolerance):
+                found.append("%s %s %.1f -> %.1f" % (result["scenario"], key, before[key], result[key]))
+
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark quickbooks2 against a local fake QBO server.")
+    parser.add_argument("scenarios", nargs="*", metavar="scenario",
+                        help="which to run (default: all of %s)" % ", ".join(SCENARIOS))
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the amount of data (default 1)")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the server adds to each request")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--fault-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--retry-after", type=float, default=0.2, help="Retry-After of the server's 429s")
+    parser.add_argument("--backoff-base", type=float, default=0.05, help="the client's backoff_base")
+    parser.add_argument("--rate", type=float, default=1000.0,
+                        help="requests a second the realm's RateLimiter allows (QBO's own limit is about 8)")
+    parser.add_argument("--typed-entities", action="store_true", help="run with QuickBooks(typed_entities=True)")
+    parser.add_argument("--sparse-updates", action="store_true", help="run with QuickBooks(sparse_updates=True)")
+    parser.add_argument("--save", metavar="PATH", help="write the results here, as JSON")
+    parser.add_argument("--compare", metavar="PATH", help="compare with results saved earlier")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="how much worse than --compare's results counts as a regression (default 0.2)")
+    options = parser.parse_args(argv)
+
+    # the retries the fault injection causes would otherwise be logged all over the results
+    logging.basicConfig(level=logging.ERROR)
+
+    names = options.scenarios or list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error("unknown scenario(s) %s" % ", ".join(unknown))
+
+    sizes = dict((key, max(1, int(value * options.scale))) if key not in ("file_size", "report_months") else
+                 (key, value) for key, value in SIZES.iteritems())
+
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_serve, args=(options, sizes, ready))
+    server.daemon = True
+    server.start()
+
+    results = []
+    try:
+        url = ready.get(timeout=600)
+
+        for name in names:
+            queue = multiprocessing.Queue()
+            child = multiprocessing.Process(target=_run, args=(name, url, options, sizes, queue))
+            child.start()
+            results.append(queue.get())
+            child.join()
+    finally:
+        server.terminate()
+
+    baseline = None
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = dict((result["scenario"], result) for result in json.load(f)["results"])
+
+    _print(results, baseline)
+
+    if options.save:
+        with open(options.save, "w") as f:
+            json.dump({"options": vars(options), "sizes": sizes, "results": results}, f, indent=1)
+
+    if baseline:
+        regressions = _regressions(results, baseline, options.tolerance)
+        for regression in regressions:
+            print "REGRESSION: " + regression
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,601 @@
+"""
+An in-process stand-in for the QBO v3 API, so quickbooks2 can be exercised (and benchmarked, see bench.py) without
+an Intuit sandbox.
+
+    server = FakeQBO(latency=0.05, throttle_rate=0.01, fault_rate=0.01)
+    server.populate(customers=20000, items=2000, attachments=10)
+    qb = QuickBooks(consumer_key="x", consumer_secret="x", access_token="x", access_token_secret="x",
+                    company_id="1", base_url=server.start())
+
+It answers queries (projection, simple WHERE clauses, COUNT(*), STARTPOSITION/MAXRESULTS), reads, creates, updates
+(full and sparse, with SyncToken checks) and deletes, batches, CDC, reports, uploads and downloads (with Range
+requests), in JSON or, when that's what's asked for, in XML. latency is added to every request; throttle_rate and
+fault_rate are the chances of a request being answered with a 429 (and Retry-After: retry_after) or a 500 instead.
+Whatever's put in canned is what the next requests get, one each: (status, content type, body), or None to hang up
+without answering. Deleted objects are remembered, so CDC reports them.
+Anything the OAuth signature says is ignored, as are realms: there's one company, whatever the URL's realm.
+"""
+import BaseHTTPServer, SocketServer, cgi, datetime, io, json, random, re, threading, time, urlparse
+import xml.etree.ElementTree as ET
+
+ENTITIES = ["Account", "Attachable", "Bill", "Class", "Customer", "Department", "Employee", "Invoice", "Item",
+            "PaymentMethod", "TaxCode", "TaxRate", "Term", "Vendor"]
+
+# what QBO's XML has as attributes rather than elements
+XML_ATTRIBUTES = frozenset(["startPosition", "maxResults", "totalCount", "time", "type", "group", "code", "element",
+                            "domain", "sparse", "status", "bId"])
+
+# the QBO message for an update whose SyncToken isn't the current one
+STALE_OBJECT = {"Message": "Stale Object Error", "Detail": "Stale Object Error : You and another user were working "
+                "on the same thing. Please try again.", "code": "5010"}
+
+
+class FakeQBO(object):
+
+    def __init__(self, latency=0.0, throttle_rate=0.0, fault_rate=0.0, retry_after=1, seed=0):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.fault_rate = fault_rate
+        self.retry_after = retry_after
+
+        self.url = None
+        self.data = dict((entity, {}) for entity in ENTITIES)  # {entity: {Id: object}}, in insertion order
+        self.order = dict((entity, []) for entity in ENTITIES)  # {entity: [Id]}
+        self.files = {}  # {Attachable Id: bytes}
+        self.deleted = dict((entity, {}) for entity in ENTITIES)  # {entity: {Id: what CDC says about it}}
+        self.canned = []  # [(status, content type, body) or None], answers for the next requests
+
+        # what's been asked for: {"query": n, "read": n, ...}, plus "throttled" and "faults"
+        self.counts = {}
+
+        self._next_id = 1
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._server = None
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def start(self, host="127.0.0.1", port=0):
+        """
+        Serves on a background thread; returns the base_url to give QuickBooks
+        """
+        self._server = _Server((host, port), _Handler)
+        self._server.fake = self
+
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.url = "http://%s:%d/v3" % self._server.server_address
+        return self.url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def populate(self, customers=0, items=0, accounts=0, invoices=0, attachments=0, attachment_size=1024 * 1024):
+        """
+        Adds this many made-up objects of each type, about as big as real ones
+        """
+        for i in range(accounts):
+            self.add("Account", _account(i))
+        for i in range(items):
+            self.add("Item", _item(i))
+        for i in range(customers):
+            self.add("Customer", _customer(i))
+        for i in range(invoices):
+            self.add("Invoice", _invoice(i, customers, self._random))
+        for i in range(attachments):
+            attachable = self.add("Attachable", {"FileName": "attachment-%d.pdf" % i, "ContentType": "application/pdf",
+                                                 "Size": attachment_size})
+            self.files[attachable["Id"]] = _file_bytes(attachable["Id"], attachment_size)
+
+    def add(self, entity, obj):
+        with self._lock:
+            obj = dict(obj)
+            obj.setdefault("Id", str(self._next_id))
+            self._next_id = max(self._next_id, int(obj["Id"])) + 1
+            obj["SyncToken"] = obj.get("SyncToken", "0")
+            obj["domain"], obj["sparse"] = "QBO", False
+            obj["MetaData"] = {"CreateTime": _now(), "LastUpdatedTime": _now()}
+
+            if obj["Id"] not in self.data[entity]:
+                self.order[entity].append(obj["Id"])
+            self.data[entity][obj["Id"]] = obj
+            return obj
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def query(self, statement):
+        match = re.match(r"\s*SELECT\s+(.+?)\s+FROM\s+(\w+)(.*)$", statement, re.I | re.S)
+        if not match:
+            return 400, _fault("ValidationFault", "QueryParserError: Encountered bad query")
+
+        projection, entity, rest = match.group(1).strip(), match.group(2), match.group(3)
+        if entity not in self.data:
+            return 400, _fault("ValidationFault", "QueryValidationError: Property %s not found" % entity)
+
+        paging = dict((key.upper(), int(value)) for key, value in
+                      re.findall(r"\b(STARTPOSITION|MAXRESULTS)\s+(\d+)", rest, re.I))
+        rest = re.sub(r"\b(STARTPOSITION|MAXRESULTS)\s+\d+", "", rest, flags=re.I)
+
+        ordering = re.search(r"\bORDERBY\s+(.+)$", rest, re.I | re.S)
+        if ordering:
+            rest = rest[:ordering.start()]
+
+        where = re.search(r"\bWHERE\s+(.+)$", rest, re.I | re.S)
+        conditions = _conditions(where.group(1)) if where else []
+
+        with self._lock:
+            rows = [self.data[entity][Id] for Id in self.order[entity] if Id in self.data[entity]]
+
+        rows = [row for row in rows if all(_matches(row, condition) for condition in conditions)]
+
+        if ordering:
+            for clause in reversed(ordering.group(1).split(",")):
+                parts = clause.split()
+                rows.sort(key=lambda row: _value(row, parts[0]), reverse=len(parts) > 1 and parts[1].upper() == "DESC")
+
+        if projection.upper() == "COUNT(*)":
+            return 200, {"QueryResponse": {"totalCount": len(rows)}, "time": _now()}
+
+        start = paging.get("STARTPOSITION", 1)
+        page = rows[start - 1:start - 1 + min(paging.get("MAXRESULTS", 100), 1000)]
+
+        if projection != "*":
+            fields = [field.strip() for field in projection.split(",")]
+            page = [dict((field, row[field]) for field in fields if field in row) for row in page]
+
+        if entity == "Attachable":
+            page = [dict(row, TempDownloadUri=self._link(row)) if "Id" in row else row for row in page]
+
+        response = {"startPosition": start, "maxResults": len(page)}
+        if page:
+            response[entity] = page
+
+        return 200, {"QueryResponse": response, "time": _now()}
+
+    def _link(self, attachable):
+        return "%s/files/%s/./%s?signature=%08x" % (self.url.rsplit("/v3", 1)[0], attachable["Id"],
+                                                    attachable.get("FileName", "file"), self._random.getrandbits(32))
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def write(self, entity, obj, operation=None):
+        """
+        create, update (sparse or not) or delete; returns (status, response body)
+        """
+        with self._lock:
+            if operation == "delete":
+                if obj.get("Id") not in self.data[entity]:
+                    return 400, _fault("ValidationFault", "Object Not Found")
+                del self.data[entity][obj["Id"]]
+                self.deleted[entity][obj["Id"]] = {"Id": obj["Id"], "status": "Deleted", "domain": "QBO",
+                                                   "MetaData": {"LastUpdatedTime": _now()}}
+                return 200, {entity: {"Id": obj["Id"], "status": "Deleted", "domain": "QBO"}, "time": _now()}
+
+            if "Id" not in obj:
+                return 200, {entity: self.add(entity, obj), "time": _now()}
+
+            current = self.data[entity].get(obj["Id"])
+            if current is None:
+                return 400, _fault("ValidationFault", "Object Not Found")
+            if str(obj.get("SyncToken")) != current["SyncToken"]:
+                return 400, {"Fault": {"Error": [STALE_OBJECT], "type": "ValidationFault"}, "time": _now()}
+
+            updated = dict(current) if obj.get("sparse") else {"Id": obj["Id"]}
+            updated.update(obj)
+            updated["SyncToken"] = str(int(current["SyncToken"]) + 1)
+            updated["sparse"] = False
+            updated["MetaData"] = {"CreateTime": current["MetaData"]["CreateTime"], "LastUpdatedTime": _now()}
+            self.data[entity][obj["Id"]] = updated
+
+            return 200, {entity: updated, "time": _now()}
+
+    def changes(self, entities, changed_since):
+        response = []
+        for entity in entities:
+            with self._lock:
+                changed = [obj for obj in self.data.get(entity, {}).values() + self.deleted.get(entity, {}).values()
+                           if obj["MetaData"]["LastUpdatedTime"] > changed_since]
+            response.append({entity: changed})
+        return {"CDCResponse": [{"QueryResponse": response}], "time": _now()}
+
+    def report(self, name, params):
+        """
+        A ProfitAndLoss-shaped report of made-up amounts, as many rows as there are Accounts (at least 20)
+        """
+        start = params.get("start_date", ["2026-01-01"])[0]
+        end = params.get("end_date", ["2026-12-31"])[0]
+        days = (_date(end) - _date(start)).days + 1
+
+        with self._lock:
+            accounts = [self.data["Account"][Id] for Id in self.order["Account"] if Id in self.data["Account"]]
+        accounts = accounts or [_account(i) for i in range(20)]
+
+        sections = []
+        for group, members in (("Income", accounts[::2]), ("Expenses", accounts[1::2])):
+            rows = [{"ColData": [{"value": account["Name"], "id": account.get("Id", "")},
+                                 {"value": "%.2f" % (days * (7 + index % 13) * 1.5)}], "type": "Data"}
+                    for index, account in enumerate(members)]
+            total = sum(float(row["ColData"][1]["value"]) for row in rows)
+            sections.append({"Header": {"ColData": [{"value": group}, {"value": ""}]}, "Rows": {"Row": rows},
+                             "Summary": {"ColData": [{"value": "Total " + group}, {"value": "%.2f" % total}]},
+                             "type": "Section", "group": group})
+
+        net = float(sections[0]["Summary"]["ColData"][1]["value"]) - \
+            float(sections[1]["Summary"]["ColData"][1]["value"])
+        sections.append({"Summary": {"ColData": [{"value": "Net Income"}, {"value": "%.2f" % net}]},
+                         "type": "Section", "group": "NetIncome"})
+
+        return {"Header": {"Time": _now(), "ReportName": name, "StartPeriod": start, "EndPeriod": end,
+                           "Currency": "USD", "Option": [{"Name": "NoReportData", "Value": "false"}]},
+                "Columns": {"Column": [{"ColTitle": "", "ColType": "Account"},
+                                       {"ColTitle": "Total", "ColType": "Money"}]},
+                "Rows": {"Row": sections}}
+
+    def upload(self, content_type, body):
+        form = cgi.FieldStorage(io.BytesIO(body), environ={"REQUEST_METHOD": "POST", "CONTENT_TYPE": content_type,
+                                                           "CONTENT_LENGTH": str(len(body))})
+        responses = []
+        index = 0
+        while "file_content_%d" % index in form:
+            part = form["file_content_%d" % index]
+            metadata = {}
+            if "file_metadata_%d" % index in form:
+                metadata = json.loads(form["file_metadata_%d" % index].value)
+
+            attachable = self.add("Attachable", dict(metadata, FileName=metadata.get("FileName", part.filename),
+                                                     ContentType=part.type, Size=len(part.value)))
+            self.files[attachable["Id"]] = part.value
+            responses.append({"Attachable": attachable})
+            index += 1
+
+        return {"AttachableResponse": responses, "time": _now()}
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # one write per response rather than one per header line, and no Nagle delays between them
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json", headers=()):
+        if isinstance(body, unicode):
+            body = body.encode("utf-8")
+        elif not isinstance(body, str) and "xml" in (self.headers.get("Accept") or ""):
+            body, content_type = _xml(body), "application/xml"
+        elif not isinstance(body, str):
+            body = json.dumps(body)
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _injected(self):
+        """
+        Sleeps for the latency, then maybe answers with something canned, a throttle or a fault; True if it did
+        """
+        fake = self.server.fake
+
+        if fake.latency:
+            time.sleep(fake.latency)
+
+        with fake._lock:
+            canned = fake.canned.pop(0) if fake.canned else False
+        if canned is None:
+            fake._count("dropped")
+            self.close_connection = True
+            return True
+        if canned:
+            status, content_type, body = canned
+            self._send(status, body, content_type)
+            return True
+
+        roll = fake._random.random()
+        if roll < fake.throttle_rate:
+            fake._count("throttled")
+            self._send(429, _fault("ThrottleExceeded", "message=ThrottleExceeded; errorCode=003001"),
+                       headers=[("Retry-After", str(fake.retry_after))])
+            return True
+        if roll < fake.throttle_rate + fake.fault_rate:
+            fake._count("faults")
+            self._send(500, _fault("SystemFault", "An application error has occurred while processing your request"))
+            return True
+
+        return False
+
+    def do_GET(self):
+        fake = self.server.fake
+        url = urlparse.urlparse(self.path)
+        params = urlparse.parse_qs(url.query)
+
+        match = re.match(r"/files/(\w+)/", url.path)
+        if match:
+            fake._count("file")
+            return self._file(match.group(1))
+
+        if self._injected():
+            return
+
+        match = re.match(r"/v3/company/\w+/(\w+)(?:/(\w+))?$", url.path)
+        if not match:
+            return self._send(404, _fault("ValidationFault", "Unsupported operation"))
+
+        segment, rest = match.groups()
+        fake._count(segment if segment in ("cdc", "reports", "download", "query") else "read")
+
+        if segment == "query":
+            return self._send(*fake.query(params.get("query", [""])[0]))
+        if segment == "cdc":
+            return self._send(200, fake.changes(params["entities"][0].split(","), params["changedSince"][0]))
+        if segment == "reports":
+            return self._send(200, fake.report(rest, params))
+        if segment == "download":
+            attachable = fake.data["Attachable"].get(rest)
+            if attachable is None:
+                return self._send(400, _fault("ValidationFault", "Object Not Found"))
+            return self._send(200, fake._link(attachable), "text/plain")
+
+        entity = _entity(segment)
+        obj = fake.data.get(entity, {}).get(rest)
+        if obj is None:
+            return self._send(400, _fault("ValidationFault", "Object Not Found"))
+        return self._send(200, {entity: obj, "time": _now()})
+
+    def _file(self, Id):
+        data = self.server.fake.files.get(Id)
+        if data is None:
+            return self._send(404, "Not Found", "text/plain")
+
+        start = 0
+        match = re.match(r"bytes=(\d+)-", self.headers.get("Range") or "")
+        if match:
+            start = int(match.group(1))
+            if start >= len(data):
+                return self._send(416, "", "text/plain", [("Content-Range", "bytes */%d" % len(data))])
+
+        self.send_response(206 if start else 200)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(len(data) - start))
+        if start:
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, len(data) - 1, len(data)))
+        self.end_headers()
+
+        view = buffer(data, start)
+        for offset in xrange(0, len(view), 65536):
+            self.wfile.write(view[offset:offset + 65536])
+
+    def do_POST(self):
+        fake = self.server.fake
+        url = urlparse.urlparse(self.path)
+        params = urlparse.parse_qs(url.query)
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+        if self._injected():
+            return
+
+        match = re.match(r"/v3/company/\w+/(\w+)$", url.path)
+        if not match:
+            return self._send(404, _fault("ValidationFault", "Unsupported operation"))
+
+        segment = match.group(1)
+
+        if segment == "query":
+            fake._count("query")
+            return self._send(*fake.query(body))
+
+        if segment == "upload":
+            fake._count("upload")
+            return self._send(200, fake.upload(self.headers["Content-Type"], body))
+
+        if segment == "batch":
+            fake._count("batch")
+            items = []
+            for item in json.loads(body)["BatchItemRequest"]:
+                if "Query" in item:
+                    status, response = fake.query(item["Query"])
+                    items.append(dict(response, bId=item["bId"]))
+                    continue
+                entity = [key for key in item if key not in ("bId", "operation")][0]
+                status, response = fake.write(entity, item[entity], item["operation"])
+                response.pop("time", None)
+                items.append(dict(response, bId=item["bId"]))
+            return self._send(200, {"BatchItemResponse": items, "time": _now()})
+
+        entity = _entity(segment)
+        if entity is None:
+            return self._send(400, _fault("ValidationFault", "Unsupported entity %s" % segment))
+
+        operation = params.get("operation", [None])[0]
+        fake._count(operation or "write")
+        return self._send(*fake.write(entity, json.loads(body), operation))
+
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _entity(segment):
+    for entity in ENTITIES:
+        if entity.lower() == segment.lower():
+            return entity
+    return None
+
+
+def _now():
+    return datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "-07:00"
+
+
+def _date(value):
+    # (not strptime, which isn't safe to call from several threads at once in Python 2)
+    return datetime.date(*[int(part) for part in value[:10].split("-")])
+
+
+def _xml(document):
+    """
+    The XML QBO would have sent instead of this JSON response
+    """
+    root = ET.Element("IntuitResponse", xmlns="http://schema.intuit.com/finance/v3")
+    _xml_fill(root, document)
+    return ET.tostring(root, encoding="utf-8")
+
+
+def _xml_fill(element, fields):
+    # a reference ({"value": "1", "name": "Sales"}) is <ItemRef name="Sales">1</ItemRef>, ColData is all attributes
+    simple = "value" in fields and not any(isinstance(value, (dict, list)) for value in fields.itervalues())
+    reference = simple and element.tag.endswith("Ref")
+
+    for key, value in fields.iteritems():
+        if reference and key == "value":
+            element.text = _xml_text(value)
+        elif simple or (key in XML_ATTRIBUTES and not isinstance(value, (dict, list))):
+            element.set(key, _xml_text(value))
+        else:
+            for item in value if isinstance(value, list) else [value]:
+                child = ET.SubElement(element, key)
+                if isinstance(item, dict):
+                    _xml_fill(child, item)
+                elif item is not None:
+                    child.text = _xml_text(item)
+
+
+def _xml_text(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float):
+        return repr(value)
+    return unicode(value)
+
+
+def _fault(fault_type, detail):
+    return {"Fault": {"Error": [{"Message": detail, "Detail": detail}], "type": fault_type}, "time": _now()}
+
+
+def _literal(text):
+    text = text.strip()
+    if text.startswith("'"):
+        return re.sub(r"\\(.)", r"\1", text[1:-1])
+    if text.lower() in ("true", "false"):
+        return text.lower() == "true"
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def _conditions(clause):
+    """
+    [(field, operator, value or [values])] of an AND-joined WHERE clause
+    """
+    conditions = []
+    for part in re.split(r"\s+AND\s+(?=(?:[^']*'[^']*')*[^']*$)", clause.strip(), flags=re.I):
+        match = re.match(r"([\w.]+)\s*(<=|>=|=|<|>|\bIN\b|\bLIKE\b)\s*(.+)$", part.strip(), re.I | re.S)
+        if not match:
+            continue
+        field, operator, value = match.group(1), match.group(2).upper(), match.group(3).strip()
+        if operator == "IN":
+            value = [_literal(item) for item in re.findall(r"'(?:[^'\\]|\\.)*'|[^,()\s]+", value)]
+        else:
+            value = _literal(value)
+        conditions.append((field, operator, value))
+    return conditions
+
+
+def _value(row, field):
+    for part in field.split("."):
+        if not isinstance(row, dict):
+            return None
+        row = row.get(part)
+    return row
+
+
+def _matches(row, condition):
+    field, operator, value = condition
+    actual = _value(row, field)
+
+    if isinstance(actual, basestring):
+        actual = actual.lower()
+        value = [item.lower() if isinstance(item, basestring) else item for item in value] \
+            if isinstance(value, list) else (value.lower() if isinstance(value, basestring) else value)
+        if not isinstance(value, (list, basestring)):
+            value = unicode(value).lower()
+
+    if operator == "IN":
+        return actual in value
+    if operator == "LIKE":
+        return actual is not None and re.match("^" + re.escape(value).replace("\\%", ".*") + "$", actual) is not None
+    if actual is None:
+        return False
+    return {"=": actual == value, "<": actual < value, ">": actual > value, "<=": actual <= value,
+            ">=": actual >= value}[operator]
+
+
+#-----------------------------------------------------------------------------------------------------------------------
+def _address(i):
+    return {"Id": str(10000 + i), "Line1": "%d Main Street" % (100 + i % 900), "City": "Springfield",
+            "CountrySubDivisionCode": "CA", "PostalCode": "9%04d" % (i % 10000), "Lat": "37.7", "Long": "-122.4"}
+
+
+def _customer(i):
+    return {"DisplayName": "Customer %06d" % i, "GivenName": "Given%d" % i, "FamilyName": "Family%d" % i,
+            "CompanyName": "Company %d, Inc." % i, "FullyQualifiedName": "Customer %06d" % i,
+            "PrintOnCheckName": "Company %d, Inc." % i, "Active": True, "Taxable": i % 3 == 0, "Job": False,
+            "BillWithParent": False, "Balance": float(i % 997), "BalanceWithJobs": float(i % 997),
+            "CurrencyRef": {"value": "USD", "name": "United States Dollar"}, "PreferredDeliveryMethod": "Email",
+            "PrimaryEmailAddr": {"Address": "customer%d@example.com" % i},
+            "PrimaryPhone": {"FreeFormNumber": "(555) 555-%04d" % (i % 10000)},
+            "BillAddr": _address(i), "ShipAddr": _address(i), "Notes": "Customer since %d." % (2000 + i % 26)}
+
+
+def _item(i):
+    return {"Name": "Item %05d" % i, "Sku": "SKU-%05d" % i, "Description": "Made-up item number %d" % i,
+            "Active": True, "FullyQualifiedName": "Item %05d" % i, "Taxable": True, "UnitPrice": 10 + i % 90,
+            "Type": "Service", "IncomeAccountRef": {"value": "1", "name": "Sales"},
+            "PurchaseCost": 5 + i % 40, "TrackQtyOnHand": False, "SubItem": False, "Level": 0}
+
+
+def _account(i):
+    return {"Name": "Account %03d" % i, "FullyQualifiedName": "Account %03d" % i, "Active": True,
+            "Classification": "Revenue" if i % 2 == 0 else "Expense",
+            "AccountType": "Income" if i % 2 == 0 else "Expense", "AcctNum": str(4000 + i),
+            "CurrentBalance": 0, "CurrencyRef": {"value": "USD", "name": "United States Dollar"}}
+
+
+def _invoice(i, customers, rand):
+    lines = [{"Id": str(n + 1), "LineNum": n + 1, "Amount": 25.0 * (n + 1), "DetailType": "SalesItemLineDetail",
+              "Description": "Line %d of invoice %d" % (n + 1, i),
+              "SalesItemLineDetail": {"ItemRef": {"value": str(1 + n), "name": "Item %05d" % n},
+                                      "UnitPrice": 25, "Qty": n + 1, "TaxCodeRef": {"value": "NON"}}}
+             for n in range(5)]
+    customer = rand.randrange(max(customers, 1))
+    return {"DocNumber": str(1000 + i), "TxnDate": "2026-%02d-%02d" % (1 + i % 12, 1 + i % 28),
+            "DueDate": "2026-%02d-28" % (1 + i % 12), "TotalAmt": sum(line["Amount"] for line in lines),
+            "Balance": 0, "Deposit": 0, "Line": lines,
+            "TxnTaxDetail": {"TotalTax": 0, "TaxLine": [{"Amount": 0, "DetailType": "TaxLineDetail",
+                                                         "TaxLineDetail": {"TaxRateRef": {"value": "1"},
+                                                                           "PercentBased": True, "TaxPercent": 0,
+                                                                           "NetAmountTaxable": 0}}]},
+            "CustomerRef": {"value": str(customer), "name": "Customer %06d" % customer},
+            "CurrencyRef": {"value": "USD", "name": "United States Dollar"}, "BillAddr": _address(i),
+            "EmailStatus": "NotSet", "PrintStatus": "NotSet"}
+
+
+def _file_bytes(Id, size):
+    pattern = ("%%PDF-1.4 attachment %s " % Id) * 64
+    return (pattern * (size // len(pattern) + 1))[:size]
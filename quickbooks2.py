@@ -1,10 +1,2143 @@
 from rauth import OAuth1Session, OAuth1Service
 import xml.etree.ElementTree as ET
 import xmltodict
-from xml.dom import minidom
-import requests, urllib
-import collections, datetime, json, time
-import textwrap  # for uploading files
+from multiprocessing.pool import ThreadPool
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.exceptions import EmptyPoolError
+import logging, requests, socket, sqlite3, urllib
+import array, bisect, collections, copy, datetime, email.utils, functools, heapq, io, itertools, json, mimetypes, os
+import random, re, sys, threading, time
+
+log = logging.getLogger("quickbooks2")
+
+# QBO won't take more than this many requests at once for the same realm (company)
+MAX_CONCURRENT_REQUESTS = 10
+
+# ...or more than about this many a minute
+MAX_REQUESTS_PER_MINUTE = 500
+
+# ...nor more than this many operations in one batch request
+MAX_BATCH_ITEMS = 30
+
+_session_lock = threading.Lock()
+
+
+class ResponseError(Exception):
+    """
+    A response hammer_it can't make anything of (one in a content type it doesn't parse), with its
+    status_code, reason, content_type and body
+    """
+
+    def __init__(self, status_code, reason, content_type, body):
+        Exception.__init__(self, "%s %s response in %s: %s" % (status_code, reason, content_type or "no content type",
+                                                                body[:500]))
+        self.status_code = status_code
+        self.reason = reason
+        self.content_type = content_type
+        self.body = body
+
+
+class RateLimiter(object):
+    """
+    The request budget of one realm, shared by every QuickBooks instance in the process (get one with
+    RateLimiter.for_realm): a token bucket refilling at `rate` requests a second (QBO allows about
+    MAX_REQUESTS_PER_MINUTE), plus a cap of max_concurrent requests in flight.
+    The rate adapts: whenever QB throttles (HTTP 429) it's halved, and requests pause for as long as Retry-After
+    says; every success then nudges it back towards max_rate.
+    state() shows where it stands, so max_rate can be raised right up to what QB will take.
+    """
+
+    _limiters = {}
+    _limiters_lock = threading.Lock()
+
+    def __init__(self, max_rate=MAX_REQUESTS_PER_MINUTE / 60.0, burst=MAX_CONCURRENT_REQUESTS,
+                 max_concurrent=MAX_CONCURRENT_REQUESTS, min_rate=0.1):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.rate = max_rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+
+        self.tokens = float(burst)
+        self.in_flight = 0
+        self.paused_until = 0
+
+        self.requests = 0
+        self.throttled = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+        self._updated = time.time()
+        self._condition = threading.Condition()
+
+    @classmethod
+    def for_realm(cls, company_id):
+        with cls._limiters_lock:
+            # "1" and 1 are the same realm
+            company_id = str(company_id)
+            if company_id not in cls._limiters:
+                cls._limiters[company_id] = cls()
+            return cls._limiters[company_id]
+
+    @classmethod
+    def forget(cls, company_id):
+        """
+        Drops a realm's limiter (if nothing's in flight for it), e.g. when its client is evicted
+        """
+        with cls._limiters_lock:
+            company_id = str(company_id)
+            limiter = cls._limiters.get(company_id)
+            if limiter is not None and limiter.in_flight == 0:
+                del cls._limiters[company_id]
+
+    @classmethod
+    def states(cls):
+        """
+        {company_id: state()} for every realm this process has talked to
+        """
+        with cls._limiters_lock:
+            limiters = dict(cls._limiters)
+        return dict((company_id, limiter.state()) for company_id, limiter in limiters.iteritems())
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _wait_needed(self, now):
+        """
+        Seconds until a request could go (None: when one in flight finishes), or 0 if it can go now
+        """
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight >= self.max_concurrent:
+            return None
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        return 0
+
+    def try_acquire(self):
+        """
+        Takes a token and a slot if both are available and returns 0; otherwise returns how long to wait
+        before trying again (None: until a request in flight finishes).
+        """
+        with self._condition:
+            now = time.time()
+            self._refill(now)
+            wait = self._wait_needed(now)
+
+            if wait == 0:
+                self.tokens -= 1
+                self.in_flight += 1
+                self.requests += 1
+
+            return wait
+
+    def acquire(self):
+        """
+        Waits for a token and a slot, and takes them
+        """
+        started = time.time()
+        waited = False
+
+        with self._condition:
+            while True:
+                now = time.time()
+                self._refill(now)
+                wait = self._wait_needed(now)
+
+                if wait == 0:
+                    break
+
+                waited = True
+                self._condition.wait(wait)
+
+            self.tokens -= 1
+            self.in_flight += 1
+            self.requests += 1
+
+            if waited:
+                self.waits += 1
+                self.wait_time += time.time() - started
+
+    def release(self, unused=False):
+        """
+        Gives back the slot, and the token too if no request was sent with it
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if unused:
+                self.tokens = min(self.burst, self.tokens + 1)
+                self.requests -= 1
+            self._condition.notify()
+
+    def on_response(self, status_code, retry_after=None):
+        """
+        Adapts the rate to how QB answered
+        """
+        with self._condition:
+            if status_code == 429:
+                self.throttled += 1
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.tokens = min(self.tokens, 0)
+                if retry_after:
+                    self.paused_until = max(self.paused_until, time.time() + retry_after)
+            elif status_code < 400 and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+    def state(self):
+        with self._condition:
+            self._refill(time.time())
+            return {"rate": self.rate, "max_rate": self.max_rate, "tokens": self.tokens,
+                    "in_flight": self.in_flight, "max_concurrent": self.max_concurrent,
+                    "paused_for": max(0, self.paused_until - time.time()), "requests": self.requests,
+                    "throttled": self.throttled, "waits": self.waits, "wait_time": self.wait_time}
+
+
+class _CountingPool(object):
+    """
+    Mixed into urllib3's connection pool classes by PooledTransport, to tell it about new connections and waits
+    """
+
+    transport = None
+
+    def _new_conn(self):
+        conn = super(_CountingPool, self)._new_conn()
+        self.transport._count(connections=1)
+        return conn
+
+    def _get_conn(self, timeout=None):
+        if timeout is None:
+            timeout = self.transport.pool_timeout
+
+        waiting = self.block and self.pool is not None and self.pool.empty()
+        started = time.time()
+
+        conn = super(_CountingPool, self)._get_conn(timeout)
+
+        self.transport._count(requests=1, waits=int(waiting), wait_time=time.time() - started if waiting else 0)
+        return conn
+
+
+class PooledTransport(HTTPAdapter):
+    """
+    Keep-alive connection pools shared by every QuickBooks instance in the process (get it with
+    PooledTransport.shared()). Sessions, and so OAuth signing, stay per instance; they just all mount this adapter,
+    so a new instance for a realm reuses connections an earlier one opened instead of paying for TCP and TLS again.
+    Up to pool_maxsize connections are kept per host (for up to pool_connections hosts); with pool_block, a request
+    waits for one to come free (for up to pool_timeout seconds, after which urllib3's EmptyPoolError is raised)
+    rather than opening another that would just be thrown away.
+    stats() shows how often connections get reused, and how often requests had to wait.
+    """
+
+    pool_connections = 10
+    pool_maxsize = 32
+    pool_block = True
+    pool_timeout = 60
+
+    _shared = None
+    _plain_session = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, pool_connections=None, pool_maxsize=None, pool_block=None):
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+        HTTPAdapter.__init__(self,
+                             pool_connections or self.pool_connections,
+                             pool_maxsize or self.pool_maxsize,
+                             pool_block=self.pool_block if pool_block is None else pool_block)
+
+    @classmethod
+    def shared(cls):
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    @classmethod
+    def configure(cls, pool_connections=None, pool_maxsize=None, pool_block=None, pool_timeout=None):
+        """
+        Changes the pool sizes for sessions created from now on (ones that already exist keep their pools)
+        """
+        with cls._shared_lock:
+            if pool_timeout:
+                cls.pool_timeout = pool_timeout
+            if pool_connections:
+                cls.pool_connections = pool_connections
+            if pool_maxsize:
+                cls.pool_maxsize = pool_maxsize
+            if pool_block is not None:
+                cls.pool_block = pool_block
+
+            cls._shared = None
+            cls._plain_session = None
+
+    @classmethod
+    def plain_session(cls):
+        """
+        A requests.Session (no OAuth) on the shared pools, for QB's pre-signed download links and the like
+        """
+        transport = cls.shared()
+
+        with cls._shared_lock:
+            if cls._plain_session is None:
+                session = requests.Session()
+                transport.mount(session)
+                cls._plain_session = session
+            return cls._plain_session
+
+    def mount(self, session):
+        session.mount("https://", self)
+        session.mount("http://", self)
+        return session
+
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+
+        pool_classes = self.poolmanager.pool_classes_by_scheme
+        self.poolmanager.pool_classes_by_scheme = dict(
+            (scheme, type(pool_class.__name__, (_CountingPool, pool_class), {"transport": self}))
+            for scheme, pool_class in pool_classes.iteritems())
+
+    def _count(self, requests=0, connections=0, waits=0, wait_time=0):
+        with self._stats_lock:
+            self.requests += requests
+            self.connections += connections
+            self.waits += waits
+            self.wait_time += wait_time
+
+    def stats(self):
+        with self._stats_lock:
+            requests, connections = self.requests, self.connections
+            return {"hosts": len(self.poolmanager.pools), "pool_maxsize": self._pool_maxsize,
+                    "requests": requests, "connections": connections,
+                    "reuse_rate": 1 - float(connections) / requests if requests else 0.0,
+                    "waits": self.waits, "wait_time": self.wait_time}
+
+
+class FileData(object):
+    """
+    Bytes to upload as a file's content, for wherever a path or file-like object would do (a plain string there
+    is always taken to be a path). name is the file name to give it, if none is given with it.
+    """
+
+    def __init__(self, data, name=None):
+        self.data = data.encode("utf-8") if isinstance(data, unicode) else data
+        self.name = name
+
+    def __len__(self):
+        return len(self.data)
+
+
+class MultipartEncoder(object):
+    """
+    A multipart/form-data body that's read as it's sent, rather than built in memory first.
+    parts are (name, filename, content_type, source) tuples, where source is a path, a file-like object (read from
+    its current position), a FileData or a bytearray; a None content_type is guessed from the filename.
+    A path that isn't an existing file raises IOError.
+    len() gives the Content-Length; rewind() starts it over, for another try.
+    """
+
+    chunk_size = 1024 * 1024
+
+    def __init__(self, parts, boundary=None):
+        self.boundary = boundary or "----------QuickBooksPython%s" % "".join(
+            random.choice("0123456789abcdef") for _ in range(24))
+        self.content_type = "multipart/form-data; boundary=%s" % self.boundary
+
+        # [(headers, kind of source, source, start position, size)]
+        self._parts = []
+
+        for name, filename, content_type, source in parts:
+            if content_type is None:
+                content_type = mimetypes.guess_type(filename or "")[0] or "application/octet-stream"
+
+            disposition = 'form-data; name="%s"' % name
+            if filename:
+                disposition += '; filename="%s"' % filename.replace('"', '\\"')
+
+            headers = "--%s\r\nContent-Disposition: %s\r\nContent-Type: %s\r\n\r\n" % (
+                self.boundary, disposition, content_type)
+            if isinstance(headers, unicode):
+                headers = headers.encode("utf-8")
+
+            if isinstance(source, FileData) or isinstance(source, bytearray):
+                source = getattr(source, "data", source)
+                kind, start, size = "bytes", 0, len(source)
+            elif isinstance(source, basestring):
+                if not os.path.isfile(source):
+                    raise IOError("No file to upload at %s" % source)
+                kind, start, size = "path", 0, os.path.getsize(source)
+            else:
+                kind, start = "file", source.tell()
+                source.seek(0, os.SEEK_END)
+                size = source.tell() - start
+                source.seek(start)
+
+            self._parts.append((headers, kind, source, start, size))
+
+        self._closing = "--%s--\r\n" % self.boundary
+        self._length = sum(len(part[0]) + part[4] + 2 for part in self._parts) + len(self._closing)
+
+        self._open = None
+        self.rewind()
+
+    @classmethod
+    def for_file(cls, source, filename=None, content_type=None, name="file_content_0"):
+        """
+        The body of a one-file upload, as QB's upload endpoint wants it
+        """
+        if filename is None:
+            if isinstance(source, basestring):
+                filename = os.path.basename(source)
+            else:
+                filename = os.path.basename(getattr(source, "name", "") or "") or "upload"
+
+        return cls([(name, filename, content_type, source)])
+
+    def __len__(self):
+        return self._length
+
+    def __contains__(self, item):
+        # rauth looks for oauth parameters in any request data; without this, looking would read the whole body
+        return False
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def rewind(self):
+        self._close_current()
+        self._pieces = self._generate()
+        self._buffer = ""
+        self._position = 0
+
+    def _close_current(self):
+        if self._open is not None:
+            self._open.close()
+            self._open = None
+
+    def _generate(self):
+        for headers, kind, source, start, size in self._parts:
+            yield headers
+
+            if kind == "bytes":
+                for offset in xrange(0, size, self.chunk_size):
+                    yield str(source[offset:offset + self.chunk_size])
+
+            else:
+                if kind == "path":
+                    self._open = open(source, "rb")
+                    file_handler = self._open
+                else:
+                    file_handler = source
+                    file_handler.seek(start)
+
+                remaining = size
+                while remaining > 0:
+                    chunk = file_handler.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        raise IOError("%s got shorter while it was being uploaded" %
+                                      getattr(file_handler, "name", "upload"))
+                    remaining -= len(chunk)
+                    yield chunk
+
+                self._close_current()
+
+            yield "\r\n"
+
+        yield self._closing
+
+    def read(self, size=-1):
+        chunks = []
+
+        while size != 0:
+            if self._position >= len(self._buffer):
+                self._buffer, self._position = next(self._pieces, ""), 0
+                if not self._buffer:
+                    break
+
+            available = len(self._buffer) - self._position
+            taken = available if size < 0 else min(size, available)
+
+            chunks.append(self._buffer[self._position:self._position + taken])
+            self._position += taken
+            if size > 0:
+                size -= taken
+
+        return "".join(chunks)
+
+
+class _Closer(object):
+    """
+    Closes a streamed response (handing its connection back to the pool), and runs the callbacks it's been given
+    (see _ResponseStream.on_close), when told to or once nothing refers to it any more. JsonStream and XmlStream
+    keep theirs in one of these because they're in a reference cycle with their own generators, where a __del__ of
+    theirs would never run.
+    """
+
+    def __init__(self, response):
+        self.response = response
+        self.callbacks = []
+        self.closed = False
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        response, self.response = self.response, None
+        try:
+            if response is not None:
+                response.close()
+        finally:
+            callbacks, self.callbacks = self.callbacks, []
+            for callback in callbacks:
+                callback()
+
+    __del__ = close
+
+
+class _ResponseStream(object):
+    """
+    What JsonStream and XmlStream have in common: closing the response they read from (see _Closer)
+    """
+
+    def _closing(self):
+        # chained after the items, so the response is closed as soon as the last one has been read
+        self.close()
+        for item in ():
+            yield item
+
+    def close(self):
+        self._closer.close()
+
+    def on_close(self, callback):
+        """
+        Has callback() called once the stream is closed (right away if it already is)
+        """
+        if self._closer.closed:
+            callback()
+        else:
+            self._closer.callbacks.append(callback)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class JsonStream(_ResponseStream):
+    """
+    The items of one array in a JSON document, decoded one at a time as the document's text arrives instead of all
+    at once at the end. path is the dotted path of keys down to the array ("QueryResponse.Invoice", "Rows.Row").
+    Iterating yields the items; everything else in the document is kept in .document (filled in as it's read, and
+    with the array itself left empty), and .count says how many items there have been.
+    codec is whatever decodes each piece of JSON (anything with a loads: json, simplejson, ujson...)
+    response, if given, is closed once the array has been read; close() (or a with block) does so sooner, for
+    a reader that stops early.
+    """
+
+    _token = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|["{}\[\]]')
+    _scalar = re.compile(r'[^,:}\]\s]*')
+    _space = re.compile(r'[\s,:]*')
+
+    def __init__(self, chunks, path, codec=json, response=None):
+        self.path = path.split(".")
+        self.codec = codec
+        self.document = {}
+        self.count = 0
+
+        self._closer = _Closer(response)
+
+        self._chunks = iter(chunks)
+        self._buffer = ""
+        self._position = 0
+        # (start, where to carry on scanning from, depth there) for a container value only partly in the buffer
+        self._scan = None
+        self._items = None
+
+    def __iter__(self):
+        if self._items is None:
+            self._items = itertools.chain(self._walk(self.document, 0), self._closing())
+        return self._items
+
+
+    def _more(self):
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return False
+
+        # drop what's been consumed, once there's a fair bit of it
+        if self._position > 65536:
+            if self._scan is not None:
+                start, resume, depth = self._scan
+                self._scan = (start - self._position, resume - self._position, depth)
+            self._buffer = self._buffer[self._position:]
+            self._position = 0
+
+        self._buffer += chunk
+        return True
+
+    def _next_char(self):
+        """
+        The next character that means something (commas and colons are skipped like whitespace), or None at the end
+        """
+        while True:
+            self._position = self._space.match(self._buffer, self._position).end()
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if not self._more():
+                return None
+
+    def _value_end(self):
+        """
+        Where the value starting at _position ends, or None if it doesn't within the buffer yet
+        """
+        start = self._position
+        first = self._buffer[start]
+
+        if first in "{[":
+            resume, depth = start, 0
+            if self._scan is not None and self._scan[0] == start:
+                resume, depth = self._scan[1:]
+
+            for match in self._token.finditer(self._buffer, resume):
+                token = match.group()
+                if token == '"':
+                    # a string that isn't all here yet
+                    self._scan = (start, match.start(), depth)
+                    return None
+                if token in "{[":
+                    depth += 1
+                elif token in "}]":
+                    depth -= 1
+                    if depth == 0:
+                        self._scan = None
+                        return match.end()
+
+            self._scan = (start, len(self._buffer), depth)
+            return None
+
+        if first == '"':
+            match = self._token.match(self._buffer, start)
+            return match.end() if match.group() != '"' else None
+
+        end = self._scalar.match(self._buffer, start).end()
+        return end if end < len(self._buffer) else None
+
+    def _take_value(self):
+        while True:
+            end = self._value_end()
+            if end is not None:
+                break
+            if not self._more():
+                raise ValueError("The JSON ended in the middle of a value")
+
+        value = self.codec.loads(self._buffer[self._position:end])
+        self._position = end
+        return value
+
+    def _walk(self, container, depth):
+        """
+        Reads the object starting at _position into container, yielding the items of the array on the path instead
+        of putting them in it
+        """
+        if self._next_char() != "{":
+            raise ValueError("Expected a JSON object")
+        self._position += 1
+
+        while True:
+            char = self._next_char()
+            if char is None:
+                raise ValueError("The JSON ended in the middle of an object")
+            if char == "}":
+                self._position += 1
+                return
+
+            key = self._take_value()
+            char = self._next_char()
+
+            if key == self.path[depth] and depth == len(self.path) - 1 and char == "[":
+                container[key] = []
+                self._position += 1
+
+                while True:
+                    char = self._next_char()
+                    if char is None:
+                        raise ValueError("The JSON ended in the middle of %s" % ".".join(self.path))
+                    if char == "]":
+                        self._position += 1
+                        break
+
+                    item = self._take_value()
+                    self.count += 1
+                    yield item
+
+            elif key == self.path[depth] and depth < len(self.path) - 1 and char == "{":
+                container[key] = {}
+                for item in self._walk(container[key], depth + 1):
+                    yield item
+
+            else:
+                container[key] = self._take_value()
+
+
+class XmlStream(_ResponseStream):
+    """
+    JsonStream for XML responses: one iterparse pass over the document (a str, or a file-like object such as a
+    streamed response's raw), turning elements into the same dicts the JSON API would have sent and clearing them
+    as it goes. The root element stands for the whole document, so path ("QueryResponse.Invoice", "Rows.Row") is
+    relative to it; parse() reads it all and returns .document, with nothing taken out of it.
+    XML doesn't say which elements are lists, objects or numbers, so that's looked up in _LISTS (and _LISTS_IN),
+    _OBJECTS and _NUMBERS (and, inside an entity, its _ENTITY_NUMBERS).
+    response is closed the same way as JsonStream's.
+    """
+
+    # elements that are always lists in the JSON, even with just one of them (as are the entities in a QueryResponse),
+    # and (parent, element) pairs that are lists only in that parent
+    _LISTS = frozenset(["Line", "Error", "Row", "ColData", "Column", "CustomField", "LinkedTxn", "AttachableRef",
+                        "CDCResponse", "AttachableResponse", "BatchItemRequest", "BatchItemResponse", "TaxLine",
+                        "Option", "Attributes", "NameValue", "TaxRateDetail", "EffectiveTaxRate", "ItemGroupLine"])
+    _LISTS_IN = frozenset([("CDCResponse", "QueryResponse"), ("Column", "MetaData")])
+
+    # elements that are objects in the JSON even when they're empty, and ones that are strings even when they look
+    # like something else
+    _OBJECTS = frozenset(["QueryResponse", "CDCResponse", "AttachableResponse", "BatchItemResponse", "Rows", "Columns"])
+    _STRINGS = frozenset(["value", "Value"])
+
+    # elements (and attributes) that are numbers wherever they are, and those that are only numbers in some entities
+    _NUMBERS = frozenset(["startPosition", "maxResults", "totalCount", "LineNum", "Amount", "TotalAmt", "Balance",
+                          "HomeBalance", "HomeTotalAmt", "UnitPrice", "Qty", "QtyOnHand", "ExchangeRate",
+                          "CurrentBalance", "CurrentBalanceWithSubAccounts", "BalanceWithJobs", "TotalTax",
+                          "TaxPercent", "NetAmountTaxable", "TaxInclusiveAmount", "OverrideDeltaAmount",
+                          "DiscountPercent", "MarkupPercent", "UnappliedAmt"])
+    _ENTITY_NUMBERS = {"Attachable": _NUMBERS | frozenset(["Size"]),
+                       "Customer": _NUMBERS | frozenset(["Level"]),
+                       "Item": _NUMBERS | frozenset(["Level", "PurchaseCost", "ReorderPoint"]),
+                       "Invoice": _NUMBERS | frozenset(["Deposit"]),
+                       "SalesReceipt": _NUMBERS | frozenset(["Deposit"]),
+                       "Estimate": _NUMBERS | frozenset(["Deposit"]),
+                       "Employee": _NUMBERS | frozenset(["BillRate", "CostRate"]),
+                       "TimeActivity": _NUMBERS | frozenset(["Hours", "Minutes", "HourlyRate", "CostRate"]),
+                       "TaxRate": _NUMBERS | frozenset(["RateValue"]),
+                       "Term": _NUMBERS | frozenset(["DueDays", "DiscountDays", "DayOfMonthDue", "DueNextMonthDays",
+                                                     "DiscountDayOfMonth"])}
+
+    def __init__(self, source, path=None, response=None):
+        if isinstance(source, basestring):
+            source = io.BytesIO(source)
+
+        self.path = path.split(".") if path else None
+        self.document = {}
+        self.count = 0
+
+        self._closer = _Closer(response)
+
+        self._source = source
+        self._items = None
+
+    def __iter__(self):
+        if self._items is None:
+            self._items = itertools.chain(self._walk(), self._closing())
+        return self._items
+
+    def parse(self):
+        for item in self:
+            pass
+        return self.document
+
+    @staticmethod
+    def _tag(element):
+        return element.tag.rsplit("}", 1)[-1]
+
+    @classmethod
+    def _scalar(cls, name, text, numbers=_NUMBERS):
+        if name in cls._STRINGS:
+            return text
+        if text == "true":
+            return True
+        if text == "false":
+            return False
+        if name in numbers:
+            try:
+                return int(text)
+            except ValueError:
+                try:
+                    return float(text)
+                except ValueError:
+                    pass
+        return text
+
+    def _walk(self):
+        # (tag, dict, numbers) for each open element, the root's dict being the document and numbers what's
+        # a number in it (those of the entity it's part of, if any)
+        stack = []
+
+        for event, element in ET.iterparse(self._source, events=("start", "end")):
+            tag = self._tag(element)
+
+            if event == "start":
+                fields = self.document if not stack else {}
+                numbers = stack[-1][2] if stack else self._NUMBERS
+                if numbers is self._NUMBERS:
+                    numbers = self._ENTITY_NUMBERS.get(tag, numbers)
+                for name, value in element.attrib.iteritems():
+                    name = name.rsplit("}", 1)[-1]
+                    fields[name] = self._scalar(name, value, numbers)
+                stack.append((tag, fields, numbers))
+                continue
+
+            tag, fields, numbers = stack.pop()
+            if not stack:
+                break
+
+            text = (element.text or "").strip()
+            if len(element) or tag in self._OBJECTS:
+                value = fields
+            elif fields:
+                value = fields
+                if text:
+                    value["value"] = self._scalar(tag, text, numbers)
+            elif tag.endswith("Ref"):
+                # a reference with no name (<TaxCodeRef>NON</TaxCodeRef>) is still {"value": ...}
+                value = {"value": text}
+            else:
+                value = self._scalar(tag, text, numbers)
+
+            element.clear()
+
+            parent_tag, parent = stack[-1][:2]
+            if self.path is not None and len(stack) == len(self.path) and \
+                    [entry[0] for entry in stack[1:]] + [tag] == self.path:
+                parent.setdefault(tag, [])
+                self.count += 1
+                yield value
+            elif tag in self._LISTS or (parent_tag, tag) in self._LISTS_IN or \
+                    (parent_tag == "QueryResponse" and isinstance(value, dict)):
+                parent.setdefault(tag, []).append(value)
+            elif tag in parent:
+                if not isinstance(parent[tag], list):
+                    parent[tag] = [parent[tag]]
+                parent[tag].append(value)
+            else:
+                parent[tag] = value
+
+
+class _Future(object):
+    """
+    Holds the result of work running on another thread. get() waits for it and re-raises whatever the work raised.
+    Callbacks added with add_done_callback (or then) run on whichever thread finishes the work.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._result = None
+        self._exc_info = None
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            callback(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exc_info(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def ready(self):
+        return self._done.is_set()
+
+    def get(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise RuntimeError("Timed out waiting for the result.")
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def add_done_callback(self, fn):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def then(self, fn):
+        """
+        Returns a new _Future for fn(result), passing any error straight through.
+        If fn returns a _Future itself, the new one resolves when that one does.
+        """
+        chained = _Future()
+
+        def copy(future):
+            if future._exc_info is not None:
+                chained.set_exc_info(future._exc_info)
+            else:
+                chained.set_result(future._result)
+
+        def callback(future):
+            if future._exc_info is not None:
+                chained.set_exc_info(future._exc_info)
+                return
+            try:
+                result = fn(future._result)
+            except:
+                chained.set_exc_info(sys.exc_info())
+                return
+            if isinstance(result, _Future):
+                result.add_done_callback(copy)
+            else:
+                chained.set_result(result)
+
+        self.add_done_callback(callback)
+        return chained
+
+
+class _Scheduler(object):
+    """
+    Runs callables after a delay, all from one daemon thread, so waiting out a backoff doesn't tie up a worker.
+    The callables should be quick (typically they just hand work back to a pool).
+    """
+
+    def __init__(self):
+        self._queue = []  # heap of (when, sequence number, fn)
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def call_later(self, delay, fn):
+        with self._condition:
+            heapq.heappush(self._queue, (time.time() + delay, next(self._sequence), fn))
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue or self._queue[0][0] > time.time():
+                    if self._queue:
+                        self._condition.wait(self._queue[0][0] - time.time())
+                    else:
+                        self._condition.wait()
+
+                fn = heapq.heappop(self._queue)[2]
+
+            try:
+                fn()
+            except:
+                pass
+
+
+def _run_in_thread(fn, *args, **kwargs):
+    """
+    Runs fn(*args, **kwargs) on a daemon thread and returns a _Future for its result.
+    """
+    future = _Future()
+
+    def target():
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except:
+            future.set_exc_info(sys.exc_info())
+
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    return future
+
+
+def _interned(value, strings):
+    """
+    The copy of the string value kept in strings (a dict; unicode strings can't go through intern(), nor be
+    weakly referenced), which it becomes if there isn't one yet. Anything else, or with no strings, is left as it is.
+    """
+    if strings is not None and isinstance(value, basestring):
+        return strings.setdefault(value, value)
+    return value
+
+
+def _plain(obj):
+    """
+    json.dumps' default for the things it can't encode itself: an Entity becomes the dict it stands for
+    """
+    if isinstance(obj, Entity):
+        return obj.to_dict()
+    raise TypeError("%r is not JSON serializable" % (obj,))
+
+
+def _compact_json(obj):
+    """
+    obj as the JSON request bodies are sent in: without the whitespace, which QB doesn't need
+    """
+    return json.dumps(obj, separators=(",", ":"), default=_plain)
+
+
+class Entity(object):
+    """
+    A compact, read-mostly stand-in for one QBO object dict, for session dicts big enough for memory to matter
+    (see the typed_entities argument of QuickBooks).
+    The often-used scalar properties (FIELDS) each get a slot; small nested ones (SHAPES, like the xxxRefs) are kept
+    as tuples of their SHAPES keys' values. Given a strings table (EntityCache keeps one per session dict), the
+    strings of the xxxRefs and of the INTERNED fields, which are few and shared by many objects, are interned in it,
+    so thousands of objects referring to the same customer or currency share one copy of its name. (Values more or
+    less unique to each object, like timestamps and email addresses, aren't: the table would only keep them alive.)
+    Everything else (Lines, addresses, custom fields...) is kept as one compact JSON string and only decoded if
+    something asks for it.
+    It reads like the dict: obj["CustomerRef"]["value"], get(), in, keys(); to_dict() gives the dict itself
+    (a copy: changing it doesn't change the Entity, but assigning obj[key] does).
+    Attributes (obj.DisplayName, obj.CurrencyRef) hand back what's stored, tuples and all.
+    Each subclass (Customer, Item, ...) lists its own FIELDS, SHAPES and INTERNED and has slots for them.
+    """
+
+    __slots__ = ("_rest", "_extra")
+
+    FIELDS = ("Id", "SyncToken", "domain", "sparse")
+    SHAPES = (("MetaData", ("CreateTime", "LastUpdatedTime")), )
+    INTERNED = ("SyncToken", "domain")
+
+    _REF = ("value", "name")
+
+    def __init__(self, obj=None, strings=None):
+        self._rest = None
+        self._extra = None
+
+        shapes = dict(self.SHAPES)
+        rest = {}
+
+        for key, value in (obj or {}).iteritems():
+            if key in self.FIELDS:
+                setattr(self, key, _interned(value, strings) if key in self.INTERNED else value)
+            elif key in shapes and self._fits(value, shapes[key]):
+                setattr(self, key, self._packed(value, shapes[key], strings))
+            else:
+                rest[key] = value
+
+        if rest:
+            self._rest = json.dumps(rest, separators=(",", ":"))
+
+    @classmethod
+    def from_dict(cls, obj):
+        return cls(obj)
+
+    @staticmethod
+    def _fits(value, parts):
+        return isinstance(value, dict) and all(part in parts for part in value)
+
+    @classmethod
+    def _packed(cls, value, parts, strings=None):
+        if parts != cls._REF:
+            strings = None
+        return tuple(_interned(value.get(part), strings) for part in parts)
+
+    def _unpacked(self):
+        """
+        The properties without a slot of their own, decoded (once) if they haven't been yet
+        """
+        if self._extra is None:
+            self._extra = json.loads(self._rest) if self._rest else {}
+            self._rest = None
+        return self._extra
+
+    def _slot(self, key):
+        for name, parts in self.SHAPES:
+            if name == key:
+                return parts
+        return () if key in self.FIELDS else None
+
+    def __getitem__(self, key):
+        parts = self._slot(key)
+
+        if parts is None:
+            return self._unpacked()[key]
+
+        try:
+            value = getattr(self, key)
+        except AttributeError:
+            # (a value that didn't fit its slot is kept with the rest)
+            if self._rest or self._extra:
+                return self._unpacked()[key]
+            raise KeyError(key)
+
+        if parts:
+            return dict((part, item) for part, item in zip(parts, value) if item is not None)
+        return value
+
+    def __setitem__(self, key, value):
+        parts = self._slot(key)
+        self._discard(key)
+
+        if parts is None or (parts and not self._fits(value, parts)):
+            self._unpacked()[key] = value
+        elif parts:
+            setattr(self, key, self._packed(value, parts))
+        else:
+            setattr(self, key, value)
+
+    def _discard(self, key):
+        """
+        Drops key, wherever it's kept; returns whether there was one
+        """
+        found = False
+
+        if self._slot(key) is not None and hasattr(self, key):
+            delattr(self, key)
+            found = True
+        if (self._rest or self._extra) and key in self._unpacked():
+            del self._extra[key]
+            found = True
+
+        return found
+
+    def __delitem__(self, key):
+        if not self._discard(key):
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        if self._slot(key) is not None and hasattr(self, key):
+            return True
+        return bool(self._rest or self._extra) and key in self._unpacked()
+
+    has_key = __contains__
+
+    def keys(self):
+        keys = [key for key in self.FIELDS if hasattr(self, key)]
+        keys += [key for key, parts in self.SHAPES if hasattr(self, key)]
+        if self._rest or self._extra:
+            keys += self._unpacked().keys()
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    iteritems = items
+
+    def to_dict(self):
+        obj = dict(self.items())
+        if self._extra:
+            # so the copy's nested dicts and lists aren't the ones this keeps
+            obj.update(json.loads(json.dumps(self._extra)))
+        return obj
+
+    def __eq__(self, other):
+        if isinstance(other, (Entity, dict)):
+            return self.to_dict() == (other.to_dict() if isinstance(other, Entity) else other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __reduce__(self):
+        return (self.__class__, (self.to_dict(), ))
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.to_dict())
+
+
+class Customer(Entity):
+    FIELDS = Entity.FIELDS + ("DisplayName", "GivenName", "FamilyName", "CompanyName", "FullyQualifiedName",
+                              "PrintOnCheckName", "Active", "Job", "BillWithParent", "Level", "Taxable", "Balance",
+                              "BalanceWithJobs", "PreferredDeliveryMethod")
+    SHAPES = Entity.SHAPES + (("ParentRef", Entity._REF), ("CurrencyRef", Entity._REF),
+                              ("SalesTermRef", Entity._REF), ("PaymentMethodRef", Entity._REF),
+                              ("PrimaryEmailAddr", ("Address", )), ("PrimaryPhone", ("FreeFormNumber", )))
+    INTERNED = Entity.INTERNED + ("PreferredDeliveryMethod", )
+    __slots__ = FIELDS + tuple(name for name, parts in SHAPES)
+
+
+class Item(Entity):
+    FIELDS = Entity.FIELDS + ("Name", "Sku", "Description", "Active", "SubItem", "Level", "FullyQualifiedName",
+                              "Taxable", "UnitPrice", "Type", "PurchaseDesc", "PurchaseCost", "TrackQtyOnHand",
+                              "QtyOnHand", "InvStartDate")
+    SHAPES = Entity.SHAPES + (("ParentRef", Entity._REF), ("IncomeAccountRef", Entity._REF),
+                              ("ExpenseAccountRef", Entity._REF), ("AssetAccountRef", Entity._REF))
+    INTERNED = Entity.INTERNED + ("Type", )
+    __slots__ = FIELDS + tuple(name for name, parts in SHAPES)
+
+
+class Account(Entity):
+    FIELDS = Entity.FIELDS + ("Name", "SubAccount", "FullyQualifiedName", "Active", "Classification", "AccountType",
+                              "AccountSubType", "AcctNum", "CurrentBalance", "CurrentBalanceWithSubAccounts",
+                              "Description")
+    SHAPES = Entity.SHAPES + (("ParentRef", Entity._REF), ("CurrencyRef", Entity._REF))
+    INTERNED = Entity.INTERNED + ("Classification", "AccountType", "AccountSubType")
+    __slots__ = FIELDS + tuple(name for name, parts in SHAPES)
+
+
+class Invoice(Entity):
+    FIELDS = Entity.FIELDS + ("DocNumber", "TxnDate", "DueDate", "TotalAmt", "Balance", "PrivateNote",
+                              "EmailStatus", "PrintStatus")
+    SHAPES = Entity.SHAPES + (("CustomerRef", Entity._REF), ("CurrencyRef", Entity._REF),
+                              ("SalesTermRef", Entity._REF), ("DepartmentRef", Entity._REF),
+                              ("ClassRef", Entity._REF), ("BillEmail", ("Address", )))
+    INTERNED = Entity.INTERNED + ("TxnDate", "DueDate", "EmailStatus", "PrintStatus")
+    __slots__ = FIELDS + tuple(name for name, parts in SHAPES)
+
+
+class Bill(Entity):
+    FIELDS = Entity.FIELDS + ("DocNumber", "TxnDate", "DueDate", "TotalAmt", "Balance", "PrivateNote")
+    SHAPES = Entity.SHAPES + (("VendorRef", Entity._REF), ("APAccountRef", Entity._REF),
+                              ("CurrencyRef", Entity._REF), ("SalesTermRef", Entity._REF),
+                              ("DepartmentRef", Entity._REF))
+    INTERNED = Entity.INTERNED + ("TxnDate", "DueDate")
+    __slots__ = FIELDS + tuple(name for name, parts in SHAPES)
+
+
+# the Entity classes QuickBooks(typed_entities=True) keeps session dicts of these types in
+ENTITY_TYPES = {"Customer": Customer, "Item": Item, "Account": Account, "Invoice": Invoice, "Bill": Bill}
+
+
+class EntityCache(collections.OrderedDict):
+    """
+    The session dict of one business-object type (Customers, Items, ...): still an OrderedDict keyed by Id,
+    but optionally bounded by entry count (max_entries) and/or approximate JSON size (max_bytes, which is also the
+    only time sizes are worked out), with entries expiring ttl seconds after they were last stored.
+    The least recently used entries are evicted first.
+    hits, misses, evictions and expirations are counted; see stats().
+    intact stays True until something has been evicted or has expired, i.e. for as long as the dict still holds
+    everything that was put in it.
+    add_index(field) keeps a {value: Ids} index on a (dotted, e.g. "PrimaryEmailAddr.Address") field up to date
+    for find(); string values are matched case-insensitively, like QB does.
+    With an entity_class (an Entity subclass), the dicts put in are kept as instances of it.
+    """
+
+    def __init__(self, items=(), max_entries=None, max_bytes=None, ttl=None, entity_class=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entity_class = entity_class
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.bytes = 0
+        self.intact = True
+
+        self._lock = threading.RLock()
+        self._recency = collections.OrderedDict()  # Id: None, least recently used first
+        self._stamps = collections.OrderedDict()  # Id: time stored, oldest first
+        self._sizes = {}
+        self._indexes = {}  # field: {value: set of Ids}
+        self._strings = {}  # what the entity_class objects intern their shared strings in (see Entity)
+
+        collections.OrderedDict.__init__(self)
+        self.update(items)
+
+    @staticmethod
+    def _normalized(value):
+        if isinstance(value, basestring):
+            return value.strip().lower()
+        if isinstance(value, (dict, list)):
+            return None
+        return value
+
+    @staticmethod
+    def _field_value(obj, field):
+        """
+        obj's value for a (dotted) field, normalized for indexing; None if it hasn't got one
+        """
+        for part in field.split("."):
+            if not isinstance(obj, (dict, Entity)) or part not in obj:
+                return None
+            obj = obj[part]
+
+        return EntityCache._normalized(obj)
+
+    def _index(self, key, obj):
+        for field, index in self._indexes.iteritems():
+            value = self._field_value(obj, field)
+            if value is not None:
+                index.setdefault(value, set()).add(key)
+
+    def _unindex(self, key, obj):
+        for field, index in self._indexes.iteritems():
+            value = self._field_value(obj, field)
+            if value in index:
+                index[value].discard(key)
+                if not index[value]:
+                    del index[value]
+
+    def add_index(self, field):
+        with self._lock:
+            if field not in self._indexes:
+                self._indexes[field] = {}
+                for key in self:
+                    value = self._field_value(dict.__getitem__(self, key), field)
+                    if value is not None:
+                        self._indexes[field].setdefault(value, set()).add(key)
+
+    def indexed(self, field):
+        return field in self._indexes
+
+    def find(self, field, value):
+        """
+        The cached objects whose field equals value (by index if there is one on that field, otherwise by scanning)
+        """
+        value = self._normalized(value)
+
+        with self._lock:
+            if field in self._indexes:
+                keys = list(self._indexes[field].get(value, ()))
+            else:
+                keys = [key for key in self if self._field_value(dict.__getitem__(self, key), field) == value]
+
+            return [obj for obj in (self.get(key) for key in keys) if obj is not None]
+
+    def _expired(self, key):
+        return self.ttl is not None and self._stamps[key] + self.ttl < time.time()
+
+    def _forget(self, key):
+        self._recency.pop(key, None)
+        self._stamps.pop(key, None)
+        self.bytes -= self._sizes.pop(key, 0)
+
+    def __getitem__(self, key):
+        with self._lock:
+            if not dict.__contains__(self, key):
+                self.misses += 1
+                raise KeyError(key)
+
+            if self._expired(key):
+                self.misses += 1
+                self.expirations += 1
+                self.intact = False
+                del self[key]
+                raise KeyError(key)
+
+            self.hits += 1
+
+            if self.max_entries or self.max_bytes:
+                del self._recency[key]
+                self._recency[key] = None
+
+            return dict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        with self._lock:
+            if not dict.__contains__(self, key):
+                return False
+            if self._expired(key):
+                self.expirations += 1
+                self.intact = False
+                del self[key]
+                return False
+            return True
+
+    has_key = __contains__
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        if self.entity_class is not None and isinstance(value, dict):
+            value = self.entity_class(value, self._strings)
+
+        with self._lock:
+            if self._indexes and dict.__contains__(self, key):
+                self._unindex(key, dict.__getitem__(self, key))
+
+            self._forget(key)
+            collections.OrderedDict.__setitem__(self, key, value)
+            self._index(key, value)
+
+            self._recency[key] = None
+            self._stamps[key] = time.time()
+
+            if self.max_bytes:
+                self._sizes[key] = len(json.dumps(value, default=_plain))
+                self.bytes += self._sizes[key]
+
+            self.expire()
+            self._evict()
+
+    def __delitem__(self, key):
+        with self._lock:
+            if self._indexes and dict.__contains__(self, key):
+                self._unindex(key, dict.__getitem__(self, key))
+
+            collections.OrderedDict.__delitem__(self, key)
+            self._forget(key)
+
+    def pop(self, key, *default):
+        with self._lock:
+            if dict.__contains__(self, key):
+                value = dict.__getitem__(self, key)
+                del self[key]
+                return value
+            if default:
+                return default[0]
+            raise KeyError(key)
+
+    def clear(self):
+        with self._lock:
+            collections.OrderedDict.clear(self)
+            self._recency.clear()
+            self._stamps.clear()
+            self._sizes.clear()
+            self._strings.clear()
+            for index in self._indexes.itervalues():
+                index.clear()
+            self.bytes = 0
+            self.intact = True
+
+    # iterating shouldn't count as using (or expire) every entry
+    def values(self):
+        return [dict.__getitem__(self, key) for key in self]
+
+    def items(self):
+        return [(key, dict.__getitem__(self, key)) for key in self]
+
+    def itervalues(self):
+        for key in self:
+            yield dict.__getitem__(self, key)
+
+    def iteritems(self):
+        for key in self:
+            yield (key, dict.__getitem__(self, key))
+
+    def copy(self):
+        cache = EntityCache(self.iteritems(), self.max_entries, self.max_bytes, self.ttl, self.entity_class)
+        for field in self._indexes:
+            cache.add_index(field)
+        return cache
+
+    # pickle and copy.deepcopy go through these, since the lock can't be pickled or copied: the copy gets a lock of
+    # its own, the same indexes and whether it's intact (but starts its counts, and its entries' ttl, afresh)
+    def __reduce__(self):
+        return (self.__class__, (self.items(), self.max_entries, self.max_bytes, self.ttl, self.entity_class),
+                {"indexes": list(self._indexes), "intact": self.intact})
+
+    def __setstate__(self, state):
+        for field in state["indexes"]:
+            self.add_index(field)
+        self.intact = state["intact"]
+
+    def expire(self):
+        """
+        Drops every entry older than ttl
+        """
+        if self.ttl is None:
+            return
+
+        with self._lock:
+            while self._stamps:
+                key = next(iter(self._stamps))
+                if not self._expired(key):
+                    break
+                self.expirations += 1
+                self.intact = False
+                del self[key]
+
+    def _evict(self):
+        while len(self) > 1 and ((self.max_entries and len(self) > self.max_entries) or
+                                 (self.max_bytes and self.bytes > self.max_bytes)):
+            key = next(iter(self._recency))
+            self.evictions += 1
+            self.intact = False
+            del self[key]
+
+    def stats(self):
+        return {"entries": len(self), "bytes": self.bytes, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "expirations": self.expirations}
+
+
+class ObjectStore(object):
+    """
+    SQLite file that keeps the session dicts (Customers, Items, ...) between QuickBooks instances and processes.
+    Objects are keyed by realm, type and Id, and an older SyncToken never overwrites a newer one.
+    Each (realm, type) also gets a sync mark: the changedSince from which CDC can bring the stored objects
+    up to date, so a warm start only has to fetch what's changed.
+    """
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS objects ("
+                                     "realm TEXT, qbbo TEXT, id TEXT, sync_token INTEGER, body TEXT, "
+                                     "PRIMARY KEY (realm, qbbo, id))")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS sync_marks ("
+                                     "realm TEXT, qbbo TEXT, mark TEXT, PRIMARY KEY (realm, qbbo))")
+            self._connection.commit()
+
+    def load(self, realm, qbbo):
+        """
+        Every stored object of this type, as (Id, object dict) pairs
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT id, body FROM objects WHERE realm = ? AND qbbo = ? ORDER BY rowid",
+                                            (realm, qbbo)).fetchall()
+
+        return [(Id, json.loads(body)) for Id, body in rows]
+
+    def put(self, realm, qbbo, objects):
+        rows = [(realm, qbbo, obj["Id"], int(obj.get("SyncToken") or 0), json.dumps(obj, default=_plain))
+                for obj in objects]
+
+        with self._lock:
+            self._connection.executemany("INSERT OR IGNORE INTO objects VALUES (?, ?, ?, ?, ?)", rows)
+            self._connection.executemany("UPDATE objects SET sync_token = ?, body = ? "
+                                         "WHERE realm = ? AND qbbo = ? AND id = ? AND sync_token <= ?",
+                                         [(token, body, realm, qbbo, Id, token) for _, _, Id, token, body in rows])
+            self._connection.commit()
+
+    def delete(self, realm, qbbo, ids):
+        with self._lock:
+            self._connection.executemany("DELETE FROM objects WHERE realm = ? AND qbbo = ? AND id = ?",
+                                         [(realm, qbbo, Id) for Id in ids])
+            self._connection.commit()
+
+    def get_mark(self, realm, qbbo):
+        with self._lock:
+            row = self._connection.execute("SELECT mark FROM sync_marks WHERE realm = ? AND qbbo = ?",
+                                           (realm, qbbo)).fetchone()
+        return row[0] if row else None
+
+    def set_mark(self, realm, qbbo, mark):
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO sync_marks VALUES (?, ?, ?)", (realm, qbbo, mark))
+            self._connection.commit()
+
+    def clear(self, realm, qbbo=None):
+        """
+        Forgets everything stored for this realm (or just this type of it)
+        """
+        with self._lock:
+            if qbbo is None:
+                self._connection.execute("DELETE FROM objects WHERE realm = ?", (realm,))
+                self._connection.execute("DELETE FROM sync_marks WHERE realm = ?", (realm,))
+            else:
+                self._connection.execute("DELETE FROM objects WHERE realm = ? AND qbbo = ?", (realm, qbbo))
+                self._connection.execute("DELETE FROM sync_marks WHERE realm = ? AND qbbo = ?", (realm, qbbo))
+            self._connection.commit()
+
+
+class ReportCache(object):
+    """
+    get_report's memo, for the QuickBooks instances given it as their report_cache (REPORT_CACHE is one to share):
+    reports keyed by realm, report name and params, served as they are for ttl seconds after they were fetched.
+    After that an instance may still reuse one if CDC says nothing's changed since (see get_report).
+    Creating, updating or deleting anything in a realm, or CDC turning up changes in it, drops its reports.
+    The least recently used reports go beyond max_entries.
+    """
+
+    def __init__(self, ttl=300, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        # {key: {"report": ..., "table": ReportTable or None, "fetched": time.time() of the fetch}}
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalized(value):
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            return value.isoformat()
+        if isinstance(value, (list, tuple, set)):
+            return ",".join(sorted(ReportCache._normalized(item) for item in value))
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        return unicode(value).strip()
+
+    @classmethod
+    def key(cls, realm, report_name, params):
+        return (str(realm), report_name,
+                tuple(sorted((key, cls._normalized(value)) for key, value in (params or {}).iteritems()
+                             if value is not None)))
+
+    def get(self, key, revalidate=None):
+        """
+        The entry for this key if it's within ttl, or if it's older but revalidate(entry) says it's still good
+        (None otherwise)
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+
+        if entry is not None and time.time() - entry["fetched"] > self.ttl:
+            if revalidate is not None and revalidate(entry):
+                entry["fetched"] = time.time()
+            else:
+                entry = None
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return entry
+
+    def put(self, key, report):
+        entry = {"report": report, "table": None, "fetched": time.time()}
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return entry
+
+    def invalidate(self, realm, report_name=None):
+        """
+        Drops this realm's reports (or just the ones of this name)
+        """
+        realm = str(realm)
+
+        with self._lock:
+            for key in [key for key in self._entries
+                        if key[0] == realm and (report_name is None or key[1] == report_name)]:
+                del self._entries[key]
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "invalidations": self.invalidations, "ttl": self.ttl}
+
+
+# a ReportCache for QuickBooks instances to share, e.g. QuickBooks(report_cache=REPORT_CACHE, ...)
+REPORT_CACHE = ReportCache()
+
+
+class ReportTable(object):
+    """
+    A report's rows flattened into columns: one per report column (named by its ColTitle), held in an array of
+    doubles if every value in it is a number (blanks become NaN) and in a list otherwise.
+    Alongside them, row_types says what each row is ("Data", or the "Header" and "Summary" of a section) and
+    groups gives the titles of the sections it's in, outermost first, joined with " / ".
+    Rows can be had as dicts (row(i), iteration); to_numpy() and to_pandas() need numpy/pandas installed.
+    """
+
+    def __init__(self, report):
+        self.name = report.get("Header", {}).get("ReportName")
+        self.header = report.get("Header", {})
+
+        self.columns = []
+        self.column_types = []
+        for index, column in enumerate((report.get("Columns") or {}).get("Column", [])):
+            self.columns.append(column.get("ColTitle") or "column_%d" % index)
+            self.column_types.append(column.get("ColType"))
+
+        self.row_types = []
+        self.groups = []
+        cells = [[] for column in self.columns]
+
+        def add(row_type, group, col_data):
+            self.row_types.append(row_type)
+            self.groups.append(" / ".join(group))
+            for index in range(len(cells)):
+                cells[index].append(col_data[index].get("value", "") if index < len(col_data) else "")
+
+        def walk(rows, group):
+            for row in rows:
+                if "ColData" in row:
+                    add(row.get("type", "Data"), group, row["ColData"])
+                    continue
+
+                header = (row.get("Header") or {}).get("ColData", [])
+                title = header[0].get("value", "") if header else row.get("group", "")
+
+                if header:
+                    add("Header", group, header)
+                walk((row.get("Rows") or {}).get("Row", []), group + [title])
+                if row.get("Summary"):
+                    add("Summary", group + [title], row["Summary"].get("ColData", []))
+
+        walk((report.get("Rows") or {}).get("Row", []), [])
+
+        self.data = collections.OrderedDict()
+        self.numeric = []
+        for name, values in zip(self.columns, cells):
+            numbers = self._numbers(values)
+            self.numeric.append(numbers is not None)
+            self.data[name] = numbers if numbers is not None else values
+
+    @staticmethod
+    def _numbers(values):
+        """
+        values as an array of doubles, or None if they aren't all numbers (or blank)
+        """
+        numbers = array.array("d")
+        seen_one = False
+
+        for value in values:
+            if value == "":
+                numbers.append(float("nan"))
+                continue
+            try:
+                numbers.append(float(value))
+            except ValueError:
+                return None
+            seen_one = True
+
+        return numbers if seen_one else None
+
+    def __len__(self):
+        return len(self.row_types)
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self.row(index)
+
+    def column(self, name):
+        return self.data[name]
+
+    def row(self, index):
+        row = dict((name, values[index]) for name, values in self.data.iteritems())
+        row["row_type"] = self.row_types[index]
+        row["group"] = self.groups[index]
+        return row
+
+    def to_numpy(self):
+        """
+        {column: numpy array}, float64 for the numeric columns and object for the rest
+        """
+        import numpy
+
+        arrays = collections.OrderedDict()
+        for name, values in self.data.iteritems():
+            if isinstance(values, array.array):
+                arrays[name] = numpy.frombuffer(values, dtype=numpy.float64).copy()
+            else:
+                arrays[name] = numpy.array(values, dtype=object)
+
+        arrays["row_type"] = numpy.array(self.row_types, dtype=object)
+        arrays["group"] = numpy.array(self.groups, dtype=object)
+        return arrays
+
+    def to_pandas(self):
+        import pandas
+
+        return pandas.DataFrame(self.to_numpy())
+
+
+class Query(object):
+    """
+    A QBO query statement, built up a clause at a time:
+        Query("Customer", ["Id", "SyncToken", "DisplayName"]).where("Active", "=", True)
+            .where_in("Id", ["1", "2"]).order_by("DisplayName")
+    str() of it is the statement (without the STARTPOSITION/MAXRESULTS _iter_fetch adds).
+    Values are escaped into literals, and field names are checked against SCHEMA: a field (or the first part of a
+    dotted one, like MetaData.LastUpdatedTime) has to be one of the entity's properties. Entities SCHEMA doesn't
+    list only need well-formed field names. Only top-level properties can be selected.
+    """
+
+    OPERATORS = ("=", "<", ">", "<=", ">=", "IN", "LIKE")
+
+    _FIELD = re.compile(r"^[A-Za-z][A-Za-z0-9_]*(\.[A-Za-z][A-Za-z0-9_]*)*$")
+
+    # properties every entity has
+    COMMON = ["Id", "SyncToken", "MetaData", "domain", "sparse"]
+
+    _TRANSACTION = ["DocNumber", "TxnDate", "PrivateNote", "TotalAmt", "Line", "LinkedTxn", "CurrencyRef",
+                    "ExchangeRate", "DepartmentRef", "TxnTaxDetail", "GlobalTaxCalculation"]
+    _PERSON = ["DisplayName", "Title", "GivenName", "MiddleName", "FamilyName", "Suffix", "PrintOnCheckName",
+               "Active", "PrimaryPhone", "Mobile", "Fax", "PrimaryEmailAddr", "WebAddr"]
+
+    SCHEMA = {
+        "Account": ["Name", "SubAccount", "ParentRef", "Description", "FullyQualifiedName", "Active",
+                    "Classification", "AccountType", "AccountSubType", "AcctNum", "CurrentBalance",
+                    "CurrentBalanceWithSubAccounts", "CurrencyRef", "TaxCodeRef"],
+        "Attachable": ["FileName", "Note", "Category", "ContentType", "Size", "AttachableRef", "TempDownloadUri",
+                       "FileAccessUri", "ThumbnailFileAccessUri", "Lat", "Long", "PlaceName", "Tag"],
+        "Bill": _TRANSACTION + ["VendorRef", "APAccountRef", "SalesTermRef", "DueDate", "Balance"],
+        "BillPayment": _TRANSACTION + ["VendorRef", "PayType", "CheckPayment", "CreditCardPayment", "APAccountRef"],
+        "Class": ["Name", "SubClass", "ParentRef", "FullyQualifiedName", "Active"],
+        "CompanyInfo": ["CompanyName", "LegalName", "CompanyAddr", "CustomerCommunicationAddr", "LegalAddr",
+                        "Country", "Email", "WebAddr", "PrimaryPhone", "FiscalYearStartMonth", "CompanyStartDate",
+                        "SupportedLanguages", "NameValue"],
+        "CreditMemo": _TRANSACTION + ["CustomerRef", "BillEmail", "BillAddr", "ShipAddr", "Balance",
+                                      "RemainingCredit", "ClassRef", "SalesTermRef", "CustomerMemo", "PrintStatus",
+                                      "EmailStatus", "DepositToAccountRef", "ApplyTaxAfterDiscount"],
+        "Customer": _PERSON + ["CompanyName", "FullyQualifiedName", "BillAddr", "ShipAddr", "Notes", "Job",
+                               "BillWithParent", "ParentRef", "Level", "Taxable", "Balance", "BalanceWithJobs",
+                               "CurrencyRef", "PreferredDeliveryMethod", "SalesTermRef", "PaymentMethodRef"],
+        "Department": ["Name", "SubDepartment", "ParentRef", "FullyQualifiedName", "Active"],
+        "Deposit": _TRANSACTION + ["DepositToAccountRef", "CashBack"],
+        "Employee": _PERSON + ["PrimaryAddr", "EmployeeNumber", "SSN", "BillableTime", "BillRate", "HiredDate",
+                               "ReleasedDate", "BirthDate", "Gender"],
+        "Estimate": _TRANSACTION + ["CustomerRef", "BillEmail", "BillAddr", "ShipAddr", "ExpirationDate",
+                                    "TxnStatus", "AcceptedBy", "AcceptedDate", "ClassRef", "SalesTermRef",
+                                    "CustomerMemo", "PrintStatus", "EmailStatus", "ApplyTaxAfterDiscount"],
+        "Invoice": _TRANSACTION + ["CustomerRef", "BillEmail", "BillAddr", "ShipAddr", "DueDate", "Balance",
+                                   "Deposit", "ClassRef", "SalesTermRef", "CustomerMemo", "PrintStatus",
+                                   "EmailStatus", "ShipDate", "TrackingNum", "DepositToAccountRef",
+                                   "AllowOnlineCreditCardPayment", "AllowOnlineACHPayment", "ApplyTaxAfterDiscount"],
+        "Item": ["Name", "Sku", "Description", "Active", "SubItem", "ParentRef", "Level", "FullyQualifiedName",
+                 "Taxable", "UnitPrice", "Type", "IncomeAccountRef", "ExpenseAccountRef", "AssetAccountRef",
+                 "PurchaseDesc", "PurchaseCost", "TrackQtyOnHand", "QtyOnHand", "InvStartDate"],
+        "JournalEntry": _TRANSACTION + ["Adjustment"],
+        "Payment": _TRANSACTION + ["CustomerRef", "DepositToAccountRef", "PaymentMethodRef", "PaymentRefNum",
+                                   "UnappliedAmt", "ARAccountRef", "ProcessPayment"],
+        "PaymentMethod": ["Name", "Active", "Type"],
+        "Preferences": ["AccountingInfoPrefs", "ProductAndServicesPrefs", "SalesFormsPrefs", "EmailMessagesPrefs",
+                        "VendorAndPurchasesPrefs", "TimeTrackingPrefs", "TaxPrefs", "CurrencyPrefs", "ReportPrefs",
+                        "OtherPrefs"],
+        "Purchase": _TRANSACTION + ["AccountRef", "PaymentType", "EntityRef", "Credit", "RemitToAddr",
+                                    "PrintStatus", "PaymentMethodRef"],
+        "PurchaseOrder": _TRANSACTION + ["VendorRef", "APAccountRef", "ClassRef", "SalesTermRef", "DueDate",
+                                         "POStatus", "VendorAddr", "ShipAddr", "ShipMethodRef", "POEmail", "Memo"],
+        "SalesReceipt": _TRANSACTION + ["CustomerRef", "BillEmail", "BillAddr", "ShipAddr", "DepositToAccountRef",
+                                        "PaymentMethodRef", "PaymentRefNum", "ClassRef", "CustomerMemo", "Balance",
+                                        "PrintStatus", "EmailStatus", "ApplyTaxAfterDiscount"],
+        "TaxCode": ["Name", "Description", "Active", "Taxable", "TaxGroup", "SalesTaxRateList",
+                    "PurchaseTaxRateList"],
+        "TaxRate": ["Name", "Description", "Active", "RateValue", "AgencyRef", "SpecialTaxType", "DisplayType"],
+        "Term": ["Name", "Active", "Type", "DueDays", "DiscountDays", "DiscountPercent", "DayOfMonthDue",
+                 "DiscountDayOfMonth", "DueNextMonthDays"],
+        "TimeActivity": ["TxnDate", "NameOf", "EmployeeRef", "VendorRef", "CustomerRef", "ItemRef", "ClassRef",
+                         "DepartmentRef", "PayrollItemRef", "BillableStatus", "Taxable", "HourlyRate", "Hours",
+                         "Minutes", "BreakHours", "BreakMinutes", "StartTime", "EndTime", "Description"],
+        "Vendor": _PERSON + ["CompanyName", "BillAddr", "OtherContactInfo", "TaxIdentifier", "TermRef", "AcctNum",
+                             "Vendor1099", "Balance", "CurrencyRef"],
+        "VendorCredit": _TRANSACTION + ["VendorRef", "APAccountRef", "Balance"],
+    }
+
+    def __init__(self, entity, fields=None):
+        self.entity = entity
+        self.fields = []
+        self.conditions = []
+        self.ordering = []
+
+        if fields:
+            self.select(*fields)
+
+    def _checked(self, field, selecting=False):
+        if not isinstance(field, basestring) or not self._FIELD.match(field):
+            raise ValueError("Not a field name: %r" % (field,))
+
+        if selecting and "." in field:
+            raise ValueError("Only top-level properties can be selected, not %s" % field)
+
+        known = self.SCHEMA.get(self.entity)
+        if known is not None and field.split(".")[0] not in known and field.split(".")[0] not in self.COMMON:
+            raise ValueError("%s has no property %s" % (self.entity, field))
+
+        return field
+
+    def select(self, *fields):
+        """
+        Adds fields to the projection (with none at all, it's SELECT *)
+        """
+        for field in fields:
+            field = self._checked(field, selecting=True)
+            if field not in self.fields:
+                self.fields.append(field)
+        return self
+
+    def where(self, field, operator, value):
+        """
+        ANDs "field operator value" onto the conditions (for IN, value is a list)
+        """
+        operator = operator.strip().upper()
+        if operator not in self.OPERATORS:
+            raise ValueError("Unsupported operator %r (use one of %s)" % (operator, ", ".join(self.OPERATORS)))
+
+        if operator == "IN":
+            return self.where_in(field, value)
+
+        self.conditions.append("%s %s %s" % (self._checked(field), operator, self.literal(value)))
+        return self
+
+    def where_in(self, field, values):
+        values = list(values)
+        if not values:
+            raise ValueError("IN needs at least one value")
+
+        self.conditions.append("%s IN (%s)" % (self._checked(field), ",".join(self.literal(v) for v in values)))
+        return self
+
+    def order_by(self, field, descending=False):
+        self.ordering.append(self._checked(field) + (" DESC" if descending else ""))
+        return self
+
+    @staticmethod
+    def literal(value):
+        """
+        value as a literal for a query statement
+        """
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        if isinstance(value, (int, long, float)):
+            return repr(value) if isinstance(value, float) else str(value)
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            value = value.isoformat()
+        return "'%s'" % unicode(value).replace("\\", "\\\\").replace("'", "\\'")
+
+    def __str__(self):
+        statement = "SELECT %s FROM %s" % (", ".join(self.fields) or "*", self.entity)
+
+        if self.conditions:
+            statement += " WHERE " + " AND ".join(self.conditions)
+        if self.ordering:
+            statement += " ORDERBY " + ", ".join(self.ordering)
+
+        return statement
+
+
+class Metrics(object):
+    """
+    Counters and latency histograms of the requests QuickBooks instances send, fed one event per try
+    (see QuickBooks._try_once):
+        qbo_requests_total{realm, entity, operation, status}    responses, by HTTP status
+        qbo_errors_total{realm, entity, operation}               tries that got no response at all
+        qbo_retries_total{realm, operation}                      tries after the first
+        qbo_throttled_total{realm}                               429s
+        qbo_bytes_sent_total, qbo_bytes_received_total{realm}
+        qbo_request_duration_seconds{realm, operation}           histogram
+    prometheus() renders them in Prometheus' text format and latency() sums the histograms up (to find slow realms,
+    say). With by_realm=False the realm label is left out, for processes talking to too many realms to keep
+    series for each.
+    """
+
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    _HELP = {"qbo_requests_total": "QBO responses, by HTTP status",
+             "qbo_errors_total": "QBO requests that got no response",
+             "qbo_retries_total": "QBO requests that were retries",
+             "qbo_throttled_total": "QBO requests throttled (HTTP 429)",
+             "qbo_bytes_sent_total": "Bytes of QBO request bodies",
+             "qbo_bytes_received_total": "Bytes of QBO response bodies",
+             "qbo_request_duration_seconds": "Time from sending a QBO request to having its response parsed"}
+
+    def __init__(self, buckets=BUCKETS, by_realm=True):
+        self.buckets = tuple(sorted(buckets))
+        self.by_realm = by_realm
+
+        self._counters = collections.OrderedDict()  # (name, labels): value
+        self._histograms = collections.OrderedDict()  # (name, labels): [count per bucket..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        self.observe(event)
+
+    def _add(self, name, labels, amount=1):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, event):
+        realm = str(event.get("realm", "")) if self.by_realm else ""
+        entity = event.get("entity") or ""
+        operation = event.get("operation") or ""
+
+        with self._lock:
+            if event.get("status") is None:
+                self._add("qbo_errors_total", (("realm", realm), ("entity", entity), ("operation", operation)))
+            else:
+                self._add("qbo_requests_total", (("realm", realm), ("entity", entity), ("operation", operation),
+                                                 ("status", str(event["status"]))))
+
+            if event.get("retries"):
+                self._add("qbo_retries_total", (("realm", realm), ("operation", operation)))
+            if event.get("throttled"):
+                self._add("qbo_throttled_total", (("realm", realm), ))
+
+            self._add("qbo_bytes_sent_total", (("realm", realm), ), event.get("bytes_sent") or 0)
+            self._add("qbo_bytes_received_total", (("realm", realm), ), event.get("bytes_received") or 0)
+
+            key = ("qbo_request_duration_seconds", (("realm", realm), ("operation", operation)))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+
+            elapsed = event.get("elapsed") or 0.0
+            histogram[bisect.bisect_left(self.buckets, elapsed)] += 1
+            histogram[-1] += elapsed
+
+    def counter(self, name, **labels):
+        """
+        The total of a counter over every series whose labels include these
+        """
+        with self._lock:
+            return sum(value for (key_name, key_labels), value in self._counters.iteritems()
+                       if key_name == name and set(labels.items()) <= set(key_labels))
+
+    def latency(self, realm=None, operation=None):
+        """
+        {"count", "mean", "p50", "p95", "p99"} of the request durations for this realm and/or operation (all of
+        them by default); the percentiles are interpolated within the histogram's buckets
+        """
+        combined = [0] * (len(self.buckets) + 1) + [0.0]
+
+        with self._lock:
+            for (name, labels), histogram in self._histograms.iteritems():
+                labels = dict(labels)
+                if (realm is None or labels["realm"] == str(realm)) and \
+                        (operation is None or labels["operation"] == operation):
+                    combined = [total + part for total, part in zip(combined, histogram)]
+
+        count = sum(combined[:-1])
+        summary = {"count": count, "mean": combined[-1] / count if count else None}
+
+        for label, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            summary[label] = self._percentile(combined[:-1], count, fraction) if count else None
+
+        return summary
+
+    def _percentile(self, counts, count, fraction):
+        wanted = fraction * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if bucket_count and seen + bucket_count >= wanted:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[index] - lower) * (wanted - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def realms(self):
+        """
+        [(realm, latency(realm))], slowest (by mean) first
+        """
+        with self._lock:
+            realms = set(dict(labels)["realm"] for name, labels in self._histograms)
+
+        summaries = [(realm, self.latency(realm)) for realm in realms]
+        return sorted(summaries, key=lambda summary: summary[1]["mean"], reverse=True)
+
+    @staticmethod
+    def _labels(labels):
+        return ",".join('%s="%s"' % (name, unicode(value).replace("\\", "\\\\").replace('"', '\\"')
+                                     .replace("\n", "\\n"))
+                        for name, value in labels if name != "realm" or value != "")
+
+    def prometheus(self):
+        """
+        Everything, in Prometheus' text exposition format
+        """
+        lines = []
+
+        with self._lock:
+            counters = self._counters.items()
+            histograms = [(key, list(histogram)) for key, histogram in self._histograms.iteritems()]
+
+        for name in sorted(set(name for (name, labels), value in counters)):
+            lines.append("# HELP %s %s" % (name, self._HELP.get(name, name)))
+            lines.append("# TYPE %s counter" % name)
+            for (key_name, labels), value in counters:
+                if key_name == name:
+                    lines.append("%s{%s} %s" % (name, self._labels(labels), value))
+
+        if histograms:
+            name = "qbo_request_duration_seconds"
+            lines.append("# HELP %s %s" % (name, self._HELP[name]))
+            lines.append("# TYPE %s histogram" % name)
+
+        for (name, labels), histogram in histograms:
+            cumulative = 0
+            for bound, bucket_count in zip([repr(bound) for bound in self.buckets] + ["+Inf"], histogram[:-1]):
+                cumulative += bucket_count
+                lines.append("%s_bucket{%s} %d" % (name, self._labels(labels + (("le", bound), )), cumulative))
+            lines.append("%s_sum{%s} %r" % (name, self._labels(labels), histogram[-1]))
+            lines.append("%s_count{%s} %d" % (name, self._labels(labels), cumulative))
+
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+# the Metrics every QuickBooks instance reports to unless it's given another
+METRICS = Metrics()
+
+
+class StatsdHook(object):
+    """
+    A post_request_hooks entry that sends every try to a StatsD daemon, over UDP, as
+        <prefix>.requests.<operation>.<status>:1|c      (status "error" if there was no response)
+        <prefix>.latency.<operation>:<ms>|ms
+        <prefix>.retries.<operation>:1|c, <prefix>.throttled:1|c
+        <prefix>.bytes_sent:<n>|c, <prefix>.bytes_received:<n>|c
+    With by_realm, the prefix is followed by "realm.<realm>". Send errors are ignored, as StatsD's are meant to be.
+    """
+
+    def __init__(self, host="localhost", port=8125, prefix="qbo", by_realm=False):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.by_realm = by_realm
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    @staticmethod
+    def _part(value):
+        return re.sub(r"[^A-Za-z0-9_-]", "_", unicode(value))
+
+    def __call__(self, event):
+        prefix = self.prefix
+        if self.by_realm:
+            prefix += ".realm." + self._part(event.get("realm", ""))
+
+        operation = self._part(event.get("operation") or "unknown")
+        status = self._part(event["status"]) if event.get("status") is not None else "error"
+
+        lines = ["%s.requests.%s.%s:1|c" % (prefix, operation, status),
+                 "%s.latency.%s:%d|ms" % (prefix, operation, (event.get("elapsed") or 0) * 1000)]
+
+        if event.get("retries"):
+            lines.append("%s.retries.%s:1|c" % (prefix, operation))
+        if event.get("throttled"):
+            lines.append("%s.throttled:1|c" % prefix)
+
+        lines.append("%s.bytes_sent:%d|c" % (prefix, event.get("bytes_sent") or 0))
+        lines.append("%s.bytes_received:%d|c" % (prefix, event.get("bytes_received") or 0))
+
+        try:
+            self._socket.sendto("\n".join(lines).encode("utf-8"), self.address)
+        except socket.error:
+            pass
 
 
 class QuickBooks():
@@ -37,13 +2170,16 @@ class QuickBooks():
     _NAME_LIST_OBJECTS = ["Account", "Class", "Customer", "Department", "Employee", "Item",
                           "PaymentMethod", "TaxCode", "TaxRate", "Term", "Vendor", ]
 
+    # what name lists are queried with when not told otherwise (so inactive, i.e. 'deleted', ones come too);
+    # it's still the whole list, as far as caching and syncing it goes
+    _ALL_NAMES_TAIL = "WHERE Active IN (true,false)"
+
     _TRANSACTION_OBJECTS = ["Bill", "BillPayment", "CreditMemo", "Deposit", "Estimate", "Invoice", "JournalEntry",
                             "Payment", "Purchase", "PurchaseOrder", "SalesReceipt", "TimeActivity", "VendorCredit"]
 
     # Added by Alex Maslakov for token refreshing (within 30 days of expiry)
     # This is known in Intuit's parlance as a "Reconnect"
     _attempts_count = 5
-    _namespace = "http://platform.intuit.com/api/v1"
     # See here for more:
     # https://developer.intuit.com/v2/docs/0100_accounting/
     # 0060_authentication_and_authorization/oauth_management_api
@@ -51,6 +2187,47 @@ class QuickBooks():
     # Things needed for authentication
     qbService = None
 
+    # ChangeDataCapture only looks this many days back, and returns at most this many objects of each type
+    _cdc_max_days = 30
+    _cdc_max_results = 1000
+
+    # what the session dicts of name list objects are indexed on (see find_by and is_object)
+    _INDEXED_FIELDS = ["Name", "DisplayName", "FullyQualifiedName", "PrimaryEmailAddr.Address", "AcctNum", "Sku"]
+
+    # longest query statement existing_ids will send
+    _max_query_length = 4000
+
+    # retries in hammer_it: at most max_tries attempts, backing off exponentially from backoff_base seconds up
+    # to backoff_max (unless QB sends a Retry-After); these faults won't go away by asking again, while these
+    # errors (the connection failing or timing out, or no pooled connection coming free) may well
+    max_tries = 10
+    backoff_base = 1.0
+    backoff_max = 60.0
+    _FATAL_FAULTS = ("ValidationFault", "AuthenticationFault", "AuthorizationFault")
+    _TRANSPORT_ERRORS = (requests.RequestException, EmptyPoolError)
+
+    # a sparse update that QB turns down because someone else changed the object first (its "Stale Object Error")
+    # is reapplied to a fresh read of it up to this many times; these properties are never part of the changes
+    stale_update_tries = 3
+    _STALE_OBJECT_CODE = "5010"
+    _UNCHANGEABLE_FIELDS = ("Id", "SyncToken", "sparse", "domain", "MetaData")
+
+    # downloads are written this many bytes at a time, and download_files tries each file this many times
+    download_chunk_size = 1024 * 1024
+    download_tries = 6
+
+    # streamed (JsonStream) responses are read this many bytes at a time
+    stream_chunk_size = 64 * 1024
+
+    # a semaphore shared by a group of instances (see QuickBooksPool) capping their requests in flight across
+    # all realms, on top of each realm's own limit; None for no such cap
+    request_slots = None
+
+    # one "Field = value" (or "Active IN (true,false)") condition of a WHERE clause, and the AND after it
+    _where_condition = re.compile(r"\s*(?:([\w.]+)\s*=\s*('(?:[^'\\]|\\.)*'|true|false|-?[\d.]+)"
+                                  r"|(Active)\s+IN\s*\(\s*(?:true\s*,\s*false|false\s*,\s*true)\s*\))\s*(?:AND\s+|$)",
+                                  re.I)
+
     #-------------------------------------------------------------------------------------------------------------------
     def __init__(self, **args):
         if 'cred_path' in args:
@@ -58,6 +2235,9 @@ class QuickBooks():
 
         self.is_sandbox = args.get('is_sandbox', False)
 
+        # e.g. "http://localhost:8000/v3" to talk to a stub server instead of Intuit
+        self.base_url = args.get('base_url', None)
+
         self.consumer_key = args.get('consumer_key', '')
         self.consumer_secret = args.get('consumer_secret', '')
         self.callback_url = args.get('callback_url', '')
@@ -78,12 +2258,62 @@ class QuickBooks():
 
         self.company_id = args.get('company_id', '0')
 
+        # what's logged goes to the "quickbooks2" logger, which the application configures (levels and handlers
+        # are process-wide, so no one instance sets them); verbosity is still accepted, but only kept
         self.verbosity = args.get('verbosity', 0)
+
+        # callables handed an event dict (see _try_once) before each try of a request is sent, and after it's done;
+        # metrics (a Metrics, or None) gets every finished one too
+        self.pre_request_hooks = list(args.get('pre_request_hooks', []))
+        self.post_request_hooks = list(args.get('post_request_hooks', []))
+        self.metrics = args.get('metrics', METRICS)
         self.error = None
 
+        # {qbbo: changedSince} for the types whose session dict holds every object QB has,
+        # so sync_objects can ask CDC for just what's changed since
+        self._sync_marks = {}
+
+        # optional ObjectStore (or the path of its SQLite file) the session dicts are read from and written through to
+        self.object_store = args.get('object_store', None)
+        if isinstance(self.object_store, basestring):
+            self.object_store = ObjectStore(self.object_store)
+
+        # {qbbo: {"max_entries": ..., "max_bytes": ..., "ttl": ...}} for the session dicts (see EntityCache);
+        # the "default" entry covers the types not listed. Unbounded if not given.
+        self.cache_limits = args.get('cache_limits', {})
+
+        # keep the session dicts of the big types (ENTITY_TYPES) as compact Entity objects instead of plain dicts:
+        # True for all of them, or a list of the types to
+        self.typed_entities = args.get('typed_entities', False)
+
+        # how many seconds a fully synced session dict counts as fresh enough to answer is_object(use_cache=True)
+        # without asking CDC for changes first; None means for as long as this instance lives
+        self.cache_max_age = args.get('cache_max_age', None)
+        self._synced_at = {}
+
+        # what decodes JSON responses (anything with json's loads will do), and whether query pages are decoded
+        # record by record as they arrive (see JsonStream) rather than once they're all in
+        self.json_codec = args.get('json_codec', json)
+        self.stream_responses = args.get('stream_responses', False)
+
+        # "json", or "xml" to have QB answer in XML (it's parsed into the same dicts either way)
+        self.response_format = args.get('response_format', 'json')
+
+        # where get_report keeps reports (a ReportCache, e.g. the process-wide REPORT_CACHE; None, the default,
+        # not to), and whether one past the cache's ttl is still used when CDC says nothing's changed since it was
+        # fetched (which is only asked for reports with a fixed start_date and end_date)
+        self.report_cache = args.get('report_cache', None)
+        self.report_revalidate = args.get('report_revalidate', False)
+
+        # whether update_object and update_objects send sparse updates (just what's changed since the cached copy)
+        # unless told otherwise
+        self.sparse_updates = args.get('sparse_updates', False)
+
     #-------------------------------------------------------------------------------------------------------------------
     @property
     def base_url_v3(self):
+        if self.base_url:
+            return self.base_url
         if self.is_sandbox:
             return "https://sandbox-quickbooks.api.intuit.com/v3"
         return "https://quickbooks.api.intuit.com/v3"
@@ -94,15 +2324,11 @@ class QuickBooks():
         days_diff = (self.expires_on - current_date).days
         if days_diff > 0:
             if days_diff <= self.reconnect_window_days_count:
-                print "Going to reconnect..."
-                import ipdb
-
-                ipdb.set_trace()
+                log.info("Going to reconnect...")
                 if self._reconnect():
-                    print "Reconnected successfully"
+                    log.info("Reconnected successfully")
                 else:
-                    print "Unable to reconnect, try again later, you have " \
-                          "{} days left to do that".format(days_diff)
+                    log.warning("Unable to reconnect, try again later, you have %d days left to do that", days_diff)
         else:
             raise Exception("The token is expired, unable to reconnect. Please get a new one.")
 
@@ -111,19 +2337,17 @@ class QuickBooks():
         """
         In case the caller of the QuickBooks session doesn't provide a callback
          function, new creds (after a reconnect) won't be ENTIRELY lost...
+         they're on this instance (access_token, access_token_secret, expires_on),
+         and the log says so, without the secrets themselves.
         """
-        print "NEW CREDENTIALS (POST RECONNECT):"
-        print "access_token:         {}".format(access_token)
-        print "access_token_secreat: {}".format(access_token_secret)
-        print "company_id:           {}".format(company_id)
-        print "expires_on:           {}".format(expires_on)
-        raw_input("Press <enter> to acknowledge and continue.")
+        log.warning("Credentials for company %s changed after a reconnect (access_token ...%s, expires_on %s); "
+                    "they're only on this QuickBooks instance, since no acc_token_changed_callback was given.",
+                    company_id, (access_token or "")[-4:], expires_on)
 
     #-------------------------------------------------------------------------------------------------------------------
     def _reconnect(self, i=1):
         if i > self._attempts_count:
-            print "Unable to reconnect, there're no attempts left " \
-                  "({} attempts sent).".format(i)
+            log.error("Unable to reconnect, there're no attempts left (%d attempts sent).", i)
             return False
         else:
             self._get_session()
@@ -134,35 +2358,20 @@ class QuickBooks():
                 self.company_id,
                 verify=False
             )
-            dom = minidom.parseString(ET.tostring(ET.fromstring(resp.content),
-                                                  "utf-8"))
+            reconnect = XmlStream(resp.content).parse()
             if resp.status_code == 200:
-                error_code = int(dom.getElementsByTagNameNS(
-                    self._namespace, "ErrorCode")[0].firstChild.nodeValue)
+                error_code = int(reconnect["ErrorCode"])
                 if error_code == 0:
-                    print "Reconnected successfully"
+                    log.info("Reconnected successfully")
 
-                    date_raw = dom.getElementsByTagNameNS(
-                        self._namespace, "ServerTime")[0].firstChild.nodeValue
+                    date_raw = reconnect["ServerTime"]
                     from dateutil import parser
 
                     added_date = parser.parse(date_raw).date()
                     self.expires_on = added_date + datetime.timedelta(days=180)
 
-                    self.access_token = str(dom.getElementsByTagNameNS(
-                        self._namespace, "OAuthToken")[0].firstChild.nodeValue)
-                    self.access_token_secret = str(dom.getElementsByTagNameNS(
-                        self._namespace,
-                        "OAuthTokenSecret")[0].firstChild.nodeValue)
-
-                    if self.verbosity > 9 or \
-                            not self.acc_token_changed_callback:
-                        print "at, ats, cid, expires_on:"
-                        print self.access_token
-                        print self.access_token_secret
-                        print self.company_id
-                        print self.expires_on
-                        raw_input("Press <enter> to continue")
+                    self.access_token = str(reconnect["OAuthToken"])
+                    self.access_token_secret = str(reconnect["OAuthTokenSecret"])
 
                     self.acc_token_changed_callback(
                         self.access_token,
@@ -174,24 +2383,21 @@ class QuickBooks():
                     return True
 
                 else:
-                    msg = str(dom.getElementsByTagNameNS(
-                        self._namespace,
-                        "ErrorMessage")[0].firstChild.nodeValue)
+                    msg = str(reconnect["ErrorMessage"])
 
-                    print "An error occurred while trying to reconnect, code:" \
-                          "{}, message: \"{}\"".format(error_code, msg)
+                    log.warning("An error occurred while trying to reconnect, code: %s, message: \"%s\"",
+                                error_code, msg)
 
                     i += 1
 
-                    print "Trying to reconnect again... attempt #{}".format(i)
+                    log.info("Trying to reconnect again... attempt #%d", i)
 
-                    self._reconnect(i)
+                    return self._reconnect(i)
             else:
-                print "An HTTP error {} occurred,".format(resp.status_code) \
-                      + "trying again, attempt #{}".format(i)
+                log.warning("An HTTP error %s occurred, trying again, attempt #%d", resp.status_code, i)
 
                 i += 1
-                self._reconnect(i)
+                return self._reconnect(i)
 
     #-------------------------------------------------------------------------------------------------------------------
     def _get_session(self):
@@ -243,12 +2449,16 @@ class QuickBooks():
 
     #-------------------------------------------------------------------------------------------------------------------
     def create_session(self):
+        """
+        A session signing with this instance's tokens, on the connection pools every instance shares
+        """
         if self.consumer_secret and self.consumer_key and \
                 self.access_token_secret and self.access_token:
             self.session = OAuth1Session(self.consumer_key,
                                          self.consumer_secret,
                                          self.access_token,
                                          self.access_token_secret)
+            PooledTransport.shared().mount(self.session)
 
         else:
 
@@ -261,37 +2471,166 @@ class QuickBooks():
         return self.session
 
     #-------------------------------------------------------------------------------------------------------------------
-    def _fetch(self, r_type, qb_object, original_payload='', batch_size=500):
+    def _fetch(self, r_type, qb_object, original_payload='', batch_size=500, limit=None):
         """
         Wrapper script around keep_trying to fetch more results if there are more.
         batch_size = 500 is the maximum number of results returned by QB
         """
-        start_position = 1
-        more = True
-        data_set = []
+        return list(self._iter_fetch(r_type, qb_object, original_payload, batch_size, limit))
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _iter_fetch(self, r_type, qb_object, original_payload='', batch_size=500, limit=None, prefetch=True,
+                    first_position=1):
+        """
+        Generator version of _fetch: yields the records page by page instead of building one big list.
+        A short page (fewer rows than asked for) is the last one. With prefetch, the next page is already
+        being requested on a background thread while the caller works through the current one.
+        limit caps the total number of records returned (None means all of them).
+        With stream_responses, each page is decoded as it arrives instead, and there's no prefetching.
+        """
         url = self.base_url_v3 + "/company/%s/query" % self.company_id
 
-        payload = '%s MAXRESULTS %d' % (original_payload, batch_size)
+        def payload_for(start, size):
+            if start == 1:
+                return '%s MAXRESULTS %d' % (original_payload, size)
+            return "%s STARTPOSITION %d MAXRESULTS %d" % (original_payload, start, size)
 
-        while more:
-            r_dict = self.hammer_it(r_type, url, payload, 'text')
+        def page_size(start):
+            if limit is None:
+                return batch_size
+            return min(batch_size, limit - (start - first_position))
 
-            try:
-                more = len(r_dict['QueryResponse'][qb_object]) > batch_size
-            except:
-                return data_set
+        start_position = first_position
+        size = page_size(start_position)
+        pending = None
 
-            if self.verbosity > 2:
-                print "(batch begins with record %d)" % start_position
+        while size > 0:
+            if pending is not None:
+                page = pending.get()
+            else:
+                page = self._fetch_page(r_type, url, payload_for(start_position, size), qb_object,
+                                        self.stream_responses)
 
-            start_position += batch_size
-            payload = "%s STARTPOSITION %d MAXRESULTS %d" % (original_payload, start_position, batch_size)
+            log.debug("(batch begins with record %d)", start_position)
 
-            data_set += r_dict['QueryResponse'][qb_object]
+            next_position = start_position + size
 
-        return data_set
+            if isinstance(page, (JsonStream, XmlStream)):
+                # how many records it has is only known once they've all been read
+                # (and if the caller stops before then, its connection has to go back to the pool all the same)
+                try:
+                    for record in page:
+                        yield record
+                finally:
+                    page.close()
 
-    #-------------------------------------------------------------------------------------------------------------------
+                start_position, size = next_position, page_size(next_position) if page.count >= size else 0
+                continue
+
+            next_size = page_size(next_position) if len(page) >= size else 0
+
+            # start on the next page before handing this one over
+            pending = None
+            if prefetch and next_size > 0:
+                pending = _run_in_thread(self._fetch_page, r_type, url, payload_for(next_position, next_size),
+                                         qb_object)
+
+            for record in page:
+                yield record
+
+            start_position, size = next_position, next_size
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _fetch_page(self, r_type, url, payload, qb_object, stream=False):
+        """
+        Runs one STARTPOSITION/MAXRESULTS window of a query and returns its records.
+        An empty list means there's nothing (more) to get, including when QB answered with a Fault.
+        With stream, the records come as a JsonStream, decoded as they arrive.
+        """
+        if stream:
+            r_dict = self.hammer_it(r_type, url, payload, 'text', stream_path="QueryResponse." + qb_object)
+            if isinstance(r_dict, (JsonStream, XmlStream)):
+                return r_dict
+        else:
+            r_dict = self.hammer_it(r_type, url, payload, 'text')
+
+        return self._page_records(r_dict, qb_object)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _page_records(self, r_dict, qb_object):
+        """
+        The records in one page of a query response
+        """
+        try:
+            return r_dict['QueryResponse'].get(qb_object, [])
+        except:
+            return []
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _count(self, r_type, original_payload):
+        """
+        Runs the COUNT(*) version of a query (same FROM and WHERE, no ORDERBY) and returns QB's totalCount.
+        """
+        url = self.base_url_v3 + "/company/%s/query" % self.company_id
+
+        payload = re.sub(r"^\s*SELECT\s+.+?\s+FROM\s+", "SELECT COUNT(*) FROM ", original_payload, flags=re.I | re.S)
+        payload = re.split(r"\s+ORDERBY\s+", payload, flags=re.I)[0]
+
+        r_dict = self.hammer_it(r_type, url, payload, 'text')
+
+        try:
+            return int(r_dict['QueryResponse']['totalCount'])
+        except:
+            return 0
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _iter_fetch_parallel(self, r_type, qb_object, original_payload='', batch_size=500,
+                             workers=MAX_CONCURRENT_REQUESTS):
+        """
+        Like _iter_fetch, but counts the matching records first, plans every STARTPOSITION/MAXRESULTS window up
+        front and fetches up to `workers` of them at once (never more than MAX_CONCURRENT_REQUESTS).
+        Pages are still yielded in order, and only about `workers` pages are held in memory at a time.
+        """
+        url = self.base_url_v3 + "/company/%s/query" % self.company_id
+
+        total = self._count(r_type, original_payload)
+        workers = max(1, min(workers, MAX_CONCURRENT_REQUESTS))
+
+        if total <= batch_size or workers == 1:
+            for record in self._iter_fetch(r_type, qb_object, original_payload, batch_size):
+                yield record
+            return
+
+        windows = collections.deque(range(1, total + 1, batch_size))
+
+        log.debug("Fetching %d %ss in %d pages, %d at a time.", total, qb_object, len(windows), workers)
+
+        pool = ThreadPool(workers)
+        in_flight = collections.deque()
+        last_page_full = False
+
+        try:
+            while windows or in_flight:
+                while windows and len(in_flight) < workers:
+                    start_position = windows.popleft()
+                    payload = "%s STARTPOSITION %d MAXRESULTS %d" % (original_payload, start_position, batch_size)
+                    in_flight.append(pool.apply_async(self._fetch_page, (r_type, url, payload, qb_object)))
+
+                page = in_flight.popleft().get()
+                last_page_full = len(page) >= batch_size
+
+                for record in page:
+                    yield record
+
+        finally:
+            pool.terminate()
+
+        # records added since the COUNT ran end up past the planned windows
+        if last_page_full:
+            for record in self._iter_fetch(r_type, qb_object, original_payload, batch_size, first_position=total + 1):
+                yield record
+
+    #-------------------------------------------------------------------------------------------------------------------
     def create_object(self, qbbo, create_dict, content_type="json"):
         """
         One of the four glorious CRUD functions.
@@ -305,9 +2644,17 @@ class QuickBooks():
 
         url = "%s/company/%s/%s" % (self.base_url_v3, self.company_id, qbbo.lower())
 
-        request_body = json.dumps(create_dict, indent=4)
+        request_body = _compact_json(create_dict)
         response = self.hammer_it("POST", url, request_body, content_type)
 
+        return self._created_object(qbbo, response)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _created_object(self, qbbo, response):
+        """
+        Second half of create_object: picks the new object out of QB's response and caches it
+        """
+
         if qbbo in response:
             new_object = response[qbbo]
 
@@ -318,27 +2665,53 @@ class QuickBooks():
                 self.error = 'Unable to create client'
             return None
 
+        self._cache_object(qbbo, new_object)
+
+        return new_object
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _cache_object(self, qbbo, new_object):
+        """
+        Puts a newly created or updated object into the session's dict of that type
+        (pulling the whole dict first if this session hasn't got one yet)
+        """
         new_Id = new_object["Id"]
 
         attr_name = qbbo + "s"
 
         if not hasattr(self, attr_name):
 
-            if self.verbosity > 2:
-                print "Creating a %ss attribute for this session." % qbbo
+            log.debug("Creating a %ss attribute for this session.", qbbo)
 
             self.get_objects(qbbo).update({new_Id: new_object})
 
         else:
 
-            if self.verbosity > 8:
-                print "Adding this new %s to the existing set of them." \
-                      % qbbo
-                print json.dumps(new_object, indent=4)
+            log.debug("Adding this new %s to the existing set of them: %s", qbbo,
+                      json.dumps(new_object, indent=4, default=_plain))
 
             getattr(self, attr_name)[new_Id] = new_object
 
-        return new_object
+        if self.object_store is not None:
+            self.object_store.put(self.company_id, qbbo, [new_object])
+
+        if self.report_cache is not None:
+            self.report_cache.invalidate(self.company_id)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _uncache_object(self, qbbo, Id):
+        """
+        Drops a deleted object from the session's dict of that type, if there is one
+        """
+        attr_name = qbbo + "s"
+        if hasattr(self, attr_name):
+            getattr(self, attr_name).pop(Id, None)
+
+        if self.object_store is not None:
+            self.object_store.delete(self.company_id, qbbo, [Id])
+
+        if self.report_cache is not None:
+            self.report_cache.invalidate(self.company_id)
 
     #-------------------------------------------------------------------------------------------------------------------
     def read_object(self, qbbo, object_id, content_type="json"):
@@ -352,29 +2725,43 @@ class QuickBooks():
 
         url = "%s/company/%s/%s/%s" % (self.base_url_v3, self.company_id, qbbo.lower(), Id)
 
-        if self.verbosity > 1:
-            print "Reading %s %s." % (qbbo, Id)
+        log.info("Reading %s %s.", qbbo, Id)
 
         response = self.hammer_it("GET", url, None, content_type)
 
+        return self._read_result(qbbo, response)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _read_result(self, qbbo, response):
+        """
+        Second half of read_object
+        """
+
         if qbbo not in response:
-            if self.verbosity > 0:
-                print "It looks like the read failed. Here's the result:"
-                print response
+            log.info("It looks like the read failed. Here's the result: %s", response)
             return None
 
         return response[qbbo]
 
     #-------------------------------------------------------------------------------------------------------------------
-    def update_object(self, qbbo, Id, update_dict, content_type="json"):
+    def update_object(self, qbbo, Id, update_dict, content_type="json", sparse=None):
         """
         Generally before calling this, you want to call the read_object
         command on what you want to update. The alternative is forming a valid
         update request_body from scratch, which doesn't look like fun to me.
+        With sparse (sparse_updates if not given), only the properties that differ
+        from the session's copy of the object are sent (see _sparse_update);
+        properties update_dict leaves out are left alone rather than cleared.
         """
         qbbo = self._validate_object_name(qbbo)
         Id = str(Id).replace(".0", "")
 
+        if sparse is None:
+            sparse = self.sparse_updates
+
+        if sparse:
+            return self._sparse_update_object(qbbo, Id, update_dict, content_type)
+
         """
         url = "https://qb.sbfinance.intuit.com/v3/company/%s/%s" % \
               (self.company_id, qbbo.lower()) + "?operation=update"
@@ -395,46 +2782,147 @@ class QuickBooks():
         # NO! DON'T DO THAT, THEN YOU CAN'T DELETE STUFF YOU WANT TO DELETE!
 
         e_dict = update_dict
-        request_body = json.dumps(e_dict, indent=4)
+        request_body = _compact_json(e_dict)
 
-        if self.verbosity > 0:
+        log.info("About to update %s Id %s with this request_body: %s", qbbo, Id, request_body)
 
-            print "About to update %s Id %s with this request_body:" \
-                  % (qbbo, Id)
+        response = self.hammer_it("POST", url, request_body, content_type)
 
-            print request_body
+        return self._updated_object(qbbo, Id, response)
 
-            if self.verbosity > 9:
-                raw_input("Waiting...")
+    #-------------------------------------------------------------------------------------------------------------------
+    def _sparse_update_object(self, qbbo, Id, update_dict, content_type="json", stale=False):
+        """
+        update_object as a sparse update, which is tried again on a fresh read of the object
+        (up to stale_update_tries times) if someone else has changed it in the meantime.
+        stale says the session's copy is already known to be out of date.
+        (It reads with QuickBooks.read_object, since this blocks either way, and update_objects uses it on
+        AsyncQuickBooks too, whose read_object hands back a future.)
+        Only what was changed from the copy the update was made against is reapplied, so whatever else someone
+        has changed in the meantime stays changed.
+        """
+        url = "%s/company/%s/%s" % (self.base_url_v3, self.company_id, qbbo.lower())
 
-        response = self.hammer_it("POST", url, request_body, content_type)
+        if stale:
+            current = QuickBooks.read_object(self, qbbo, Id)
+            if current is None:
+                return None
+        else:
+            current = self._cached_copy(qbbo, Id, update_dict)
 
-        if qbbo in response:
+        changes = self._sparse_update(Id, update_dict, current)
+        tries = 0
 
-            new_object = response[qbbo]
+        while True:
+            tries += 1
 
-        else:
-            if self.verbosity > 0:
-                print "It looks like the update failed. Here's the result:"
-                print response
+            if changes is None:
+                log.info("%s Id %s is already up to date; not updating it.", qbbo, Id)
+                return current.to_dict() if isinstance(current, Entity) else current
 
+            request_body = _compact_json(changes)
+            log.info("About to update %s Id %s with this sparse request_body: %s", qbbo, Id, request_body)
+
+            response = self.hammer_it("POST", url, request_body, content_type)
+
+            if not self._stale_update(response) or tries >= self.stale_update_tries:
+                break
+
+            log.info("%s Id %s was changed by someone else; reapplying the update to a fresh read of it.", qbbo, Id)
+
+            current = QuickBooks.read_object(self, qbbo, Id)
+            if current is None:
+                break
+
+            changes = self._sparse_update(Id, changes, current)
+
+        return self._updated_object(qbbo, Id, response)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _cached_copy(self, qbbo, Id, update_dict):
+        """
+        The session's copy of the object update_dict is an edited version of (the dict or Entity itself, so
+        _sparse_update can tell what update_dict shares with it), or None if there's no telling what was changed:
+        it isn't cached, it's update_dict itself (edited in place), or its SyncToken isn't the one update_dict was
+        edited from
+        """
+        cached = getattr(self, qbbo + "s", {}).get(Id)
+
+        if cached is None or cached is update_dict:
             return None
 
-        attr_name = qbbo + "s"
+        if "SyncToken" in update_dict and str(update_dict["SyncToken"]) != str(cached.get("SyncToken")):
+            return None
 
-        if not hasattr(self, attr_name):
-            if self.verbosity > 2:
-                print "Creating a %ss attribute for this session." % qbbo
+        return cached
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _sparse_update(self, Id, update_dict, current=None):
+        """
+        The dict to send as a sparse update setting update_dict's properties: with current (the object as QB has
+        it), just those that differ from it (see _changed) and current's SyncToken, otherwise all of them and
+        update_dict's. None if there's nothing to change.
+        """
+        if isinstance(update_dict, Entity):
+            update_dict = update_dict.to_dict()
+
+        changes = dict((key, value) for key, value in update_dict.iteritems()
+                       if key not in self._UNCHANGEABLE_FIELDS and
+                       (current is None or self._changed(value, current.get(key))))
+
+        if not changes and current is not None:
+            return None
+
+        changes.update(Id=Id, SyncToken=(current or update_dict).get("SyncToken"), sparse=True)
+
+        return changes
+
+    #-------------------------------------------------------------------------------------------------------------------
+    @classmethod
+    def _changed(cls, value, cached):
+        """
+        Whether value may differ from the cached one: it isn't equal to it, or it holds a dict or list that's one
+        of the cached one's own (as after dict(qb.Customers[Id]), whose BillAddr is the cached one), which may have
+        been edited in place, and so changed the cache along with it
+        """
+        if value is cached:
+            return isinstance(value, (dict, list))
+
+        if isinstance(value, dict) and isinstance(cached, dict):
+            if any(cls._changed(item, cached[key]) for key, item in value.iteritems() if key in cached):
+                return True
+        elif isinstance(value, list) and isinstance(cached, list):
+            if any(cls._changed(item, cached_item) for item, cached_item in zip(value, cached)):
+                return True
+
+        return value != cached
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _stale_update(self, response):
+        """
+        Whether QB turned an update down because the object's SyncToken was out of date
+        """
+        if not isinstance(response, dict) or not isinstance(response.get("Fault"), dict):
+            return False
+
+        return any(str(error.get("code")) == self._STALE_OBJECT_CODE for error in response["Fault"].get("Error", []))
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _updated_object(self, qbbo, Id, response):
+        """
+        Second half of update_object: picks the updated object out of QB's response and caches it
+        """
+
+        if qbbo in response:
 
-            self.get_objects(qbbo)
+            new_object = response[qbbo]
 
         else:
-            if self.verbosity > 8:
-                print "Adding this new %s to the existing set of them." \
-                      % qbbo
-                print json.dumps(new_object, indent=4)
+            log.info("It looks like the update failed. Here's the result: %s", response)
+
+            return None
 
-            getattr(self, attr_name)[Id] = new_object
+        self._cache_object(qbbo, new_object)
 
         return new_object
 
@@ -454,27 +2942,173 @@ class QuickBooks():
                 raise Exception("Need either an Id or an existing object dict!")
 
         if 'Id' not in json_dict:
-            print json.dumps(json_dict, indent=4)
-            raise Exception("No Id attribute found in the above dict!")
+            raise Exception("No Id attribute found in %s!" % json.dumps(json_dict, indent=4, default=_plain))
 
-        request_body = json.dumps(json_dict, indent=4)
+        request_body = _compact_json(json_dict)
 
         url = "%s/company/%s/%s" % (self.base_url_v3, self.company_id, qbbo.lower())
 
-        if self.verbosity > 0:
-            print "Deleting %s %s." % (qbbo, Id)
+        log.info("Deleting %s %s.", qbbo, Id)
 
         response = self.hammer_it("POST", url, request_body, content_type, **{"params": {"operation": "delete"}})
 
+        return self._deleted_object(qbbo, Id, response)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _deleted_object(self, qbbo, Id, response):
+        """
+        Second half of delete_object: drops the object from the cache if QB says it's gone
+        """
+
         if qbbo not in response:
             return response
 
-        attr_name = qbbo + "s"
-        if hasattr(self, attr_name):
-            del (getattr(self, qbbo + "s")[Id])
+        self._uncache_object(qbbo, Id)
 
         return response[qbbo]
 
+    #-------------------------------------------------------------------------------------------------------------------
+    def batch(self, operations, workers=MAX_CONCURRENT_REQUESTS, content_type="json"):
+        """
+        Runs many operations through QBO's batch endpoint, MAX_BATCH_ITEMS to a request and up to `workers`
+        requests at a time.
+        operations is a list of ("create" | "update" | "delete", qbbo, object_dict) or ("query", query_string)
+        Returns one result per operation, in the same order: the object QB sent back (the QueryResponse for a
+        query), or {"Fault": ...} if that item failed. The session's dicts are kept up to date the same way
+        create_object, update_object and delete_object do it.
+        """
+        items = []
+
+        for bId, operation in enumerate(operations):
+            if operation[0] == "query":
+                items.append({"bId": str(bId), "Query": operation[1]})
+            else:
+                op, qbbo, object_dict = operation
+                items.append({"bId": str(bId), "operation": op, self._validate_object_name(qbbo): object_dict})
+
+        chunks = [items[i:i + MAX_BATCH_ITEMS] for i in range(0, len(items), MAX_BATCH_ITEMS)]
+
+        url = "%s/company/%s/batch" % (self.base_url_v3, self.company_id)
+
+        def send(chunk):
+            return self.hammer_it("POST", url, _compact_json({"BatchItemRequest": chunk}), content_type)
+
+        log.debug("Sending %d operations in %d batches.", len(items), len(chunks))
+
+        results = [None] * len(items)
+
+        pool = None
+        if workers > 1 and len(chunks) > 1:
+            pool = ThreadPool(min(workers, len(chunks)))
+            responses = pool.imap(send, chunks)
+        else:
+            responses = itertools.imap(send, chunks)
+
+        try:
+            for chunk, response in itertools.izip(chunks, responses):
+                item_responses = {}
+                if isinstance(response, dict):
+                    for item_response in response.get("BatchItemResponse", []):
+                        item_responses[item_response.get("bId")] = item_response
+
+                for item in chunk:
+                    results[int(item["bId"])] = self._batch_item_result(item, item_responses.get(item["bId"]),
+                                                                        response)
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        return results
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _batch_item_result(self, item, item_response, response):
+        """
+        What batch() hands back for one item, given QB's BatchItemResponse for it (and the whole response,
+        for when the batch failed as a whole)
+        """
+        if item_response is None:
+            if isinstance(response, dict) and "Fault" in response:
+                return {"Fault": response["Fault"]}
+            return {"Fault": {"type": "(synthetic, inconclusive)",
+                              "Error": [{"Detail": "No response for batch item %s" % item["bId"]}]}}
+
+        if "Fault" in item_response:
+            return {"Fault": item_response["Fault"]}
+
+        if "Query" in item:
+            return item_response.get("QueryResponse", {})
+
+        operation = item["operation"]
+        qbbo = [key for key in item if key not in ("bId", "operation")][0]
+        new_object = item_response.get(qbbo)
+
+        if new_object is None:
+            return {"Fault": {"type": "(synthetic, inconclusive)",
+                              "Error": [{"Detail": "No %s in the response to batch item %s" % (qbbo, item["bId"])}]}}
+
+        if operation == "delete":
+            self._uncache_object(qbbo, new_object["Id"])
+        else:
+            self._cache_object(qbbo, new_object)
+
+        return new_object
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def create_objects(self, qbbo, create_dicts, workers=MAX_CONCURRENT_REQUESTS):
+        """
+        create_object for a whole list, through the batch endpoint. See batch() for what comes back.
+        """
+        return self.batch([("create", qbbo, create_dict) for create_dict in create_dicts], workers)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def update_objects(self, qbbo, update_dicts, workers=MAX_CONCURRENT_REQUESTS, sparse=None):
+        """
+        update_object for a whole list (each dict needs its Id and SyncToken), through the batch endpoint.
+        With sparse (sparse_updates if not given), each is sent as update_object would send it: the ones already
+        up to date aren't sent at all (their cached copy is what comes back), and the ones someone else changed
+        in the meantime are retried one at a time.
+        """
+        if sparse is None:
+            sparse = self.sparse_updates
+
+        if not sparse:
+            return self.batch([("update", qbbo, update_dict) for update_dict in update_dicts], workers)
+
+        qbbo = self._validate_object_name(qbbo)
+
+        results = []
+        pending = []  # (position, Id, changes)
+
+        for position, update_dict in enumerate(update_dicts):
+            Id = str(update_dict["Id"]).replace(".0", "")
+            current = self._cached_copy(qbbo, Id, update_dict)
+            changes = self._sparse_update(Id, update_dict, current)
+
+            results.append(current.to_dict() if isinstance(current, Entity) else current)
+            if changes is not None:
+                pending.append((position, Id, changes))
+
+        updated = self.batch([("update", qbbo, item_changes) for _, _, item_changes in pending], workers)
+
+        for (position, Id, changes), result in itertools.izip(pending, updated):
+            if self._stale_update(result):
+                log.info("%s Id %s was changed by someone else; reapplying the update to a fresh read of it.",
+                         qbbo, Id)
+                retried = self._sparse_update_object(qbbo, Id, changes, stale=True)
+                if retried is not None:
+                    result = retried
+
+            results[position] = result
+
+        return results
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def delete_objects(self, qbbo, json_dicts, workers=MAX_CONCURRENT_REQUESTS):
+        """
+        delete_object for a whole list of objects (at least Id and SyncToken each), through the batch endpoint
+        """
+        return self.batch([("delete", qbbo, json_dict) for json_dict in json_dicts], workers)
+
     #-------------------------------------------------------------------------------------------------------------------
     def upload_file(self, path, name="same", upload_type="automatic", qbbo=None, Id=None):
         """
@@ -485,23 +3119,84 @@ class QuickBooks():
 
         url = "%s/company/%s/upload" % (self.base_url_v3, self.company_id)
 
-        bare_name, extension = path.rsplit("/", 1)[-1].rsplit(".", 1)
+        result = self.hammer_it("POST", url, None, "multipart/formdata",
+                                file_name=self._upload_body(path, name, upload_type, qbbo, Id))
 
-        if upload_type == "automatic":
-            upload_type = "application/%s" % extension
+        uploaded = self._uploaded_attachable(result)
+        if "Fault" in uploaded:
+            raise Exception("Upload of %s failed: %s" % (path, json.dumps(uploaded["Fault"])))
+
+        return uploaded["Attachable"]["Id"]
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def upload_files(self, uploads, workers=MAX_CONCURRENT_REQUESTS):
+        """
+        upload_file for many files at once, up to `workers` at a time (and within the realm's rate limits).
+        uploads are (path, qbbo, Id) tuples; each file is linked to that transaction (or other entity), or to nothing
+        if qbbo and Id are None.
+        Returns one result per upload, in the same order: the new Attachable's Id, or {"Fault": ...} if it failed.
+        """
+        url = "%s/company/%s/upload" % (self.base_url_v3, self.company_id)
+
+        def upload(item):
+            path, qbbo, Id = item
+
+            try:
+                result = self.hammer_it("POST", url, None, "multipart/formdata",
+                                        file_name=self._upload_body(path, qbbo=qbbo, Id=Id))
+            except Exception as e:
+                return {"Fault": {"type": "(synthetic, upload failed)", "Error": [{"Detail": str(e)}]}}
+
+            uploaded = self._uploaded_attachable(result)
+            if "Fault" in uploaded:
+                return {"Fault": uploaded["Fault"]}
 
+            return uploaded["Attachable"]["Id"]
+
+        log.debug("Uploading %d files.", len(uploads))
+
+        return self._pool_map(upload, list(uploads), workers)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _upload_body(self, path, name="same", upload_type="automatic", qbbo=None, Id=None):
+        """
+        The multipart body for uploading path: the file itself, after the Attachable QB should make for it
+        (named name, of type upload_type, and linked to the qbbo with this Id if they're given).
+        path can also be an open file or a FileData.
+        """
         if name == "same":
-            name = bare_name
+            name = os.path.basename(path if isinstance(path, basestring) else getattr(path, "name", None) or "upload")
+
+        if upload_type == "automatic":
+            extension = os.path.splitext(name)[1].lstrip(".") or "octet-stream"
+            upload_type = mimetypes.guess_type(name)[0] or "application/%s" % extension
 
-        result = self.hammer_it("POST", url, None, "multipart/formdata", file_name=path)
+        attachable = {"FileName": name, "ContentType": upload_type}
 
-        attachment_id = result["AttachableResponse"][0]["Attachable"]["Id"]
+        if qbbo is not None and Id is not None:
+            attachable["AttachableRef"] = [{"EntityRef": {"type": self._validate_object_name(qbbo),
+                                                          "value": str(Id)}}]
 
-        import ipdb
+        return MultipartEncoder([("file_metadata_0", "attachment.json", "application/json",
+                                  FileData(json.dumps(attachable))),
+                                 ("file_content_0", name, upload_type, path)])
 
-        ipdb.set_trace()
+    #-------------------------------------------------------------------------------------------------------------------
+    def _uploaded_attachable(self, result):
+        """
+        The {"Attachable": ...} (or {"Fault": ...}) for the one file of an upload, given QB's response to it
+        """
+        if not isinstance(result, dict):
+            return {"Fault": {"type": "(synthetic, inconclusive)", "Error": [{"Detail": unicode(result)[:500]}]}}
+
+        if "Fault" in result:
+            return {"Fault": result["Fault"]}
 
-        return attachment_id
+        responses = result.get("AttachableResponse") or [{}]
+        if "Attachable" not in responses[0] and "Fault" not in responses[0]:
+            return {"Fault": {"type": "(synthetic, inconclusive)", "Error": [{"Detail": "No Attachable came back"}]}}
+
+        return responses[0]
 
     #-------------------------------------------------------------------------------------------------------------------
     def download_file(self, attachment_id, destination_dir='', alternate_name=None):
@@ -520,207 +3215,825 @@ class QuickBooks():
 
         # special hammer it routine for this very un-oauthed GET...
         while not success and tries_remaining >= 0:
-            if self.verbosity > 0 and tries_remaining < 6:
-                print "This is attempt #%d to download Attachable id %s." % \
-                      (6 - tries_remaining + 1, attachment_id)
+            if tries_remaining < 6:
+                log.info("This is attempt #%d to download Attachable id %s.", 6 - tries_remaining + 1, attachment_id)
 
             try:
-                my_r = requests.get(link)
-
-                if alternate_name:
-                    filename = alternate_name
-
-                else:
-                    filename = urllib.unquote(my_r.url)
-                    filename = filename.split("/./")[1].split("?")[0]
-
-                with open(destination_dir + filename, 'wb') as f:
-                    for chunk in my_r.iter_content(1024):
-                        f.write(chunk)
-
+                self._download_link(link, destination_dir, alternate_name)
                 success = True
 
             except:
                 tries_remaining -= 1
-                time.sleep(1)
+                time.sleep(self._retry_delay(6 - tries_remaining + 1))
 
                 if tries_remaining == 0:
-                    print "Max retries reached..."
+                    log.error("Max retries reached downloading Attachable id %s.", attachment_id)
                     raise
 
         return link
 
     #-------------------------------------------------------------------------------------------------------------------
-    def hammer_it(self, request_type, url, request_body, content_type, accept='json', file_name=None, **req_kwargs):
+    def _download_link(self, link, destination_dir='', alternate_name=None):
         """
-        A slim version of simonv3's excellent keep_trying method. Among other
-         trimmings, it assumes we can only use v3 of the
-         QBO API. It also allows for requests and responses
-         in xml OR json. (No xml parsing added yet but the way is paved...)
+        One attempt at saving the file behind a (temporary, un-oauthed) download link
         """
-        if self.session != None:
-            session = self.session
+        my_r = PooledTransport.plain_session().get(link, stream=True)
 
-        else:
-            # Why wouldn't we have a session already!?
-            # Because __init__doesn't do it!
+        try:
+            my_r.raise_for_status()
 
-            session = self.create_session()
-            self.session = session
+            if alternate_name:
+                filename = alternate_name
 
-        #haven't found an example of when this wouldn't be True, but leaving
-        #it for the meantime...
+            else:
+                # (from the link as given: requests drops the "/./" QB's links have in front of the name)
+                filename = urllib.unquote(link).split("?")[0]
+                filename = filename.split("/./")[1] if "/./" in filename else filename.rsplit("/", 1)[-1]
 
-        header_auth = True
+            path = destination_dir + filename
+            self._save_response(my_r, path + ".part")
 
-        trying = True
-        print_error = False
+        finally:
+            my_r.close()
 
-        tries = 0
+        os.rename(path + ".part", path)
 
-        while trying:
-            tries += 1
-            if tries > 1:
-                #we don't want to get shut out...
-                time.sleep(1)
-
-            if self.verbosity > 2 and tries > 1:
-                print "(this is try#%d)" % tries
-
-            if accept == "filelink":
-                headers = {}
-
-            else:
-                headers = {'Accept': 'application/%s' % accept}
-
-            if file_name is None:
-                if request_type != "GET":
-                    headers.update({'Content-Type': 'application/%s' % content_type})
-
-            else:
-                boundary = "-------------PythonMultipartPost"
-                headers.update({
-                    'Content-Type': 'multipart/form-data; boundary=%s' % boundary,
-                    'Accept-Encoding': 'gzip;q=1.0,deflate;q=0.6,identity;q=0.3',
-                    'User-Agent': 'OAuth gem v0.4.7',
-                    'Accept': 'application/json',
-                    'Connection': 'close'
-                })
-
-                with open(file_name, "rb") as file_handler:
-                    binary_data = file_handler.read()
-
-                request_body = textwrap.dedent(
-                    """
-                    --%s
-                    Content-Disposition: form-data; name="file_content_0"; filename="%s"
-                    Content-Length: %d
-                    Content-Type: image/jpeg
-                    Content-Transfer-Encoding: binary
-                    %s
-                    --%s--
-                    """
-                ) % (boundary, file_name, len(binary_data),
-                     binary_data, boundary)
-
-            my_r = session.request(request_type, url, header_auth,
-                                   self.company_id, headers=headers,
-                                   data=request_body, verify=False,
-                                   **req_kwargs)
-
-            resp_cont_type = my_r.headers['content-type']
-
-            if 'xml' in resp_cont_type:
-                result = ET.fromstring(my_r.content)
-                rough_string = ET.tostring(result, "utf-8")
-                reparsed = minidom.parseString(rough_string)
-                '''
-                if self.verbosity > 7:
-                    print reparsed.toprettyxml(indent="\t")
-                '''
-                if self.verbosity > 0:
-                    print my_r, my_r.reason,
-
-                    if my_r.status_code in [503]:
-                        print " (Service Unavailable)"
-
-                    elif my_r.status_code in [401]:
-                        print " (Unauthorized -- a dubious response)"
+    #-------------------------------------------------------------------------------------------------------------------
+    def _save_response(self, my_r, path, append=False):
+        """
+        Writes a (streamed) download to path in download_chunk_size pieces; raises IOError if it ends short
+        """
+        with open(path, "ab" if append else "wb", self.download_chunk_size) as f:
+            for chunk in my_r.iter_content(self.download_chunk_size):
+                f.write(chunk)
 
-                    else:
-                        print " (json parse failed)"
+        expected = my_r.headers.get("Content-Length")
+        if expected is not None and my_r.raw.tell() < int(expected):
+            raise IOError("Download of %s ended after %d of %s bytes" % (path, my_r.raw.tell(), expected))
 
-                if self.verbosity > 8:
-                    print my_r.text
+    #-------------------------------------------------------------------------------------------------------------------
+    def download_files(self, attachment_ids, destination_dir='', workers=MAX_CONCURRENT_REQUESTS, overwrite=False):
+        """
+        Downloads many Attachables at once. Their temporary download links come from a few "Id IN (...)" queries,
+        then up to `workers` files download at a time, each to a .part file that's renamed into place once it's
+        complete. A download that breaks off picks up where it left off (with an HTTP Range request), and one whose
+        link has expired gets a fresh link. Files already in destination_dir are skipped unless overwrite.
+        Returns {Id: path}, or {Id: {"Fault": ...}} for the ones that failed.
+        """
+        ids = [str(Id) for Id in attachment_ids]
 
-                    result = None
+        statements = self._in_queries("SELECT * FROM Attachable WHERE Id IN ", [self._literal(Id) for Id in ids])
 
-            elif 'json' in resp_cont_type:
-                try:
-                    result = my_r.json()
+        attachables = {}
+        for records in self._pool_map(lambda statement: self._fetch("POST", "Attachable", original_payload=statement),
+                                      statements, workers):
+            for record in records:
+                attachables[record["Id"]] = record
 
-                except:
-                    result = {"Fault": {"type": "(synthetic, inconclusive)"}}
+        log.debug("Downloading %d of %d attachments.", len(attachables), len(ids))
 
-                if "Fault" in result and "type" in result["Fault"] and result["Fault"]["type"] == "ValidationFault":
+        def download(Id):
+            attachable = attachables.get(Id)
+            if attachable is None:
+                return {"Fault": {"type": "(synthetic, not found)",
+                                  "Error": [{"Detail": "No Attachable with Id %s" % Id}]}}
 
-                    trying = False
-                    print_error = True
+            # attachments' names needn't be unique, so each is saved as <Id>_<FileName>
+            filename = "%s_%s" % (Id, os.path.basename(attachable.get("FileName") or "attachment"))
 
-                elif tries >= 10:
-                    trying = False
+            path = os.path.join(destination_dir, filename)
+            if os.path.exists(path) and not overwrite:
+                return path
 
-                    if "Fault" in result:
-                        print_error = True
+            try:
+                self._download_resumable(Id, attachable.get("TempDownloadUri"), path)
+            except Exception as e:
+                return {"Fault": {"type": "(synthetic, download failed)", "Error": [{"Detail": str(e)}]}}
 
-                elif "Fault" not in result:
-                    #sounds like a success
-                    trying = False
+            return path
 
-                else:
-                    print my_r, my_r.reason, my_r.text
-                    #import ipdb;ipdb.set_trace()
+        return dict(zip(ids, self._pool_map(download, ids, workers)))
 
-                if (not trying and print_error):  #or self.verbosity > 8:
-                    print json.dumps(result, indent=1)
+    #-------------------------------------------------------------------------------------------------------------------
+    def _download_resumable(self, attachment_id, link, path):
+        """
+        Saves the file behind link to path, resuming from what's already in path + ".part" and trying up to
+        download_tries times; a new link is asked for if there isn't one or it stops working
+        """
+        part = path + ".part"
+        tries = 0
 
-            elif 'plain/text' in resp_cont_type or accept == 'filelink':
-                if not "Fault" in my_r.text or tries >= 10:
-                    trying = False
+        while True:
+            tries += 1
 
-                else:
-                    print "Failed to get file link."
-                    if self.verbosity > 4:
-                        print my_r.text
+            try:
+                if not link:
+                    url = "%s/company/%s/download/%s" % (self.base_url_v3, self.company_id, attachment_id)
+                    link = self.hammer_it("GET", url, None, "json", accept="filelink")
 
-                result = my_r.text
+                offset = os.path.getsize(part) if os.path.exists(part) else 0
+                headers = {"Range": "bytes=%d-" % offset} if offset else {}
 
-            elif 'text/html' in resp_cont_type:
-                import ipdb
+                my_r = PooledTransport.plain_session().get(link, headers=headers, stream=True)
+                try:
+                    # 416: there's nothing past what we already have
+                    if not (offset and my_r.status_code == 416):
+                        if my_r.status_code in (401, 403, 404):
+                            link = None
+                        my_r.raise_for_status()
+                        self._save_response(my_r, part, append=my_r.status_code == 206)
+                finally:
+                    my_r.close()
+
+                break
+
+            except (requests.RequestException, IOError):
+                if tries >= self.download_tries:
+                    raise
 
-                ipdb.set_trace()
+                log.info("This is attempt #%d to download Attachable id %s.", tries + 1, attachment_id)
 
-            else:
-                raise NotImplementedError("How do I parse a %s response?" \
-                                          #% accept)
-                                          % resp_cont_type)
+                time.sleep(self._retry_delay(tries + 1))
 
-        return result
+        os.rename(part, path)
 
     #-------------------------------------------------------------------------------------------------------------------
-    def get_report(self, report_name, params=None):
+    def hammer_it(self, request_type, url, request_body, content_type, accept=None, file_name=None, stream_path=None,
+                  **req_kwargs):
         """
-        Tries to use the QBO reporting API:
-        https://developer.intuit.com/docs/0025_quickbooksapi/0050_data_services/reports
+        A slim version of simonv3's excellent keep_trying method. Among other
+         trimmings, it assumes we can only use v3 of the
+         QBO API. It also allows for requests and responses
+         in xml OR json (accept defaults to response_format); either way the
+         result is the JSON-shaped dict.
+        file_name, for uploads, is a path, file-like object, FileData or MultipartEncoder; it's streamed,
+         not read into memory.
+        With stream_path, a successful response comes back as a JsonStream (or XmlStream) of the array at that path;
+        its request keeps its place in the realm's limits (and request_slots) until it's been read or closed.
+        Throttling (429), trouble on QB's side (5xx) and _TRANSPORT_ERRORS are tried again, up to max_tries times;
+        a response it can't parse raises ResponseError.
         """
+        if accept is None:
+            accept = self.response_format
 
-        if params is None:
-            params = {}
+        session = self._request_session()
+        limiter = self.limiter
 
-        url = "%s/company/%s/reports/%s" % (self.base_url_v3, self.company_id, report_name)
+        if file_name is not None and not isinstance(file_name, MultipartEncoder):
+            file_name = MultipartEncoder.for_file(file_name)
+
+        trying = True
+        tries = 0
+        retry_after = None
+
+        while trying:
+            tries += 1
+            if tries > 1:
+                #we don't want to get shut out...
+                time.sleep(self._retry_delay(tries, retry_after))
+
+            if tries > 1:
+                log.debug("(this is try#%d)", tries)
+
+            # the realm's own limit first, so a throttled or paused realm doesn't sit on slots shared with others
+            limiter.acquire()
+            slots = self.request_slots
+            if slots is not None:
+                slots.acquire()
+
+            release = functools.partial(self._release_request, limiter, slots)
+            try:
+                result, trying, retry_after = self._try_once(session, request_type, url, request_body,
+                                                             content_type, accept, file_name, tries, stream_path,
+                                                             **req_kwargs)
+            except:
+                release()
+                raise
+
+            if isinstance(result, _ResponseStream):
+                # the response is still being read, over a connection still in use
+                result.on_close(release)
+            else:
+                release()
+
+        return result
+
+    #-------------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def _release_request(limiter, slots):
+        if slots is not None:
+            slots.release()
+        limiter.release()
+
+    #-------------------------------------------------------------------------------------------------------------------
+    @property
+    def limiter(self):
+        """
+        This realm's RateLimiter, shared with every other instance in the process
+        """
+        return RateLimiter.for_realm(self.company_id)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _request_session(self):
+        """
+        The session hammer_it signs its requests with, created on first use
+        """
+        if self.session != None:
+            return self.session
+
+        # Why wouldn't we have a session already!?
+        # Because __init__doesn't do it!
+        # (and several threads may get here at once)
+
+        with _session_lock:
+            if self.session is None:
+                self.session = self.create_session()
+
+        return self.session
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _retry_delay(self, tries, retry_after=None):
+        """
+        How long to wait before try number `tries`: what QB asked for in Retry-After if it did, otherwise
+        exponential backoff (backoff_base, doubling up to backoff_max) with jitter, so callers that failed
+        together don't all come back at the same moment.
+        """
+        if retry_after:
+            return retry_after
+
+        delay = min(self.backoff_max, self.backoff_base * 2 ** max(0, tries - 2))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _retry_after(self, response):
+        """
+        Seconds from the response's Retry-After header (which may also be an HTTP date), or None
+        """
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            parsed = email.utils.parsedate_tz(value)
+            if parsed is None:
+                return None
+            return max(0.0, email.utils.mktime_tz(parsed) - time.time())
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _retryable(self, status_code, result):
+        """
+        Whether a failed request is worth trying again: throttling and server-side trouble are, while requests QB
+        found fault with (validation, authentication, authorization, not found) will just fail the same way again.
+        """
+        if status_code == 429 or status_code >= 500:
+            return True
+
+        fault_type = None
+        if isinstance(result, dict) and isinstance(result.get("Fault"), dict):
+            fault_type = result["Fault"].get("type")
+
+        if fault_type in self._FATAL_FAULTS or status_code in (400, 401, 403, 404):
+            return False
+
+        return True
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _try_once(self, session, request_type, url, request_body, content_type, accept, file_name, tries,
+                  stream_path=None, **req_kwargs):
+        """
+        One round of hammer_it: sends the request and parses the response.
+        Returns (result, trying, retry_after), where trying says whether it's worth another go and retry_after
+        is how long QB asked us to wait before it (None if it didn't say).
+        Each round is described by an event dict, handed to pre_request_hooks before the request goes out (with
+        realm, entity, operation, method, url, try, retries, bytes_sent, started) and to post_request_hooks and
+        metrics once it's done (adding status, bytes_received, throttled, retry_after, fault, error, elapsed and
+        final, whether hammer_it is done with the request).
+        """
+        event = self._request_event(request_type, url, request_body, file_name, tries, req_kwargs)
+        self._run_hooks(self.pre_request_hooks, event)
+
+        try:
+            outcome = self._send_once(session, request_type, url, request_body, content_type, accept, file_name,
+                                      tries, stream_path, event, **req_kwargs)
+        except self._TRANSPORT_ERRORS as e:
+            trying = tries < self.max_tries
+            event.update(error="%s: %s" % (e.__class__.__name__, e), elapsed=time.time() - event["started"],
+                         final=not trying)
+            self._request_done(event)
+
+            if not trying:
+                raise
+
+            log.info("%s %s failed, will retry: %s", request_type, url, e)
+            return None, True, None
+
+        except Exception as e:
+            event.update(error="%s: %s" % (e.__class__.__name__, e), elapsed=time.time() - event["started"],
+                         final=True)
+            self._request_done(event)
+            raise
+
+        event.update(elapsed=time.time() - event["started"], final=not outcome[1])
+        self._request_done(event)
+
+        return outcome
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _request_event(self, request_type, url, request_body, file_name, tries, req_kwargs):
+        """
+        The event _try_once hands its hooks, as far as it can be filled in before the request is sent
+        """
+        entity = None
+        operation = request_type.lower()
+
+        match = re.search(r"/company/[^/]+/([^/?]+)(?:/([^/?]+))?", url)
+        if match:
+            segment, rest = match.group(1).lower(), match.group(2)
+
+            if segment == "query":
+                operation = "query"
+                found = re.search(r"\bFROM\s+(\w+)", request_body if isinstance(request_body, basestring) else "",
+                                  re.I)
+                entity = found.group(1) if found else None
+            elif segment in ("cdc", "batch", "upload"):
+                operation = segment
+            elif segment == "reports":
+                operation, entity = "report", rest
+            elif segment == "download":
+                operation, entity = "download", "Attachable"
+            else:
+                entity = ([name for name in self._BUSINESS_OBJECTS if name.lower() == segment] or [segment])[0]
+                if request_type == "GET":
+                    operation = "read"
+                elif (req_kwargs.get("params") or {}).get("operation") == "delete":
+                    operation = "delete"
+                else:
+                    operation = "write"
+
+        if file_name is not None:
+            bytes_sent = len(file_name)
+        else:
+            bytes_sent = len(request_body) if isinstance(request_body, basestring) else 0
+
+        return {"realm": self.company_id, "entity": entity, "operation": operation, "method": request_type,
+                "url": url, "try": tries, "retries": tries - 1, "bytes_sent": bytes_sent, "started": time.time(),
+                "status": None, "bytes_received": 0, "throttled": False, "retry_after": None, "fault": None,
+                "error": None}
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _run_hooks(self, hooks, event):
+        for hook in hooks:
+            try:
+                hook(event)
+            except Exception:
+                log.exception("Request hook %r failed", hook)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _request_done(self, event):
+        if self.metrics is not None:
+            self._run_hooks([self.metrics], event)
+        self._run_hooks(self.post_request_hooks, event)
+
+        if event["throttled"]:
+            log.info("Realm %s throttled (%s %s), retry after %s", event["realm"], event["method"], event["url"],
+                     event["retry_after"])
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _send_once(self, session, request_type, url, request_body, content_type, accept, file_name, tries,
+                   stream_path, event, **req_kwargs):
+        """
+        The request and response handling of _try_once, which also fills in event as it goes
+        """
+
+        #haven't found an example of when this wouldn't be True, but leaving
+        #it for the meantime...
+
+        header_auth = True
+
+        trying = True
+        print_error = False
+
+        if accept == "filelink":
+            headers = {}
+
+        else:
+            headers = {'Accept': 'application/%s' % accept}
+
+        if file_name is None:
+            if request_type != "GET":
+                headers.update({'Content-Type': 'application/%s' % content_type})
+
+        else:
+            headers.update({
+                'Content-Type': file_name.content_type,
+                'Accept-Encoding': 'gzip;q=1.0,deflate;q=0.6,identity;q=0.3',
+                'User-Agent': 'OAuth gem v0.4.7',
+                'Accept': 'application/json'
+            })
+
+            file_name.rewind()
+            request_body = file_name
+
+        my_r = session.request(request_type, url, header_auth,
+                               self.company_id, headers=headers,
+                               data=request_body, verify=False,
+                               stream=stream_path is not None,
+                               **req_kwargs)
+
+        retry_after = self._retry_after(my_r)
+        self.limiter.on_response(my_r.status_code, retry_after)
+
+        event.update(status=my_r.status_code, throttled=my_r.status_code == 429, retry_after=retry_after)
+        if stream_path is not None:
+            event["bytes_received"] = int(my_r.headers.get('content-length') or 0)
+        else:
+            event["bytes_received"] = len(my_r.content)
+
+        resp_cont_type = my_r.headers.get('content-type', '')
+        last_try = tries >= self.max_tries
+
+        if (my_r.status_code == 429 or my_r.status_code >= 500) and not last_try:
+            #throttled, or trouble on QB's side: worth another go, whatever the body is
+            log.info("%s %s, will retry: %s", my_r.status_code, my_r.reason, my_r.text[:500])
+            my_r.close()
+
+            result = {"Fault": {"type": "(synthetic, %d response)" % my_r.status_code}}
+
+        elif stream_path is not None and my_r.status_code == 200 and 'xml' in resp_cont_type:
+            my_r.raw.decode_content = True
+            result = XmlStream(my_r.raw, stream_path, response=my_r)
+            trying = False
+
+        elif stream_path is not None and my_r.status_code == 200 and 'json' in resp_cont_type:
+            result = JsonStream(my_r.iter_content(self.stream_chunk_size), stream_path, self.json_codec,
+                                response=my_r)
+            trying = False
+
+        elif 'json' in resp_cont_type or 'xml' in resp_cont_type:
+            try:
+                if 'xml' in resp_cont_type:
+                    result = XmlStream(my_r.content).parse()
+                else:
+                    result = self.json_codec.loads(my_r.content)
+
+            except:
+                result = {"Fault": {"type": "(synthetic, inconclusive)"}}
+
+            if "Fault" in result and not self._retryable(my_r.status_code, result):
+
+                trying = False
+                print_error = True
+
+            elif last_try:
+                trying = False
+
+                if "Fault" in result:
+                    print_error = True
+
+            elif "Fault" not in result:
+                #sounds like a success
+                trying = False
+
+            else:
+                log.info("%s %s, will retry: %s", my_r.status_code, my_r.reason, my_r.text)
+
+            if (not trying and print_error):
+                log.warning("%s %s %s failed: %s", request_type, url, my_r.status_code, json.dumps(result, indent=1))
+
+        elif 'plain/text' in resp_cont_type or accept == 'filelink':
+            if not "Fault" in my_r.text or last_try:
+                trying = False
+
+            else:
+                log.info("Failed to get file link: %s", my_r.text)
+
+            result = my_r.text
+
+        elif 'text/html' in resp_cont_type:
+            #an error page from something in front of QB (gateway timeouts and the like)
+            result = {"Fault": {"type": "(synthetic, html %d response)" % my_r.status_code}}
+
+            if last_try or not self._retryable(my_r.status_code, None):
+                trying = False
+                log.warning("%s %s %s failed: %s", request_type, url, my_r.status_code, my_r.reason)
+
+        else:
+            log.warning("%s %s %s failed: %s", request_type, url, my_r.status_code, my_r.reason)
+            raise ResponseError(my_r.status_code, my_r.reason, resp_cont_type, my_r.text)
+
+        if isinstance(result, dict) and isinstance(result.get("Fault"), dict):
+            event["fault"] = result["Fault"].get("type")
+
+        return result, trying, retry_after
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def get_report(self, report_name, params=None, stream=False, shard=None, workers=4, refresh=False):
+        """
+        Tries to use the QBO reporting API:
+        https://developer.intuit.com/docs/0025_quickbooksapi/0050_data_services/reports
+        With a report_cache (see ReportCache), reports are kept there and asked for again only once they're too
+        old and, with report_revalidate, CDC has seen something change since; refresh asks again regardless.
+        With stream, returns a JsonStream of the report's top-level Rows.Row, decoded as they arrive
+        (its .document has the Header and Columns); those aren't cached. One that isn't read to the end should be
+        closed (or used in a with block), to give its connection back.
+        With shard ("month" or "quarter"), params' start_date..end_date is asked for a window at a time,
+        up to `workers` windows at once, and the windows merged into one report (see _sharded_report).
+        """
+        if shard:
+            if stream:
+                raise ValueError("A sharded report can't be streamed")
+            return self._sharded_report(report_name, params, shard, workers, refresh)
+
+        if stream:
+            return self._fetch_report(report_name, params, stream)
+
+        return self._cached_report(report_name, params, refresh)["report"]
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def get_report_table(self, report_name, params=None, shard=None, workers=4, refresh=False):
+        """
+        get_report's report as a ReportTable (which is cached along with it, unless it's sharded)
+        """
+        if shard:
+            report = self._sharded_report(report_name, params, shard, workers, refresh)
+            return report if "Fault" in report else ReportTable(report)
+
+        entry = self._cached_report(report_name, params, refresh)
+
+        if entry.get("table") is None:
+            entry["table"] = ReportTable(entry["report"])
+
+        return entry["table"]
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _fetch_report(self, report_name, params=None, stream=False):
+        if params is None:
+            params = {}
+
+        url = "%s/company/%s/reports/%s" % (self.base_url_v3, self.company_id, report_name)
+
+        if stream:
+            return self.hammer_it("GET", url, None, "json", stream_path="Rows.Row", **{"params": params})
 
         return self.hammer_it("GET", url, None, "json", **{"params": params})
 
+    #-------------------------------------------------------------------------------------------------------------------
+    def _cached_report(self, report_name, params=None, refresh=False):
+        """
+        The report cache's entry for this report, fetching the report if need be (or if refresh says to)
+        (a report that came back as a Fault is handed back, but not kept)
+        """
+        cache = self.report_cache
+        if cache is None:
+            return {"report": self._fetch_report(report_name, params), "table": None, "fetched": time.time()}
+
+        key = cache.key(self.company_id, report_name, params)
+
+        if not refresh:
+            # a report over a range relative to today (a date_macro, or QB's default when there are no dates)
+            # covers different days as time goes by, whatever CDC says
+            revalidate = None
+            if self.report_revalidate and self._fixed_range(params):
+                revalidate = self._unchanged_since
+
+            entry = cache.get(key, revalidate)
+
+            if entry is not None:
+                return entry
+
+        report = self._fetch_report(report_name, params)
+
+        if not isinstance(report, dict) or "Fault" in report:
+            return {"report": report, "table": None, "fetched": time.time()}
+
+        return cache.put(key, report)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _sharded_report(self, report_name, params, shard, workers, refresh=False):
+        """
+        The report for params' start_date..end_date, fetched as calendar month or quarter windows (each of
+        which is cached on its own, so closed periods aren't asked for again) and merged in date order.
+        The first Fault any window comes back with is returned instead.
+        """
+        from dateutil import parser
+
+        params = dict(params or {})
+
+        if params.get("summarize_column_by") not in (None, "Total"):
+            raise ValueError("Can't shard a report whose columns depend on its dates (summarize_column_by=%s)"
+                             % params["summarize_column_by"])
+
+        if not params.get("start_date") or not params.get("end_date"):
+            raise ValueError("Sharding a report needs its start_date and end_date")
+
+        start, end = [value if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime)
+                      else parser.parse(unicode(value)).date()
+                      for value in (params["start_date"], params["end_date"])]
+        params.pop("date_macro", None)
+
+        def fetch(window):
+            window_params = dict(params, start_date=window[0].isoformat(), end_date=window[1].isoformat())
+            return self._cached_report(report_name, window_params, refresh)["report"]
+
+        reports = self._pool_map(fetch, self._report_windows(start, end, shard), workers)
+
+        for report in reports:
+            if not isinstance(report, dict) or "Fault" in report:
+                return report
+
+        if len(reports) == 1:
+            return reports[0]
+
+        return self._merged_report(reports)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _report_windows(self, start, end, shard):
+        """
+        [(first day, last day)] of the calendar months or quarters from start to end (the first and last cut
+        down to start and end)
+        """
+        months = {"month": 1, "quarter": 3}.get(shard)
+        if months is None:
+            raise ValueError("shard must be 'month' or 'quarter', not %r" % (shard,))
+
+        windows = []
+        window_start = start
+
+        while window_start <= end:
+            next_month = ((window_start.year * 12 + window_start.month - 1) // months + 1) * months
+            next_start = datetime.date(next_month // 12, next_month % 12 + 1, 1)
+
+            windows.append((window_start, min(end, next_start - datetime.timedelta(days=1))))
+            window_start = next_start
+
+        return windows
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _merged_report(self, reports):
+        """
+        One report out of the reports for consecutive windows (oldest first).
+        A detail report (one with a date column, like TransactionList or GeneralLedger) has its rows
+        concatenated, section by section; a summary report (like ProfitAndLoss) has its rows added up by account.
+        Either way, amounts in section summaries are added up across the windows, running balances are taken from
+        the last window they're in, and percentages (which can't be worked out from the totals) are blanked.
+        """
+        columns = []
+        for report in reports:
+            columns = (report.get("Columns") or {}).get("Column", [])
+            if columns:
+                break
+
+        kinds = []
+        for column in columns:
+            col_type = (column.get("ColType") or "").lower()
+            title = (column.get("ColTitle") or "").lower()
+
+            if "%" in title:
+                kinds.append("percent")
+            elif "bal" in col_type or "balance" in title:
+                kinds.append("balance")
+            elif col_type in ("money", "amount") or "amount" in col_type or col_type.endswith("_amt"):
+                kinds.append("amount")
+            elif col_type in ("tx_date", "date") or title == "date":
+                kinds.append("date")
+            else:
+                kinds.append("text")
+
+        detail = "date" in kinds
+
+        def combine(cells, more):
+            for index, cell in enumerate(more):
+                if index >= len(cells):
+                    cells.append(copy.deepcopy(cell))
+                    continue
+
+                kind = kinds[index] if index < len(kinds) else "text"
+                old, new = cells[index].get("value", ""), cell.get("value", "")
+
+                if kind == "balance":
+                    if new != "":
+                        cells[index]["value"] = new
+                elif kind == "amount" and (old != "" or new != ""):
+                    try:
+                        cells[index]["value"] = "%.2f" % (float(old or 0) + float(new or 0))
+                    except ValueError:
+                        pass
+                elif old == "":
+                    cells[index] = copy.deepcopy(cell)
+
+        indexes = {}
+
+        def merge(merged, rows, path, fresh):
+            index = indexes.setdefault(path, {})
+
+            for row in rows:
+                if "ColData" in row:
+                    cells = row["ColData"]
+                    if detail:
+                        if not fresh and cells and cells[0].get("value") == "Beginning Balance":
+                            # already have the balance the section started the whole range with
+                            continue
+                        merged.append(copy.deepcopy(row))
+                        continue
+
+                    key = ("row", cells[0].get("id") or cells[0].get("value")) if cells else ("row", None)
+                    if key in index:
+                        combine(index[key]["ColData"], cells)
+                    else:
+                        index[key] = copy.deepcopy(row)
+                        merged.append(index[key])
+                    continue
+
+                header = (row.get("Header") or {}).get("ColData", [])
+                key = ("section", row.get("group") or (header[0].get("value") if header else None))
+                children = (row.get("Rows") or {}).get("Row", [])
+
+                section = index.get(key)
+                if section is None:
+                    section = dict((name, copy.deepcopy(value)) for name, value in row.iteritems() if name != "Rows")
+                    if "Rows" in row:
+                        section["Rows"] = dict(row["Rows"], Row=[])
+                    index[key] = section
+                    merged.append(section)
+                    merge(section.get("Rows", {}).get("Row", []), children, path + (key,), True)
+                    continue
+
+                if row.get("Summary"):
+                    if section.get("Summary"):
+                        combine(section["Summary"].setdefault("ColData", []), row["Summary"].get("ColData", []))
+                    else:
+                        section["Summary"] = copy.deepcopy(row["Summary"])
+
+                if children:
+                    section.setdefault("Rows", {"Row": []})
+                    merge(section["Rows"].setdefault("Row", []), children, path + (key,), False)
+
+        rows = []
+        for report in reports:
+            merge(rows, (report.get("Rows") or {}).get("Row", []), (), report is reports[0])
+
+        percents = [index for index, kind in enumerate(kinds) if kind == "percent"]
+
+        def blank_percents(rows):
+            for row in rows:
+                for part in (row, row.get("Header") or {}, row.get("Summary") or {}):
+                    cells = part.get("ColData", [])
+                    for index in percents:
+                        if index < len(cells):
+                            cells[index]["value"] = ""
+                blank_percents((row.get("Rows") or {}).get("Row", []))
+
+        if percents:
+            blank_percents(rows)
+
+        header = copy.deepcopy(reports[0].get("Header", {}))
+        header["StartPeriod"] = reports[0].get("Header", {}).get("StartPeriod", header.get("StartPeriod"))
+        header["EndPeriod"] = reports[-1].get("Header", {}).get("EndPeriod", header.get("EndPeriod"))
+
+        times = [report["Header"]["Time"] for report in reports if report.get("Header", {}).get("Time")]
+        if times:
+            header["Time"] = min(times)
+
+        options = [option for option in header.get("Option", []) if option.get("Name") == "NoReportData"]
+        if options:
+            options[0]["Value"] = "true" if not rows else "false"
+
+        return {"Header": header, "Columns": {"Column": copy.deepcopy(columns)},
+                "Rows": {"Row": rows}}
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _fixed_range(self, params):
+        """
+        Whether report params pin the report to fixed dates: a start_date and an end_date, and no date_macro
+        """
+        params = params or {}
+        return bool(params.get("start_date") and params.get("end_date")) and not params.get("date_macro")
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _unchanged_since(self, entry):
+        """
+        Whether CDC says no transaction or name list object (account, customer, vendor, item...) has changed since
+        this cached report was made
+        """
+        from dateutil import parser, tz
+
+        made = entry["report"].get("Header", {}).get("Time")
+        if not made:
+            return False
+
+        try:
+            oldest_allowed = datetime.datetime.now(tz.tzutc()) - datetime.timedelta(days=self._cdc_max_days - 1)
+            if parser.parse(made) < oldest_allowed:
+                return False
+
+            changed, server_time = self.changed_objects(self._TRANSACTION_OBJECTS + self._NAME_LIST_OBJECTS, made)
+        except Exception:
+            return False
+
+        return not any(changed.itervalues())
+
     #-------------------------------------------------------------------------------------------------------------------
     def _validate_object_name(self, business_object):
         if business_object in self._BUSINESS_OBJECTS:
@@ -731,165 +4044,1009 @@ class QuickBooks():
                         (business_object, self._BUSINESS_OBJECTS))
 
     #-------------------------------------------------------------------------------------------------------------------
-    def query_objects(self, business_object, params={}, query_tail=""):
+    def query_objects(self, business_object, params={}, query_tail="", workers=1, fields=None, order_by=None):
         """
         Runs a query-type request against the QBOv3 API
         Gives you the option to create an AND-joined query by parameter
             or just pass in a whole query tail
         The parameter dicts should be keyed by parameter name and
             have twp-item tuples for values, which are operator and criterion
+            (a bare value means "="; for IN, the criterion is a list)
+        fields limits what's returned to those properties, e.g. ["Id", "SyncToken", "DisplayName"];
+            order_by sorts the results (see _query_string). business_object can also be a whole Query.
+        With workers > 1, big result sets are fetched that many pages at a time (see _iter_fetch_parallel)
         """
+        return list(self.iter_objects(business_object, params, query_tail, workers=workers, fields=fields,
+                                      order_by=order_by))
 
-        business_object = self._validate_object_name(business_object)
-
-        #eventually, we should be able to select more than just *,
-        #but chances are any further filtering is easier done with Python
-        #than in the query...
+    #-------------------------------------------------------------------------------------------------------------------
+    def iter_objects(self, business_object, params={}, query_tail="", batch_size=500, workers=1, fields=None,
+                     order_by=None):
+        """
+        Same query as query_objects, but yields the records one at a time as the pages come in,
+        so memory use stays flat no matter how many rows the query matches.
+        """
+        query_string = self._query_string(business_object, params, query_tail, fields, order_by)
+        business_object = self._validate_object_name(getattr(business_object, "entity", business_object))
 
-        query_string = "SELECT * FROM %s" % business_object
+        if workers > 1:
+            return self._iter_fetch_parallel("POST", business_object, original_payload=query_string,
+                                             batch_size=batch_size, workers=workers)
 
-        if query_tail == "" and not params == {}:
+        return self._iter_fetch("POST", business_object, original_payload=query_string, batch_size=batch_size)
 
-            #It's not entirely obvious what are valid properties for
-            #filtering, so we'll collect the working ones here and
-            #validate the properties before sending it
-            #datatypes are defined here:
-            #https://developer.intuit.com/docs/0025_quickbooksapi/
-            #    0050_data_services/020_key_concepts/0700_other_topics
+    #-------------------------------------------------------------------------------------------------------------------
+    def _query_string(self, business_object, params={}, query_tail="", fields=None, order_by=None):
+        """
+        Builds the "SELECT ... FROM ..." statement for query_objects and iter_objects with a Query:
+        fields is the projection (None for *), params are ANDed together, order_by is a field or a list of them
+        (each optionally followed by " DESC"). A query_tail is tacked on as it is instead of params and order_by.
+        business_object can also be a Query, which is the whole statement.
+        """
+        if isinstance(business_object, Query):
+            return str(business_object)
 
-            props = {
-                "TxnDate": "Date",
-                "MetaData.CreateTime": "DateTime",  #takes a Date though
-                "MetaData.LastUpdatedTime": "DateTime"  #ditto
-            }
+        query = Query(self._validate_object_name(business_object), fields)
 
-            p = params.keys()
+        if query_tail != "":
+            if not query_tail[0] == " ":
+                query_tail = " " + query_tail
+            return str(query) + query_tail
 
-            #only validating the property name for now, not the DataType
-            if p[0] not in props:
-                raise Exception("Unfamiliar property: %s" % p[0])
+        for field, condition in sorted(params.iteritems()):
+            if isinstance(condition, tuple) and len(condition) == 2:
+                operator, value = condition
+            else:
+                operator, value = "=", condition
 
-            query_string += " WHERE %s %s %s" % (p[0],
-                                                 params[p[0]][0],
-                                                 params[p[0]][1])
+            if isinstance(value, basestring) and len(value) > 1 and value[0] == value[-1] == "'":
+                # quoted by the caller, as params used to have to be
+                value = value[1:-1]
 
-            if len(p) > 1:
-                for i in range(1, len(p) + 1):
-                    if p[i] not in props:
-                        raise Exception("Unfamiliar property: %s" % p[i])
+            query.where(field, operator, value)
 
-                    query_string += " AND %s %s %s" % (p[i],
-                                                       params[p[i]][0],
-                                                       params[p[i]][1])
+        if isinstance(order_by, basestring):
+            order_by = [order_by]
 
-        elif not query_tail == "":
-            if not query_tail[0] == " ":
-                query_tail = " " + query_tail
-            query_string += query_tail
+        for ordering in order_by or []:
+            parts = ordering.split()
+            query.order_by(parts[0], len(parts) > 1 and parts[1].upper() == "DESC")
 
-        return self._fetch(r_type="POST", qb_object=business_object, original_payload=query_string)
+        return str(query)
 
     #-------------------------------------------------------------------------------------------------------------------
-    def is_object(self, business_object, where_clause=None):
+    def is_object(self, business_object, where_clause=None, use_cache=False):
         """
         Runs a query-type request against the QBOv3 API
         Gives you the option to create an AND-joined query by parameter
             or just pass in a whole query tail
         The parameter dicts should be keyed by parameter name and
             have twp-item tuples for values, which are operator and criterion
+        With use_cache, a simple where clause ("WHERE Name = 'x' AND ...", on Id or an indexed field) is answered
+        from the session dict instead, as long as that holds the whole, synced list (see _fresh_cache).
         """
 
         business_object = self._validate_object_name(business_object)
 
+        if use_cache:
+            results = self._find_locally(business_object, where_clause)
+            if results is not None:
+                return results[:1]
+
         if where_clause:
             query_string = "SELECT Id FROM %s %s" % (business_object, where_clause)
         else:
             query_string = "SELECT Id FROM %s " % business_object
 
-        results = self._fetch("POST", business_object, original_payload=query_string, batch_size=1)
+        results = self._fetch("POST", business_object, original_payload=query_string, batch_size=1, limit=1)
         return results
 
     #-------------------------------------------------------------------------------------------------------------------
-    def get_objects(self, qbbo, requery=False, params={}, query_tail=""):
+    def existing_ids(self, qbbo, field, values, workers=MAX_CONCURRENT_REQUESTS, use_cache=True):
         """
-        Rather than have to look up the account that's associate with an invoice item, for example, which requires
-        another query, it might be easier to just have a local dict for reference. The same is true with linked
-        transactions, so transactions can also be cloned with this method
+        is_object for many values at once: returns {value: Id} for the values some qbbo has as its field
+        (values nothing matches are left out). Strings match case-insensitively and, like is_object,
+        name list objects only count if they're active.
+        With use_cache, a fresh session dict (see _fresh_cache) and field being Id or one it has an index on, it's
+        answered locally; otherwise (or for values that can't be) the values go out in "WHERE field IN (...)"
+        queries of up to _max_query_length characters, up to `workers` at a time.
         """
-
         qbbo = self._validate_object_name(qbbo)
 
-        if qbbo in self._NAME_LIST_OBJECTS and query_tail == "":
-            #to avoid confusion from 'deleted' accounts later...
-            query_tail = "WHERE Active IN (true,false)"
+        by_normalized = collections.OrderedDict()
+        for value in values:
+            by_normalized.setdefault(EntityCache._normalized(value), value)
 
-        attr_name = qbbo + "s"
+        ids = {}
 
-        #if we've already populated this list, only redo if told to
-        #because, say, we've created another Account or Item or something
-        #during the session
+        objects = self._fresh_cache(qbbo) if use_cache else None
 
-        if not hasattr(self, attr_name):
-            setattr(self, attr_name, collections.OrderedDict())
-            requery = True
+        if objects is not None and (field == "Id" or objects.indexed(field)):
+            remaining = collections.OrderedDict()
+            for normalized, value in by_normalized.iteritems():
+                found = self._find_locally(qbbo, "WHERE %s = %s" % (field, self._literal(value)))
+                if found is None:
+                    # not something the session dict can answer after all
+                    remaining[normalized] = value
+                elif found:
+                    ids[value] = found[0]["Id"]
 
-        if requery:
-            if self.verbosity > 2:
-                print "Caching list of %ss." % qbbo
-                if not params == {}:
-                    print "params:\n%s" % params
-                if query_tail:
-                    print "query_tail:\n%s" % query_tail
+            if not remaining:
+                return ids
 
-            object_list = self.query_objects(qbbo, params, query_tail)
+            by_normalized = remaining
 
-            #let's dictionarize it (keyed by Id), though, for easy lookup later
-            object_dict = {}
+        select = "SELECT Id, %s FROM %s WHERE %s IN " % (field.split(".")[0], qbbo, field)
+        statements = self._in_queries(select, [self._literal(value) for value in by_normalized.itervalues()])
 
-            # Any previously stored objects (with the same ID) will
-            #  be overwritten.
-            for obj in object_list:
-                Id = obj["Id"]
-                '''
-                if Id == "288":
-                    import ipdb;ipdb.set_trace()
-                '''
-                getattr(self, attr_name)[Id] = obj
+        def run(statement):
+            return self._fetch("POST", qbbo, original_payload=statement)
 
-        return getattr(self, attr_name)
+        log.debug("Checking %d %s values in %d queries.", len(by_normalized), field, len(statements))
+
+        results = self._pool_map(run, statements, workers)
+
+        for records in results:
+            for record in records:
+                normalized = EntityCache._field_value(record, field)
+                if normalized in by_normalized:
+                    ids[by_normalized[normalized]] = record["Id"]
+
+        return ids
 
     #-------------------------------------------------------------------------------------------------------------------
-    def object_dicts(self, qbbo_list=[], requery=False, params={}, query_tail=""):
+    def _in_queries(self, select, literals):
         """
-        returns dict of dicts of ALL the Business Objects of each of these types (filtering with params and query_tail)
+        select + "(literal,literal,...)" statements between them covering all the literals, each short enough
+        (_max_query_length) to send
         """
-        object_dicts = {}  # {qbbo:[object_list]}
+        # room for the parentheses and the STARTPOSITION/MAXRESULTS _fetch adds
+        empty_length = len(select) + len("() STARTPOSITION 1000000 MAXRESULTS 500")
+
+        chunks = []
+        chunk = []
+        length = empty_length
+        for literal in literals:
+            if chunk and length + len(literal) + 1 > self._max_query_length:
+                chunks.append(chunk)
+                chunk = []
+                length = empty_length
+            chunk.append(literal)
+            length += len(literal) + 1
+        if chunk:
+            chunks.append(chunk)
+
+        return [select + "(%s)" % ",".join(literals_chunk) for literals_chunk in chunks]
 
-        for qbbo in qbbo_list:
+    #-------------------------------------------------------------------------------------------------------------------
+    def _pool_map(self, fn, items, workers):
+        """
+        map(fn, items), running up to `workers` at a time
+        """
+        if workers > 1 and len(items) > 1:
+            pool = ThreadPool(min(workers, len(items)))
+            try:
+                return pool.map(fn, items)
+            finally:
+                pool.terminate()
 
-            if qbbo == "TimeActivity":
-                #for whatever reason, this failed with some basic criteria, so
-                query_tail = ""
-            elif qbbo in self._NAME_LIST_OBJECTS and query_tail == "":
-                #just something to avoid confusion from 'deleted' accounts later
-                query_tail = "WHERE Active IN (true,false)"
+        return [fn(item) for item in items]
 
-            object_dicts[qbbo] = self.get_objects(qbbo, requery, params, query_tail)
+    #-------------------------------------------------------------------------------------------------------------------
+    def _literal(self, value):
+        """
+        value as a literal for a query statement
+        """
+        return Query.literal(value)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def find_by(self, qbbo, field, value):
+        """
+        The objects in the session dict of this type whose (dotted) field equals value, e.g.
+        find_by('Customer', 'PrimaryEmailAddr.Address', 'bob@example.com'). Strings match case-insensitively.
+        """
+        objects = self.get_objects(qbbo)
+        objects.add_index(field)
+
+        return objects.find(field, value)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _fresh_cache(self, qbbo):
+        """
+        The session dict of this type if it can stand in for a query: it holds the whole list (from a full pull,
+        the object store or CDC), nothing has been evicted from it, and it's been synced within cache_max_age
+        (if it hasn't, one CDC request brings it up to date). None otherwise.
+        """
+        objects = getattr(self, qbbo + "s", None)
+
+        if objects is None or not objects.intact or qbbo not in self._sync_marks:
+            return None
+
+        if self.cache_max_age is not None and time.time() - self._synced_at.get(qbbo, 0) > self.cache_max_age:
+            self.sync_objects([qbbo])
+            objects = getattr(self, qbbo + "s")
+
+            if not objects.intact or qbbo not in self._sync_marks:
+                return None
+
+        return objects
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _parse_where(self, where_clause):
+        """
+        {field: value} for a "WHERE a = 'x' AND b = true ..." clause, or None if it's anything more complicated.
+        "Active IN (true,false)" comes back as {"Active": None}.
+        """
+        where_clause = re.sub(r"^\s*WHERE\s+", "", where_clause or "", flags=re.I)
+
+        conditions = {}
+        position = 0
+
+        while position < len(where_clause):
+            match = self._where_condition.match(where_clause, position)
+            if match is None or match.end() == position:
+                return None
+
+            field, value, active = match.group(1, 2, 3)
+
+            if active:
+                conditions["Active"] = None
+            elif value.startswith("'"):
+                conditions[field] = re.sub(r"\\(.)", r"\1", value[1:-1])
+            elif value.lower() in ("true", "false"):
+                conditions[field] = value.lower() == "true"
+            elif "." in value:
+                conditions[field] = float(value)
+            else:
+                conditions[field] = int(value)
+
+            position = match.end()
+
+        return conditions
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _find_locally(self, qbbo, where_clause):
+        """
+        is_object's answer from the session dict, as [{"Id": ...}, ...], or None if it can't be answered there
+        """
+        objects = self._fresh_cache(qbbo)
+        if objects is None:
+            return None
+
+        conditions = self._parse_where(where_clause)
+        if conditions is None:
+            return None
+
+        if "Active" not in conditions and qbbo in self._NAME_LIST_OBJECTS:
+            # like QB, only count active ones unless asked otherwise
+            conditions["Active"] = True
+        elif "Active" in conditions and conditions["Active"] is None:
+            del conditions["Active"]
+
+        if "Id" in conditions:
+            candidates = [objects.get(str(conditions["Id"]))]
+        else:
+            indexed = [field for field in conditions if objects.indexed(field)]
+            if not indexed:
+                return None
+            candidates = objects.find(indexed[0], conditions[indexed[0]])
+
+        return [{"Id": obj["Id"]} for obj in candidates if obj is not None and
+                all(EntityCache._field_value(obj, field) == EntityCache._normalized(value)
+                    for field, value in conditions.iteritems())]
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def get_objects(self, qbbo, requery=False, params={}, query_tail="", workers=1, incremental=False):
+        """
+        Rather than have to look up the account that's associate with an invoice item, for example, which requires
+        another query, it might be easier to just have a local dict for reference. The same is true with linked
+        transactions, so transactions can also be cloned with this method
+        With incremental, a requery of the whole (unfiltered) list only asks QB for what's changed since the last
+        one (see sync_objects).
+        """
+
+        qbbo = self._validate_object_name(qbbo)
+
+        if qbbo in self._NAME_LIST_OBJECTS and query_tail == "":
+            #to avoid confusion from 'deleted' accounts later...
+            query_tail = self._ALL_NAMES_TAIL
+
+        complete = params == {} and query_tail in ("", self._ALL_NAMES_TAIL)
+
+        attr_name = qbbo + "s"
+
+        #if we've already populated this list, only redo if told to
+        #because, say, we've created another Account or Item or something
+        #during the session
+
+        if not hasattr(self, attr_name):
+            setattr(self, attr_name, self._new_cache(qbbo))
+
+            if complete and self._restore_objects(qbbo):
+                # warm start: only what's changed since the store was last synced
+                self.sync_objects([qbbo])
+            else:
+                requery = True
+
+        elif requery and incremental and complete and qbbo in self._sync_marks:
+            self.sync_objects([qbbo])
+            requery = False
+
+        if requery:
+            log.debug("Caching list of %ss (params: %s, query_tail: %s).", qbbo, params, query_tail)
+
+            # a filtered list isn't one CDC can keep up to date
+            self._sync_marks.pop(qbbo, None)
+            last_updated = ""
+
+            store = self.object_store
+            to_store = []
+
+            objects = getattr(self, attr_name)
+            lost = objects.evictions + objects.expirations
+
+            if store is not None and complete:
+                # start over, so objects deleted while nobody was syncing don't linger
+                store.clear(self.company_id, qbbo)
+
+            #let's dictionarize it (keyed by Id), though, for easy lookup later
+            # Any previously stored objects (with the same ID) will
+            #  be overwritten.
+            for obj in self.iter_objects(qbbo, params, query_tail, workers=workers):
+                Id = obj["Id"]
+                getattr(self, attr_name)[Id] = obj
+
+                last_updated = max(last_updated, obj.get("MetaData", {}).get("LastUpdatedTime", ""))
+
+                if store is not None:
+                    to_store.append(obj)
+                    if len(to_store) >= 500:
+                        store.put(self.company_id, qbbo, to_store)
+                        to_store = []
+
+            if store is not None:
+                store.put(self.company_id, qbbo, to_store)
+
+            if complete and objects.evictions + objects.expirations == lost:
+                # everything QB has is back in it, whatever was evicted before
+                objects.intact = True
+
+            if complete and last_updated:
+                self._sync_marks[qbbo] = self._sync_mark(last_updated)
+                self._synced_at[qbbo] = time.time()
+
+                if store is not None:
+                    store.set_mark(self.company_id, qbbo, self._sync_marks[qbbo])
+
+        getattr(self, attr_name).expire()
+
+        return getattr(self, attr_name)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _new_cache(self, qbbo):
+        """
+        An empty session dict for this type, with its limits from cache_limits
+        """
+        limits = self.cache_limits.get(qbbo, self.cache_limits.get("default", {}))
+
+        entity_class = None
+        if self.typed_entities is True or qbbo in (self.typed_entities or ()):
+            entity_class = ENTITY_TYPES.get(qbbo)
+
+        objects = EntityCache(max_entries=limits.get("max_entries"), max_bytes=limits.get("max_bytes"),
+                              ttl=limits.get("ttl"), entity_class=entity_class)
+
+        if qbbo in self._NAME_LIST_OBJECTS:
+            for field in self._INDEXED_FIELDS:
+                objects.add_index(field)
+
+        return objects
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def cache_stats(self):
+        """
+        {qbbo: EntityCache.stats()} for every session dict this instance has
+        """
+        return dict((qbbo, getattr(self, qbbo + "s").stats()) for qbbo in self._BUSINESS_OBJECTS
+                    if hasattr(self, qbbo + "s"))
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _restore_objects(self, qbbo):
+        """
+        Fills the (new, empty) session dict of this type from the object store.
+        Only does so, and returns True, if the store has the whole list with a sync mark to bring it up to date from.
+        """
+        if self.object_store is None:
+            return False
+
+        mark = self.object_store.get_mark(self.company_id, qbbo)
+
+        if mark is None:
+            return False
+
+        objects = getattr(self, qbbo + "s")
+        for Id, obj in self.object_store.load(self.company_id, qbbo):
+            objects[Id] = obj
+
+        log.debug("Restored %d %ss from %s.", len(objects), qbbo, self.object_store.path)
+
+        self._sync_marks[qbbo] = mark
+        return True
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _sync_mark(self, last_updated):
+        """
+        The changedSince to use after a full pull whose newest object is from last_updated.
+        QB's timestamps are in the company's local time, so comparing them as strings can be off by a DST hour;
+        backing off an hour makes sure CDC doesn't miss anything (merging a few objects twice is harmless).
+        """
+        from dateutil import parser
+
+        return (parser.parse(last_updated) - datetime.timedelta(hours=1)).isoformat()
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _mark_time(self, mark):
+        """
+        A sync mark as a UTC datetime; one that can't be parsed or has no UTC offset (so there's no telling
+        when it was) comes back as the earliest possible time, i.e. expired
+        """
+        from dateutil import parser, tz
+
+        try:
+            parsed = parser.parse(mark)
+        except (ValueError, TypeError, AttributeError, OverflowError):
+            parsed = None
+
+        if parsed is None or parsed.tzinfo is None:
+            return datetime.datetime.min.replace(tzinfo=tz.tzutc())
+
+        return parsed.astimezone(tz.tzutc())
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def changed_objects(self, qbbo_list, changed_since):
+        """
+        Asks QBO's ChangeDataCapture endpoint for the objects of these types changed (or deleted) since
+        changed_since, an ISO 8601 timestamp no more than _cdc_max_days ago.
+        Returns ({qbbo: [objects]}, server_time). Deleted objects come back as {"Id": ..., "status": "Deleted", ...}
+        """
+        qbbo_list = [self._validate_object_name(qbbo) for qbbo in qbbo_list]
+
+        url = "%s/company/%s/cdc" % (self.base_url_v3, self.company_id)
+
+        response = self.hammer_it("GET", url, None, "json",
+                                  params={"entities": ",".join(qbbo_list), "changedSince": changed_since})
+
+        if "CDCResponse" not in response:
+            raise Exception("ChangeDataCapture failed: %s" % response)
+
+        changed = dict((qbbo, []) for qbbo in qbbo_list)
+
+        for cdc_response in response["CDCResponse"]:
+            for query_response in cdc_response.get("QueryResponse", []):
+                for qbbo in qbbo_list:
+                    changed[qbbo] += query_response.get(qbbo, [])
+
+        if self.report_cache is not None and any(changed.itervalues()):
+            self.report_cache.invalidate(self.company_id)
+
+        return changed, response.get("time")
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def sync_objects(self, qbbo_list=None):
+        """
+        Brings the session's dicts of these types (default: every one it has) up to date.
+        A type whose dict came from a full, unfiltered get_objects only gets merged with what CDC says has changed or
+        been deleted since, in one request for all such types. Anything else (a filtered dict, one older than CDC
+        reaches back, or more changes than CDC will return) is requeried in full.
+        Returns {qbbo: dict}, like object_dicts.
+        """
+        if qbbo_list is None:
+            qbbo_list = [qbbo for qbbo in self._BUSINESS_OBJECTS if hasattr(self, qbbo + "s")]
+
+        qbbo_list = [self._validate_object_name(qbbo) for qbbo in qbbo_list]
+
+        from dateutil import tz
+
+        oldest_allowed = datetime.datetime.now(tz.tzutc()) - datetime.timedelta(days=self._cdc_max_days - 1)
+
+        incremental = [qbbo for qbbo in qbbo_list
+                       if hasattr(self, qbbo + "s") and qbbo in self._sync_marks and
+                       self._mark_time(self._sync_marks[qbbo]) > oldest_allowed]
+
+        full = [qbbo for qbbo in qbbo_list if qbbo not in incremental]
+
+        if incremental:
+            changed_since = min([self._sync_marks[qbbo] for qbbo in incremental], key=self._mark_time)
+
+            changed, server_time = self.changed_objects(incremental, changed_since)
+
+            for qbbo in incremental:
+                if len(changed[qbbo]) >= self._cdc_max_results:
+                    # CDC cut the list short
+                    full.append(qbbo)
+                    continue
+
+                log.debug("%d %ss changed since %s.", len(changed[qbbo]), qbbo, changed_since)
+
+                for obj in changed[qbbo]:
+                    if obj.get("status") == "Deleted":
+                        self._uncache_object(qbbo, obj["Id"])
+                    else:
+                        getattr(self, qbbo + "s")[obj["Id"]] = obj
+
+                if self.object_store is not None:
+                    self.object_store.put(self.company_id, qbbo,
+                                          [obj for obj in changed[qbbo] if obj.get("status") != "Deleted"])
+
+                if server_time:
+                    self._sync_marks[qbbo] = server_time
+                    self._synced_at[qbbo] = time.time()
+
+                    if self.object_store is not None:
+                        self.object_store.set_mark(self.company_id, qbbo, server_time)
+
+        for qbbo in full:
+            self.get_objects(qbbo, requery=True)
+
+        return dict((qbbo, getattr(self, qbbo + "s")) for qbbo in qbbo_list)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def object_dicts(self, qbbo_list=[], requery=False, params={}, query_tail="", workers=1, incremental=False):
+        """
+        returns dict of dicts of ALL the Business Objects of each of these types (filtering with params and query_tail)
+        With workers > 1 the types are queried that many at a time; they all share the realm's request budget
+        (MAX_CONCURRENT_REQUESTS) with every other caller, so it's safe to ask for more.
+        incremental is passed on to get_objects.
+        """
+        object_dicts = {}  # {qbbo:[object_list]}
+        query_tails = {}
+
+        for qbbo in qbbo_list:
+
+            if qbbo == "TimeActivity":
+                #for whatever reason, this failed with some basic criteria, so
+                query_tails[qbbo] = ""
+            elif qbbo in self._NAME_LIST_OBJECTS and query_tail == "":
+                #just something to avoid confusion from 'deleted' accounts later
+                query_tails[qbbo] = self._ALL_NAMES_TAIL
+            else:
+                query_tails[qbbo] = query_tail
+
+        def get_one(qbbo):
+            return self.get_objects(qbbo, requery, params, query_tails[qbbo], incremental=incremental)
+
+        if workers > 1 and len(qbbo_list) > 1:
+            pool = ThreadPool(min(workers, len(qbbo_list)))
+            try:
+                results = pool.map(get_one, qbbo_list)
+            finally:
+                pool.terminate()
+
+            object_dicts.update(zip(qbbo_list, results))
+
+        else:
+            for qbbo in qbbo_list:
+                object_dicts[qbbo] = get_one(qbbo)
 
         return object_dicts
 
     #-------------------------------------------------------------------------------------------------------------------
-    def names(self, requery=False, params={}, query_tail="WHERE Active IN (true,false)"):
+    def names(self, requery=False, params={}, query_tail=_ALL_NAMES_TAIL, workers=1, incremental=False):
         """
         get a dict of every Name List Business Object (of every type) results are subject to the filter if applicable
         returned dict has two dimensions:  name = names[qbbo][Id]
         """
-        return self.object_dicts(self._NAME_LIST_OBJECTS, requery, params, query_tail)
+        return self.object_dicts(self._NAME_LIST_OBJECTS, requery, params, query_tail, workers, incremental)
 
     #-------------------------------------------------------------------------------------------------------------------
-    def transactions(self, requery=False, params={}, query_tail=""):
+    def transactions(self, requery=False, params={}, query_tail="", workers=1, incremental=False):
         """
         get a dict of every Transaction Business Object (of every type) results are subject to the filter if applicable
         returned dict has two dimensions: transaction = transactions[qbbo][Id]
         """
-        return self.object_dicts(self._TRANSACTION_OBJECTS, requery, params, query_tail)
+        return self.object_dicts(self._TRANSACTION_OBJECTS, requery, params, query_tail, workers, incremental)
+
+
+class AsyncQuickBooks(QuickBooks):
+    """
+    QuickBooks client whose calls return at once with a future instead of blocking the caller.
+    (This module is Python 2, so there's no asyncio; futures are the nearest thing.)
+
+    Every instance shares one worker pool and one scheduler (and, like any QuickBooks, the connection pools), so a
+    single process can keep requests for many realms in flight. A request that has to back off, or whose realm is
+    already at MAX_CONCURRENT_REQUESTS, is put back on the scheduler rather than sleeping on a worker.
+
+    The futures have get(timeout=None), ready(), add_done_callback(fn) and then(fn).
+
+    Only the calls overridden here return futures: hammer_async, create_object, read_object, update_object,
+    delete_object, query_objects, get_report, upload_file and download_file. Everything else is inherited as it is
+    and blocks the caller's thread like it does on QuickBooks (the bulk ones included: get_objects, object_dicts,
+    names, transactions, sync_objects, batch, create_objects, update_objects, delete_objects, upload_files,
+    download_files, existing_ids, iter_objects); run those on a thread of their own if need be.
+    """
+
+    pool_size = 32
+    # how long to wait before checking again on a realm that's at its concurrency limit
+    slot_poll_interval = 0.05
+
+    _executor = None
+    _scheduler = _Scheduler()
+    _shared_lock = threading.Lock()
+
+    #-------------------------------------------------------------------------------------------------------------------
+    @classmethod
+    def _get_executor(cls):
+        with cls._shared_lock:
+            if cls._executor is None:
+                cls._executor = ThreadPool(cls.pool_size)
+            return cls._executor
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _submit(self, fn, *args):
+        self._get_executor().apply_async(fn, args)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def hammer_async(self, request_type, url, request_body, content_type, accept=None, file_name=None,
+                     **req_kwargs):
+        """
+        hammer_it, but returns a future for the result. Same retry rules, minus the blocking.
+        """
+        future = _Future()
+
+        if accept is None:
+            accept = self.response_format
+
+        if file_name is not None and not isinstance(file_name, MultipartEncoder):
+            file_name = MultipartEncoder.for_file(file_name)
+
+        def attempt(tries):
+            limiter = self.limiter
+            slots = self.request_slots
+
+            # limiter first, then the slot, like hammer_it
+            wait = limiter.try_acquire()
+
+            if wait != 0:
+                self._scheduler.call_later(wait or self.slot_poll_interval, lambda: self._submit(attempt, tries))
+                return
+
+            if slots is not None and not slots.acquire(False):
+                limiter.release(unused=True)
+                self._scheduler.call_later(self.slot_poll_interval, lambda: self._submit(attempt, tries))
+                return
+
+            release = functools.partial(self._release_request, limiter, slots)
+            try:
+                result, trying, retry_after = self._try_once(self._request_session(), request_type, url,
+                                                             request_body, content_type, accept, file_name, tries,
+                                                             **req_kwargs)
+            except:
+                release()
+                future.set_exc_info(sys.exc_info())
+                return
+
+            if isinstance(result, _ResponseStream):
+                # like hammer_it, held until the stream's been read
+                result.on_close(release)
+            else:
+                release()
+
+            if trying:
+                log.debug("(try#%d coming up)", tries + 1)
+                self._scheduler.call_later(self._retry_delay(tries + 1, retry_after),
+                                           lambda: self._submit(attempt, tries + 1))
+            else:
+                future.set_result(result)
+
+        self._submit(attempt, 1)
+        return future
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _retry_async(self, fn, args, tries=7):
+        """
+        Runs fn(*args) on the pool up to `tries` times, waiting _retry_delay between goes on the scheduler.
+        """
+        future = _Future()
+
+        def attempt(tries_so_far):
+            try:
+                result = fn(*args)
+            except:
+                if tries_so_far >= tries:
+                    future.set_exc_info(sys.exc_info())
+                else:
+                    self._scheduler.call_later(self._retry_delay(tries_so_far + 1),
+                                               lambda: self._submit(attempt, tries_so_far + 1))
+                return
+
+            future.set_result(result)
+
+        self._submit(attempt, 1)
+        return future
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def create_object(self, qbbo, create_dict, content_type="json"):
+        qbbo = self._validate_object_name(qbbo)
+
+        url = "%s/company/%s/%s" % (self.base_url_v3, self.company_id, qbbo.lower())
+
+        request_body = _compact_json(create_dict)
+
+        return self.hammer_async("POST", url, request_body, content_type).then(
+            lambda response: self._created_object(qbbo, response))
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def read_object(self, qbbo, object_id, content_type="json"):
+        qbbo = self._validate_object_name(qbbo)
+
+        Id = str(object_id).replace(".0", "")
+
+        url = "%s/company/%s/%s/%s" % (self.base_url_v3, self.company_id, qbbo.lower(), Id)
+
+        return self.hammer_async("GET", url, None, content_type).then(
+            lambda response: self._read_result(qbbo, response))
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def update_object(self, qbbo, Id, update_dict, content_type="json", sparse=None):
+        qbbo = self._validate_object_name(qbbo)
+        Id = str(Id).replace(".0", "")
+
+        url = "%s/company/%s/%s" % (self.base_url_v3, self.company_id, qbbo.lower())
+
+        if sparse is None:
+            sparse = self.sparse_updates
+
+        if not sparse:
+            return self.hammer_async("POST", url, _compact_json(update_dict), content_type).then(
+                lambda response: self._updated_object(qbbo, Id, response))
+
+        def attempt(changes, current, tries):
+            if changes is None:
+                future = _Future()
+                future.set_result(current.to_dict() if isinstance(current, Entity) else current)
+                return future
+
+            def updated(response):
+                if not self._stale_update(response) or tries >= self.stale_update_tries:
+                    return self._updated_object(qbbo, Id, response)
+
+                return self.read_object(qbbo, Id).then(
+                    lambda fresh: self._updated_object(qbbo, Id, response) if fresh is None
+                    else attempt(self._sparse_update(Id, changes, fresh), fresh, tries + 1))
+
+            return self.hammer_async("POST", url, _compact_json(changes), content_type).then(updated)
+
+        current = self._cached_copy(qbbo, Id, update_dict)
+        return attempt(self._sparse_update(Id, update_dict, current), current, 1)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def delete_object(self, qbbo, object_id=None, content_type="json", json_dict=None):
+        Id = str(object_id).replace(".0", "")
+
+        def delete(json_dict):
+            if not json_dict or 'Id' not in json_dict:
+                raise Exception("No Id attribute found in %s!" % json_dict)
+
+            url = "%s/company/%s/%s" % (self.base_url_v3, self.company_id, qbbo.lower())
+
+            return self.hammer_async("POST", url, _compact_json(json_dict), content_type,
+                                     params={"operation": "delete"}).then(
+                lambda response: self._deleted_object(qbbo, Id, response))
+
+        if json_dict:
+            return delete(json_dict)
+
+        if not Id:
+            raise Exception("Need either an Id or an existing object dict!")
+
+        return self.read_object(qbbo, Id).then(delete)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def query_objects(self, business_object, params={}, query_tail="", batch_size=500, on_page=None, fields=None,
+                      order_by=None):
+        """
+        Future for the list of matching records.
+        With on_page, each page's records are handed to on_page (in order) as they arrive instead of being
+        collected, and the future resolves to the number of records seen.
+        """
+        query_string = self._query_string(business_object, params, query_tail, fields, order_by)
+        business_object = self._validate_object_name(getattr(business_object, "entity", business_object))
+
+        url = self.base_url_v3 + "/company/%s/query" % self.company_id
+
+        future = _Future()
+        records = []
+        counter = [0]
+
+        def fetch(start_position):
+            payload = "%s STARTPOSITION %d MAXRESULTS %d" % (query_string, start_position, batch_size)
+            self.hammer_async("POST", url, payload, 'text').add_done_callback(
+                lambda page_future: got(page_future, start_position))
+
+        def got(page_future, start_position):
+            try:
+                page = self._page_records(page_future.get(), business_object)
+
+                if on_page is None:
+                    records.extend(page)
+                else:
+                    on_page(page)
+            except:
+                future.set_exc_info(sys.exc_info())
+                return
+
+            counter[0] += len(page)
+
+            if len(page) >= batch_size:
+                fetch(start_position + batch_size)
+            else:
+                future.set_result(records if on_page is None else counter[0])
+
+        fetch(1)
+        return future
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def get_report(self, report_name, params=None, stream=False, shard=None, workers=4, refresh=False):
+        # the whole of QuickBooks.get_report (report_cache, sharding and all), on a thread of its own
+        return _run_in_thread(QuickBooks.get_report, self, report_name, params, stream, shard, workers, refresh)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def upload_file(self, path, name="same", upload_type="automatic", qbbo=None, Id=None):
+        url = "%s/company/%s/upload" % (self.base_url_v3, self.company_id)
+
+        def attachment_id(result):
+            uploaded = self._uploaded_attachable(result)
+            if "Fault" in uploaded:
+                raise Exception("Upload of %s failed: %s" % (path, json.dumps(uploaded["Fault"])))
+            return uploaded["Attachable"]["Id"]
+
+        return self.hammer_async("POST", url, None, "multipart/formdata",
+                                 file_name=self._upload_body(path, name, upload_type, qbbo, Id)).then(attachment_id)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def download_file(self, attachment_id, destination_dir='', alternate_name=None):
+        url = "%s/company/%s/download/%s" % (self.base_url_v3, self.company_id, attachment_id)
+
+        def download(link):
+            return self._retry_async(self._download_link, (link, destination_dir, alternate_name)).then(
+                lambda ignored: link)
+
+        return self.hammer_async("GET", url, None, "json", accept="filelink").then(download)
+
+
+class QuickBooksPool(object):
+    """
+    Clients for many realms (company_ids) in one process. A realm's client is only made the first time it's asked
+    for, with credentials(company_id) (a function, or a dict) supplying its tokens; client_args go to every client
+    (cache_limits, object_store, base_url and so on).
+
+    All the clients share the process's connection pools (and, for AsyncQuickBooks clients, its scheduler), and
+    between them never have more than max_concurrent requests in flight; each realm also keeps to realm_concurrent.
+    Realms not used for idle_timeout seconds, or the least recently used ones beyond max_realms, are evicted along
+    with their session dicts, and made again if they're needed later.
+    """
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def __init__(self, credentials, client_class=QuickBooks, max_concurrent=100,
+                 realm_concurrent=MAX_CONCURRENT_REQUESTS, idle_timeout=900, max_realms=None, **client_args):
+        self.credentials = credentials
+        self.client_class = client_class
+        self.realm_concurrent = realm_concurrent
+        self.idle_timeout = idle_timeout
+        self.max_realms = max_realms
+        self.client_args = client_args
+
+        self.request_slots = threading.BoundedSemaphore(max_concurrent)
+        self.max_concurrent = max_concurrent
+
+        self.created = 0
+        self.evictions = 0
+
+        # {company_id: (client, last used)}, least recently used first
+        self._clients = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def __getitem__(self, company_id):
+        return self.get(company_id)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def __contains__(self, company_id):
+        return str(company_id) in self._clients
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def __len__(self):
+        return len(self._clients)
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def get(self, company_id):
+        """
+        The client for this realm, made (and its credentials loaded) if there isn't one yet
+        """
+        company_id = str(company_id)
+        now = time.time()
+
+        with self._lock:
+            if company_id in self._clients:
+                client = self._clients.pop(company_id)[0]
+            else:
+                client = self._new_client(company_id)
+
+            self._clients[company_id] = (client, now)
+            self._evict_idle(now)
+
+        return client
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _new_client(self, company_id):
+        if callable(self.credentials):
+            credentials = self.credentials(company_id)
+        else:
+            credentials = self.credentials[company_id]
+
+        args = dict(self.client_args)
+        args.update(credentials)
+        args["company_id"] = company_id
+
+        client = self.client_class(**args)
+        client.request_slots = self.request_slots
+        client.limiter.max_concurrent = self.realm_concurrent
+
+        self.created += 1
+        return client
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def evict(self, company_id):
+        """
+        Forgets this realm's client, its session dicts and its session
+        """
+        with self._lock:
+            entry = self._clients.pop(str(company_id), None)
+
+        if entry is None:
+            return False
+
+        client = entry[0]
+        for qbbo in client._BUSINESS_OBJECTS:
+            if hasattr(client, qbbo + "s"):
+                delattr(client, qbbo + "s")
+        client.session = None
+
+        RateLimiter.forget(client.company_id)
+        self.evictions += 1
+        return True
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def evict_idle(self):
+        """
+        Evicts the realms that have been idle too long (or are over max_realms); returns how many went
+        """
+        with self._lock:
+            return self._evict_idle(time.time())
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def _evict_idle(self, now):
+        evicted = 0
+
+        while self._clients:
+            company_id, (client, last_used) = next(self._clients.iteritems())
+
+            too_many = self.max_realms is not None and len(self._clients) > self.max_realms
+            too_idle = self.idle_timeout is not None and now - last_used > self.idle_timeout
+
+            if not (too_many or too_idle):
+                break
+
+            self.evict(company_id)
+            evicted += 1
+
+        return evicted
+
+    #-------------------------------------------------------------------------------------------------------------------
+    def stats(self):
+        with self._lock:
+            realms = len(self._clients)
+
+        return {"realms": realms, "created": self.created, "evictions": self.evictions,
+                "max_concurrent": self.max_concurrent, "realm_concurrent": self.realm_concurrent,
+                "connections": PooledTransport.shared().stats()}
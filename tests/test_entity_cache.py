@@ -0,0 +1,96 @@
+import os, pickle, sys, time, unittest
+
+sys.path[:0] = [os.path.join(os.path.dirname(__file__), "..")]
+
+from quickbooks2 import Customer, EntityCache
+
+
+def customer(Id, name=None):
+    return {"Id": Id, "SyncToken": "0", "DisplayName": name or "Customer %s" % Id,
+            "PrimaryEmailAddr": {"Address": "customer%s@example.com" % Id}}
+
+
+class EntityCacheTest(unittest.TestCase):
+    """
+    EntityCache's limits (LRU by entries or bytes, ttl), indexes and counts
+    """
+
+    def test_least_recently_used_go_first(self):
+        cache = EntityCache(max_entries=2)
+        cache["1"], cache["2"] = customer("1"), customer("2")
+        cache["1"]
+        cache["3"] = customer("3")
+
+        self.assertEqual(sorted(cache), ["1", "3"])
+        self.assertEqual((cache.evictions, cache.intact), (1, False))
+
+    def test_iterating_isnt_using(self):
+        cache = EntityCache(max_entries=2)
+        cache["1"], cache["2"] = customer("1"), customer("2")
+        cache.values()
+        list(cache.iteritems())
+        cache["3"] = customer("3")
+
+        self.assertEqual(sorted(cache), ["2", "3"])
+
+    def test_max_bytes(self):
+        cache = EntityCache(max_bytes=300)
+        for Id in "12345":
+            cache[Id] = customer(Id)
+
+        self.assertTrue(0 < cache.bytes <= 300)
+        self.assertEqual(sorted(cache)[-1], "5")
+        self.assertEqual(cache.evictions, 5 - len(cache))
+
+    def test_ttl(self):
+        cache = EntityCache(ttl=0.05)
+        cache["1"] = customer("1")
+        self.assertIn("1", cache)
+
+        time.sleep(0.1)
+        cache["2"] = customer("2")
+
+        self.assertEqual(list(cache), ["2"])
+        self.assertEqual(cache.get("1"), None)
+        self.assertEqual((cache.expirations, cache.intact), (1, False))
+
+    def test_counts(self):
+        cache = EntityCache()
+        cache["1"] = customer("1")
+        cache.get("1")
+        cache.get("2")
+
+        self.assertEqual(cache.stats(), {"entries": 1, "bytes": 0, "hits": 1, "misses": 1, "evictions": 0,
+                                         "expirations": 0})
+
+    def test_index(self):
+        cache = EntityCache()
+        cache.add_index("PrimaryEmailAddr.Address")
+        cache["1"], cache["2"] = customer("1"), customer("2")
+        cache["1"] = dict(customer("1"), PrimaryEmailAddr={"Address": "New@Example.com"})
+        del cache["2"]
+
+        self.assertEqual([c["Id"] for c in cache.find("PrimaryEmailAddr.Address", "new@example.com")], ["1"])
+        self.assertEqual(cache.find("PrimaryEmailAddr.Address", "customer1@example.com"), [])
+        self.assertEqual(cache.find("PrimaryEmailAddr.Address", "customer2@example.com"), [])
+
+    def test_entity_class(self):
+        cache = EntityCache(entity_class=Customer)
+        cache["1"] = customer("1")
+
+        self.assertIsInstance(cache["1"], Customer)
+        self.assertEqual(cache["1"].to_dict(), customer("1"))
+
+    def test_pickle(self):
+        cache = EntityCache(max_entries=5, ttl=60)
+        cache.add_index("DisplayName")
+        cache["1"] = customer("1", "Amy")
+
+        copy = pickle.loads(pickle.dumps(cache))
+
+        self.assertEqual((copy.max_entries, copy.ttl, copy.items()), (5, 60, cache.items()))
+        self.assertEqual([c["Id"] for c in copy.find("DisplayName", "amy")], ["1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import os, sys, unittest
+
+sys.path[:0] = [os.path.join(os.path.dirname(__file__), ".."),
+                os.path.join(os.path.dirname(__file__), "..", "benchmarks")]
+
+import quickbooks2
+import fake_qbo
+
+
+class ExistingIdsTest(unittest.TestCase):
+    """
+    existing_ids against the fake QBO server, with and without a fresh session dict to answer from
+    """
+
+    def setUp(self):
+        self.fake = fake_qbo.FakeQBO(latency=0)
+        url = self.fake.start()
+        self.fake.populate(customers=20, items=1, accounts=1, invoices=5, attachments=0)
+
+        self.qb = quickbooks2.QuickBooks(base_url=url, company_id="1", consumer_key="test", consumer_secret="test",
+                                         access_token="test", access_token_secret="test", report_cache=None)
+
+        self.invoices = sorted(self.fake.data["Invoice"].values(), key=lambda invoice: invoice["DocNumber"])
+        self.customers = sorted(self.fake.data["Customer"].values(), key=lambda customer: customer["DisplayName"])
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def expected(self, objects, field):
+        return dict((obj[field], obj["Id"]) for obj in objects[:2])
+
+    def test_unindexed_field_without_cache(self):
+        numbers = [invoice["DocNumber"] for invoice in self.invoices[:2]] + ["no such number"]
+
+        self.assertEqual(self.qb.existing_ids("Invoice", "DocNumber", numbers),
+                         self.expected(self.invoices, "DocNumber"))
+
+    def test_unindexed_field_with_fresh_cache(self):
+        self.qb.get_objects("Invoice")
+        self.qb.get_objects("Customer")
+
+        numbers = [invoice["DocNumber"] for invoice in self.invoices[:2]] + ["no such number"]
+        names = [customer["CompanyName"] for customer in self.customers[:2]] + ["no such company"]
+
+        self.assertEqual(self.qb.existing_ids("Invoice", "DocNumber", numbers),
+                         self.expected(self.invoices, "DocNumber"))
+        self.assertEqual(self.qb.existing_ids("Customer", "CompanyName", names),
+                         self.expected(self.customers, "CompanyName"))
+
+    def test_indexed_field_with_fresh_cache(self):
+        self.qb.get_objects("Customer")
+        requests = []
+        self.qb.post_request_hooks.append(requests.append)
+
+        names = [customer["DisplayName"] for customer in self.customers[:2]] + ["no such customer"]
+
+        self.assertEqual(self.qb.existing_ids("Customer", "DisplayName", names),
+                         self.expected(self.customers, "DisplayName"))
+        self.assertEqual(requests, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import cgi, io, json, os, shutil, sys, tempfile, unittest
+
+sys.path[:0] = [os.path.join(os.path.dirname(__file__), "..")]
+
+import quickbooks2
+
+
+def parts_of(encoder):
+    body = encoder.read()
+    form = cgi.FieldStorage(io.BytesIO(body), environ={"REQUEST_METHOD": "POST", "CONTENT_TYPE": encoder.content_type,
+                                                       "CONTENT_LENGTH": str(len(body))})
+    return body, dict((name, (form[name].filename, form[name].type, form[name].value)) for name in form)
+
+
+class MultipartEncoderTest(unittest.TestCase):
+    """
+    MultipartEncoder's body, read in one go or in chunks, from each kind of source
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "receipt.pdf")
+        with open(self.path, "wb") as f:
+            f.write("%PDF-1.4 " * 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_sources(self):
+        metadata = json.dumps({"FileName": "notes.txt"})
+        encoder = quickbooks2.MultipartEncoder([
+            ("file_metadata_0", None, "application/json", quickbooks2.FileData(metadata)),
+            ("file_content_0", "receipt.pdf", None, self.path),
+            ("file_content_1", "data.bin", None, bytearray("\x00\x01\x02")),
+            ("file_content_2", "notes.txt", None, io.BytesIO("notes\r\n--not a boundary")),
+        ])
+
+        body, parts = parts_of(encoder)
+
+        self.assertEqual(len(body), len(encoder))
+        self.assertEqual(parts["file_metadata_0"], (None, "application/json", metadata))
+        self.assertEqual(parts["file_content_0"], ("receipt.pdf", "application/pdf", "%PDF-1.4 " * 1000))
+        self.assertEqual(parts["file_content_1"], ("data.bin", "application/octet-stream", "\x00\x01\x02"))
+        self.assertEqual(parts["file_content_2"], ("notes.txt", "text/plain", "notes\r\n--not a boundary"))
+
+    def test_chunks_and_rewind(self):
+        encoder = quickbooks2.MultipartEncoder.for_file(self.path)
+        encoder.chunk_size = 100
+
+        whole = encoder.read()
+        encoder.rewind()
+        pieces = []
+        while True:
+            piece = encoder.read(7)
+            if not piece:
+                break
+            pieces.append(piece)
+
+        self.assertEqual("".join(pieces), whole)
+        encoder.rewind()
+        self.assertEqual("".join(encoder), whole)
+        self.assertEqual(len(whole), len(encoder))
+
+    def test_file_like_from_its_position(self):
+        source = io.BytesIO("skip this|upload this")
+        source.seek(10)
+
+        body, parts = parts_of(quickbooks2.MultipartEncoder.for_file(source, filename="part.txt"))
+
+        self.assertEqual(parts["file_content_0"], ("part.txt", "text/plain", "upload this"))
+
+    def test_missing_path(self):
+        self.assertRaises(IOError, quickbooks2.MultipartEncoder.for_file, os.path.join(self.directory, "missing"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import os, shutil, sys, tempfile, unittest
+
+sys.path[:0] = [os.path.join(os.path.dirname(__file__), ".."),
+                os.path.join(os.path.dirname(__file__), "..", "benchmarks")]
+
+import quickbooks2
+import fake_qbo
+
+
+class NamesSyncTest(unittest.TestCase):
+    """
+    names() pulls whole name lists (inactive ones too), so they get synced, answer is_object locally and
+    warm-start from an object store
+    """
+
+    def setUp(self):
+        self.fake = fake_qbo.FakeQBO(latency=0)
+        self.url = self.fake.start()
+        self.fake.populate(customers=5, items=2, accounts=2)
+        # one of every other name list type, so each one has something to sync from
+        for qbbo in quickbooks2.QuickBooks._NAME_LIST_OBJECTS:
+            if not self.fake.data[qbbo]:
+                self.fake.add(qbbo, {"Name": "%s 1" % qbbo, "Active": True})
+
+        self.directory = tempfile.mkdtemp()
+        self.store_path = os.path.join(self.directory, "objects.db")
+
+    def tearDown(self):
+        self.fake.stop()
+        shutil.rmtree(self.directory)
+
+    def client(self, **args):
+        qb = quickbooks2.QuickBooks(base_url=self.url, company_id="1", consumer_key="test", consumer_secret="test",
+                                    access_token="test", access_token_secret="test", report_cache=None, **args)
+        requests = []
+        qb.post_request_hooks.append(requests.append)
+        return qb, requests
+
+    def test_names_are_synced(self):
+        qb, requests = self.client()
+        qb.names()
+
+        self.assertIn("Customer", qb._sync_marks)
+
+        name = self.fake.data["Customer"].values()[0]["DisplayName"]
+        del requests[:]
+        self.assertEqual(len(qb.is_object("Customer", "WHERE DisplayName = '%s'" % name, use_cache=True)), 1)
+        self.assertEqual(requests, [])
+
+    def test_incremental_names(self):
+        qb, requests = self.client()
+        qb.names()
+
+        customer = dict(self.fake.data["Customer"].values()[0], DisplayName="Renamed")
+        self.fake.write("Customer", customer)
+
+        del requests[:]
+        names = qb.names(requery=True, incremental=True)
+
+        self.assertEqual(names["Customer"][customer["Id"]]["DisplayName"], "Renamed")
+        self.assertTrue(requests)
+        self.assertEqual([request for request in requests if request["operation"] != "cdc"], [])
+
+    def test_warm_start_through_names(self):
+        qb, requests = self.client(object_store=self.store_path)
+        qb.names()
+
+        customer = dict(self.fake.data["Customer"].values()[0], DisplayName="Renamed")
+        self.fake.write("Customer", customer)
+
+        qb, requests = self.client(object_store=self.store_path)
+        names = qb.names()
+
+        self.assertEqual(len(names["Customer"]), 5)
+        self.assertEqual(names["Customer"][customer["Id"]]["DisplayName"], "Renamed")
+        # just the CDC requests that bring the restored lists up to date, no queries
+        self.assertTrue(requests)
+        self.assertEqual([request for request in requests if request["operation"] != "cdc"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import datetime, os, sys, unittest
+
+sys.path[:0] = [os.path.join(os.path.dirname(__file__), "..")]
+
+from quickbooks2 import Query
+
+
+class QueryTest(unittest.TestCase):
+    """
+    Query's statements: literals quoted and escaped, field names checked
+    """
+
+    def test_literals(self):
+        self.assertEqual(Query.literal("O'Brien"), "'O\\'Brien'")
+        self.assertEqual(Query.literal("C:\\temp"), "'C:\\\\temp'")
+        self.assertEqual(Query.literal("back\\'slash"), "'back\\\\\\'slash'")
+        self.assertEqual(Query.literal(u"Café"), u"'Café'")
+        self.assertEqual(Query.literal(True), "true")
+        self.assertEqual(Query.literal(False), "false")
+        self.assertEqual(Query.literal(12), "12")
+        self.assertEqual(Query.literal(2.5), "2.5")
+        self.assertEqual(Query.literal(datetime.date(2026, 1, 31)), "'2026-01-31'")
+        self.assertEqual(Query.literal(datetime.datetime(2026, 1, 31, 8, 30)), "'2026-01-31T08:30:00'")
+
+    def test_statement(self):
+        query = Query("Customer", ["Id", "DisplayName"]).where("Active", "=", True) \
+            .where("DisplayName", "like", "O'B%").where_in("Id", ["1", "2"]).order_by("DisplayName", descending=True)
+
+        self.assertEqual(str(query), "SELECT Id, DisplayName FROM Customer WHERE Active = true AND "
+                                     "DisplayName LIKE 'O\\'B%' AND Id IN ('1','2') ORDERBY DisplayName DESC")
+
+    def test_select_all(self):
+        self.assertEqual(str(Query("Invoice").where("MetaData.LastUpdatedTime", ">", "2026-01-01")),
+                         "SELECT * FROM Invoice WHERE MetaData.LastUpdatedTime > '2026-01-01'")
+
+    def test_fields_are_checked(self):
+        self.assertRaises(ValueError, Query, "Customer", ["Nmae"])
+        self.assertRaises(ValueError, Query, "Customer", ["BillAddr.City"])
+        self.assertRaises(ValueError, Query("Customer").where, "DisplayName = 'x' OR 1", "=", 1)
+        self.assertRaises(ValueError, Query("Customer").where, "DisplayName", "!=", "x")
+        self.assertRaises(ValueError, Query("Customer").where_in, "Id", [])
+
+        # entities SCHEMA doesn't know only need well-formed names
+        self.assertEqual(str(Query("Budget", ["Whatever"])), "SELECT Whatever FROM Budget")
+
+
+if __name__ == "__main__":
+    unittest.main()
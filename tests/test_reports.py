@@ -0,0 +1,106 @@
+import datetime, os, sys, unittest
+
+sys.path[:0] = [os.path.join(os.path.dirname(__file__), ".."),
+                os.path.join(os.path.dirname(__file__), "..", "benchmarks")]
+
+import quickbooks2
+import fake_qbo
+
+
+def row(*values):
+    return {"type": "Data", "ColData": [{"value": value} for value in values]}
+
+
+def section(group, rows, total):
+    return {"type": "Section", "group": group, "Header": {"ColData": [{"value": group}]}, "Rows": {"Row": rows},
+            "Summary": {"ColData": [{"value": "Total " + group}] + [{"value": value} for value in total]}}
+
+
+def report(start, end, rows, columns):
+    return {"Header": {"Time": "%sT00:00:00-07:00" % end, "ReportName": "Test", "StartPeriod": start,
+                       "EndPeriod": end, "Option": [{"Name": "NoReportData", "Value": "false"}]},
+            "Columns": {"Column": [{"ColTitle": title, "ColType": col_type} for title, col_type in columns]},
+            "Rows": {"Row": rows}}
+
+
+class ReportShardingTest(unittest.TestCase):
+    """
+    Sharded reports: the windows asked for, and how the windows' reports are merged
+    """
+
+    def setUp(self):
+        self.fake = fake_qbo.FakeQBO(latency=0)
+        url = self.fake.start()
+        self.fake.populate(accounts=6)
+
+        self.qb = quickbooks2.QuickBooks(base_url=url, company_id="1", consumer_key="test", consumer_secret="test",
+                                         access_token="test", access_token_secret="test", report_cache=None)
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def test_windows(self):
+        date = datetime.date
+
+        self.assertEqual(self.qb._report_windows(date(2026, 1, 15), date(2026, 3, 10), "month"),
+                         [(date(2026, 1, 15), date(2026, 1, 31)), (date(2026, 2, 1), date(2026, 2, 28)),
+                          (date(2026, 3, 1), date(2026, 3, 10))])
+        self.assertEqual(self.qb._report_windows(date(2025, 11, 1), date(2026, 4, 30), "quarter"),
+                         [(date(2025, 11, 1), date(2025, 12, 31)), (date(2026, 1, 1), date(2026, 3, 31)),
+                          (date(2026, 4, 1), date(2026, 4, 30))])
+        self.assertRaises(ValueError, self.qb._report_windows, date(2026, 1, 1), date(2026, 2, 1), "week")
+
+    def test_sharded_like_whole(self):
+        params = {"start_date": "2026-01-01", "end_date": "2026-06-30"}
+
+        whole = self.qb.get_report("ProfitAndLoss", params)
+        sharded = self.qb.get_report("ProfitAndLoss", params, shard="month")
+
+        self.assertEqual(sharded["Rows"], whole["Rows"])
+        self.assertEqual((sharded["Header"]["StartPeriod"], sharded["Header"]["EndPeriod"]),
+                         ("2026-01-01", "2026-06-30"))
+
+    def test_unshardable(self):
+        self.assertRaises(ValueError, self.qb.get_report, "ProfitAndLoss", {"start_date": "2026-01-01"},
+                          shard="month")
+        self.assertRaises(ValueError, self.qb.get_report, "ProfitAndLoss",
+                          {"start_date": "2026-01-01", "end_date": "2026-06-30", "summarize_column_by": "Month"},
+                          shard="month")
+
+    def test_summary_merge(self):
+        columns = [("", "Account"), ("Total", "Money"), ("% of Income", "Money")]
+        january = report("2026-01-01", "2026-01-31",
+                         [section("Income", [row("Sales", "10.00", "50.0"), row("Fees", "10.00", "50.0")],
+                                  ["20.00", "100.0"])], columns)
+        february = report("2026-02-01", "2026-02-28",
+                          [section("Income", [row("Sales", "5.50", "100.0")], ["5.50", "100.0"])], columns)
+
+        merged = self.qb._merged_report([january, february])
+
+        self.assertEqual(merged["Rows"]["Row"],
+                         [section("Income", [row("Sales", "15.50", ""), row("Fees", "10.00", "")], ["25.50", ""])])
+        self.assertEqual((merged["Header"]["StartPeriod"], merged["Header"]["EndPeriod"]),
+                         ("2026-01-01", "2026-02-28"))
+
+    def test_detail_merge(self):
+        columns = [("Date", "tx_date"), ("Num", "doc_num"), ("Amount", "subt_nat_amount"),
+                   ("Balance", "rbal_nat_amount")]
+        january = report("2026-01-01", "2026-01-31",
+                         [section("Checking", [row("Beginning Balance", "", "", "100.00"),
+                                               row("2026-01-05", "1", "10.00", "110.00")], ["", "10.00", "110.00"])],
+                         columns)
+        february = report("2026-02-01", "2026-02-28",
+                          [section("Checking", [row("Beginning Balance", "", "", "110.00"),
+                                                row("2026-02-07", "2", "-5.00", "105.00")], ["", "-5.00", "105.00"])],
+                          columns)
+
+        merged = self.qb._merged_report([january, february])
+
+        self.assertEqual(merged["Rows"]["Row"],
+                         [section("Checking", [row("Beginning Balance", "", "", "100.00"),
+                                               row("2026-01-05", "1", "10.00", "110.00"),
+                                               row("2026-02-07", "2", "-5.00", "105.00")], ["", "5.00", "105.00"])])
+
+
+if __name__ == "__main__":
+    unittest.main()
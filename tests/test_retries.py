@@ -0,0 +1,59 @@
+import os, sys, unittest
+
+sys.path[:0] = [os.path.join(os.path.dirname(__file__), ".."),
+                os.path.join(os.path.dirname(__file__), "..", "benchmarks")]
+
+import requests
+import quickbooks2
+import fake_qbo
+
+
+class RetryTest(unittest.TestCase):
+    """
+    What hammer_it tries again, whatever the body of the response is, and what it gives up on
+    """
+
+    def setUp(self):
+        self.fake = fake_qbo.FakeQBO(latency=0)
+        url = self.fake.start()
+        self.fake.populate(customers=1)
+
+        self.qb = quickbooks2.QuickBooks(base_url=url, company_id="1", consumer_key="test", consumer_secret="test",
+                                         access_token="test", access_token_secret="test", report_cache=None)
+        self.qb.backoff_base = self.qb.backoff_max = 0.01
+        self.qb.max_tries = 3
+
+        self.Id = self.fake.data["Customer"].keys()[0]
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def test_text_and_html_errors_are_retried(self):
+        self.fake.canned = [(503, "text/plain", "Service Unavailable"),
+                            (429, "text/html", "<html><body>Too Many Requests</body></html>")]
+
+        self.assertEqual(self.qb.read_object("Customer", self.Id)["Id"], self.Id)
+        self.assertEqual(self.fake.canned, [])
+
+    def test_dropped_connections_are_retried(self):
+        self.fake.canned = [None, None]
+
+        self.assertEqual(self.qb.read_object("Customer", self.Id)["Id"], self.Id)
+        self.assertEqual(self.fake.counts.get("dropped"), 2)
+
+    def test_gives_up_after_max_tries(self):
+        self.fake.canned = [None] * 3
+
+        self.assertRaises(requests.ConnectionError, self.qb.read_object, "Customer", self.Id)
+
+    def test_unparseable_response(self):
+        self.fake.canned = [(200, "text/csv", "Id,Name")]
+
+        with self.assertRaises(quickbooks2.ResponseError) as raised:
+            self.qb.read_object("Customer", self.Id)
+
+        self.assertEqual((raised.exception.status_code, raised.exception.body), (200, "Id,Name"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import copy, os, sys, unittest
+
+sys.path[:0] = [os.path.join(os.path.dirname(__file__), ".."),
+                os.path.join(os.path.dirname(__file__), "..", "benchmarks")]
+
+import quickbooks2
+import fake_qbo
+
+
+class SparseUpdateTest(unittest.TestCase):
+    """
+    Sparse updates send only what's been changed from the session's copy, and are reapplied to a fresh read of
+    an object someone else has changed in the meantime (QB's "Stale Object Error", 5010)
+    """
+
+    def setUp(self):
+        self.fake = fake_qbo.FakeQBO(latency=0)
+        url = self.fake.start()
+        self.fake.populate(customers=2)
+
+        self.qb = quickbooks2.QuickBooks(base_url=url, company_id="1", consumer_key="test", consumer_secret="test",
+                                         access_token="test", access_token_secret="test", report_cache=None,
+                                         sparse_updates=True)
+        self.qb.get_objects("Customer")
+
+        self.Id = sorted(self.fake.data["Customer"])[0]
+        self.requests = []
+        self.qb.post_request_hooks.append(lambda event: self.requests.append((event["operation"], event["status"])))
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def someone_else_sets(self, **changes):
+        self.fake.write("Customer", dict(self.fake.data["Customer"][self.Id], **changes))
+
+    def test_diff(self):
+        cached = self.qb.Customers[self.Id]
+        edited = copy.deepcopy(cached)
+        edited.update(GivenName="Changed", BillAddr=dict(cached["BillAddr"], City="Shelbyville"))
+
+        self.assertEqual(self.qb._sparse_update(self.Id, edited, cached),
+                         {"Id": self.Id, "SyncToken": cached["SyncToken"], "sparse": True, "GivenName": "Changed",
+                          "BillAddr": edited["BillAddr"]})
+        self.assertEqual(self.qb._sparse_update(self.Id, copy.deepcopy(cached), cached), None)
+
+    def test_nested_edit_in_place(self):
+        # a shallow copy shares BillAddr with the session's copy, so editing it edits both: there's no telling
+        # what's changed in what's shared, so all of it is sent
+        edited = dict(self.qb.Customers[self.Id])
+        edited["BillAddr"]["City"] = "Shelbyville"
+
+        changes = self.qb._sparse_update(self.Id, edited, self.qb.Customers[self.Id])
+
+        self.assertEqual(changes["BillAddr"]["City"], "Shelbyville")
+        self.assertIn("PrimaryEmailAddr", changes)
+        self.assertNotIn("GivenName", changes)
+
+    def test_only_changes_are_sent(self):
+        edited = dict(self.qb.Customers[self.Id], GivenName="Changed")
+        # (without bumping the SyncToken, so the update isn't stale)
+        self.fake.data["Customer"][self.Id]["FamilyName"] = "Someone else's"
+
+        updated = self.qb.update_object("Customer", self.Id, edited)
+
+        self.assertEqual((updated["GivenName"], updated["FamilyName"]), ("Changed", "Someone else's"))
+        self.assertEqual(self.requests, [("write", 200)])
+
+    def test_nothing_to_send(self):
+        self.assertEqual(self.qb.update_object("Customer", self.Id, copy.deepcopy(self.qb.Customers[self.Id])),
+                         self.qb.Customers[self.Id])
+        self.assertEqual(self.requests, [])
+
+    def test_stale_update_is_reapplied(self):
+        edited = dict(self.qb.Customers[self.Id], GivenName="Changed")
+        self.someone_else_sets(FamilyName="Someone else's")
+
+        updated = self.qb.update_object("Customer", self.Id, edited)
+
+        self.assertEqual((updated["GivenName"], updated["FamilyName"]), ("Changed", "Someone else's"))
+        self.assertEqual(updated["SyncToken"], "2")
+        self.assertEqual(self.requests, [("write", 400), ("read", 200), ("write", 200)])
+
+    def test_stale_update_tries(self):
+        self.qb.stale_update_tries = 1
+        edited = dict(self.qb.Customers[self.Id], GivenName="Changed")
+        self.someone_else_sets(FamilyName="Someone else's")
+
+        self.assertEqual(self.qb.update_object("Customer", self.Id, edited), None)
+        self.assertEqual(self.fake.data["Customer"][self.Id]["GivenName"], self.qb.Customers[self.Id]["GivenName"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import json, os, sys, unittest
+
+sys.path[:0] = [os.path.join(os.path.dirname(__file__), ".."),
+                os.path.join(os.path.dirname(__file__), "..", "benchmarks")]
+
+import quickbooks2
+import fake_qbo
+
+
+DOCUMENT = {"QueryResponse": {"startPosition": 1, "maxResults": 3,
+                               "Invoice": [{"Id": "1", "DocNumber": "a \\\"quoted\\\" [name] {x}", "TotalAmt": 12.5,
+                                            "Line": [{"Amount": 12.5}, {"Amount": 0}], "sparse": False},
+                                           {"Id": "2", "DocNumber": u"caf\u00e9", "TotalAmt": -3, "Line": [],
+                                            "CustomerRef": None},
+                                           {"Id": "3", "DocNumber": "", "TotalAmt": 1e3, "Line": [{}]}]},
+            "time": "2026-10-01T10:00:00.000-07:00"}
+
+
+def chunked(text, size):
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+
+class JsonStreamTest(unittest.TestCase):
+    """
+    JsonStream gives the same items and document however the text is split into chunks
+    """
+
+    def test_any_chunking(self):
+        text = json.dumps(DOCUMENT, indent=1)
+
+        for size in (1, 2, 3, 7, 64, len(text)):
+            stream = quickbooks2.JsonStream(chunked(text, size), "QueryResponse.Invoice")
+
+            self.assertEqual(list(stream), DOCUMENT["QueryResponse"]["Invoice"])
+            self.assertEqual(stream.count, 3)
+            self.assertEqual(stream.document, {"QueryResponse": {"startPosition": 1, "maxResults": 3, "Invoice": []},
+                                               "time": DOCUMENT["time"]})
+
+    def test_no_such_array(self):
+        stream = quickbooks2.JsonStream([json.dumps({"QueryResponse": {}})], "QueryResponse.Invoice")
+
+        self.assertEqual(list(stream), [])
+        self.assertEqual(stream.document, {"QueryResponse": {}})
+
+    def test_fault(self):
+        fault = {"Fault": {"Error": [{"Message": "message", "code": "500"}], "type": "SystemFault"}}
+        stream = quickbooks2.JsonStream([json.dumps(fault)], "QueryResponse.Invoice")
+
+        self.assertEqual(list(stream), [])
+        self.assertEqual(stream.document, fault)
+
+    def test_response_closed_at_the_end(self):
+        response = ClosableResponse()
+        stream = quickbooks2.JsonStream([json.dumps(DOCUMENT)], "QueryResponse.Invoice", response=response)
+
+        items = iter(stream)
+        next(items)
+        self.assertFalse(response.closed)
+
+        list(items)
+        self.assertTrue(response.closed)
+
+
+class ClosableResponse(object):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class StreamedResponseTest(unittest.TestCase):
+    """
+    A streamed response keeps its request's place in the realm's limits until it's been read or closed
+    """
+
+    def setUp(self):
+        self.fake = fake_qbo.FakeQBO(latency=0)
+        url = self.fake.start()
+        self.fake.populate(customers=30)
+
+        self.qb = quickbooks2.QuickBooks(base_url=url, company_id="streamed", consumer_key="test",
+                                         consumer_secret="test", access_token="test", access_token_secret="test",
+                                         report_cache=None)
+        self.url = self.qb.base_url_v3 + "/company/streamed/query"
+
+    def tearDown(self):
+        self.fake.stop()
+        quickbooks2.RateLimiter.forget("streamed")
+
+    def stream(self):
+        return self.qb.hammer_it("POST", self.url, "SELECT * FROM Customer", "text",
+                                 stream_path="QueryResponse.Customer")
+
+    def test_held_until_read(self):
+        stream = self.stream()
+        self.assertEqual(self.qb.limiter.in_flight, 1)
+
+        self.assertEqual(len(list(stream)), 30)
+        self.assertEqual(self.qb.limiter.in_flight, 0)
+
+    def test_held_until_closed(self):
+        with self.stream() as stream:
+            next(iter(stream))
+            self.assertEqual(self.qb.limiter.in_flight, 1)
+
+        self.assertEqual(self.qb.limiter.in_flight, 0)
+
+        stream.close()
+        self.assertEqual(self.qb.limiter.in_flight, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
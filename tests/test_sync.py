@@ -0,0 +1,70 @@
+import os, sys, unittest
+
+sys.path[:0] = [os.path.join(os.path.dirname(__file__), ".."),
+                os.path.join(os.path.dirname(__file__), "..", "benchmarks")]
+
+import quickbooks2
+import fake_qbo
+
+
+class SyncTest(unittest.TestCase):
+    """
+    sync_objects merges what CDC says has changed (or been deleted) into the session dicts
+    """
+
+    def setUp(self):
+        self.fake = fake_qbo.FakeQBO(latency=0)
+        url = self.fake.start()
+        self.fake.populate(customers=5, invoices=3)
+
+        self.qb = quickbooks2.QuickBooks(base_url=url, company_id="1", consumer_key="test", consumer_secret="test",
+                                         access_token="test", access_token_secret="test", report_cache=None)
+        self.qb.get_objects("Customer")
+        self.qb.get_objects("Invoice")
+
+        self.operations = []
+        self.qb.post_request_hooks.append(lambda event: self.operations.append(event["operation"]))
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def change_things(self):
+        customer = sorted(self.fake.data["Customer"])[0]
+        self.fake.write("Customer", dict(self.fake.data["Customer"][customer], GivenName="Changed"))
+        self.fake.write("Customer", {"DisplayName": "New customer", "Active": True})
+        self.fake.write("Invoice", {"Id": sorted(self.fake.data["Invoice"])[0]}, operation="delete")
+
+    def assertInSync(self):
+        for qbbo in ("Customer", "Invoice"):
+            self.assertEqual(dict(getattr(self.qb, qbbo + "s").items()), self.fake.data[qbbo])
+
+    def test_merge(self):
+        self.change_things()
+
+        self.qb.sync_objects()
+
+        self.assertInSync()
+        self.assertEqual(self.operations, ["cdc"])
+
+    def test_filtered_list_is_requeried(self):
+        self.qb.get_objects("Customer", requery=True, query_tail="WHERE Active = true")
+        self.change_things()
+        del self.operations[:]
+
+        self.qb.sync_objects()
+
+        self.assertInSync()
+        self.assertEqual(sorted(self.operations), ["cdc", "query"])
+
+    def test_more_changes_than_cdc_returns(self):
+        self.qb._cdc_max_results = 2
+        self.change_things()
+
+        self.qb.sync_objects(["Customer"])
+
+        self.assertEqual(dict(self.qb.Customers.items()), self.fake.data["Customer"])
+        self.assertEqual(self.operations, ["cdc", "query"])
+
+
+if __name__ == "__main__":
+    unittest.main()
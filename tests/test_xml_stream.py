@@ -0,0 +1,90 @@
+import json, os, sys, time, unittest
+
+sys.path[:0] = [os.path.join(os.path.dirname(__file__), ".."),
+                os.path.join(os.path.dirname(__file__), "..", "benchmarks")]
+
+import quickbooks2
+import fake_qbo
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return f.read()
+
+
+class XmlStreamTest(unittest.TestCase):
+    """
+    XmlStream turns QBO's XML into what the JSON API sends: each fixtures/*.xml parses to its *.json
+    """
+
+    def assertParsesLikeJson(self, name):
+        self.assertEqual(quickbooks2.XmlStream(fixture(name + ".xml")).parse(), json.loads(fixture(name + ".json")))
+
+    def test_cdc(self):
+        self.assertParsesLikeJson("cdc")
+
+    def test_query(self):
+        self.assertParsesLikeJson("invoice_query")
+
+    def test_read(self):
+        self.assertParsesLikeJson("item_read")
+
+    def test_upload(self):
+        self.assertParsesLikeJson("upload")
+
+    def test_fault(self):
+        self.assertParsesLikeJson("stale_fault")
+
+    def test_report(self):
+        self.assertParsesLikeJson("report")
+
+    def test_stream_path(self):
+        stream = quickbooks2.XmlStream(fixture("invoice_query.xml"), "QueryResponse.Invoice")
+        expected = json.loads(fixture("invoice_query.json"))
+
+        self.assertEqual(list(stream), expected["QueryResponse"]["Invoice"])
+        self.assertEqual(stream.count, 1)
+        self.assertEqual(stream.document["QueryResponse"], {"Invoice": [], "startPosition": 1, "maxResults": 1})
+
+
+class XmlResponseTest(unittest.TestCase):
+    """
+    A client asking for XML gets the same as one asking for JSON, from the fake QBO server
+    """
+
+    def setUp(self):
+        self.fake = fake_qbo.FakeQBO(latency=0)
+        url = self.fake.start()
+        self.fake.populate(customers=3, items=2, accounts=2, invoices=2)
+
+        self.json, self.xml = [quickbooks2.QuickBooks(base_url=url, company_id="1", consumer_key="test",
+                                                      consumer_secret="test", access_token="test",
+                                                      access_token_secret="test", report_cache=None,
+                                                      response_format=response_format)
+                               for response_format in ("json", "xml")]
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def test_query(self):
+        for qbbo in ("Customer", "Item", "Account", "Invoice"):
+            self.assertEqual(self.xml.query_objects(qbbo), self.json.query_objects(qbbo))
+
+    def test_one_of_each_in_cdc(self):
+        since = max(obj["MetaData"]["LastUpdatedTime"] for objects in self.fake.data.values()
+                    for obj in objects.values())
+        time.sleep(0.01)
+
+        Id = self.fake.data["Customer"].keys()[0]
+        self.fake.write("Customer", dict(self.fake.data["Customer"][Id], GivenName="Changed"))
+
+        changed = self.xml.changed_objects(["Customer", "Invoice"], since)[0]
+
+        self.assertEqual(changed, self.json.changed_objects(["Customer", "Invoice"], since)[0])
+        self.assertEqual([customer["Id"] for customer in changed["Customer"]], [Id])
+
+
+if __name__ == "__main__":
+    unittest.main()